@@ -1,7 +1,12 @@
 # admin.py
 from django.contrib import admin
-from .models import Task, TrelloMember, detail_of_everyday
+from .models import GeneratedContent, OutboundEmail, Task, TaskEscalation, TrelloMember, TrelloOutbox, TrelloSyncState, detail_of_everyday
 
 admin.site.register(Task)
 admin.site.register(TrelloMember)
-admin.site.register(detail_of_everyday)
\ No newline at end of file
+admin.site.register(detail_of_everyday)
+admin.site.register(TrelloSyncState)
+admin.site.register(OutboundEmail)
+admin.site.register(GeneratedContent)
+admin.site.register(TaskEscalation)
+admin.site.register(TrelloOutbox)
\ No newline at end of file
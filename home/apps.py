@@ -1,6 +1,30 @@
+import logging
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _register_trello_webhook():
+    from .tasks import ensure_trello_webhook
+
+    try:
+        ensure_trello_webhook()
+    except Exception:
+        logger.exception("Failed to check Trello webhook registration")
 
 
 class HomeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'home'
+
+    def ready(self):
+        from . import metrics, scheduler, search_index  # noqa: F401 connects their signal handlers
+
+        metrics.connect_background_task_signals()
+
+        # Off the startup path so a slow Trello doesn't delay the worker boot
+        if settings.TRELLO_WEBHOOK_AUTO_REGISTER:
+            threading.Thread(target=_register_trello_webhook, daemon=True).start()
@@ -0,0 +1,233 @@
+# llm.py
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+from openai import OpenAI
+
+from .metrics import track_outbound
+from .models import GeneratedContent
+
+logger = logging.getLogger(__name__)
+
+client = OpenAI(api_key=settings.OPENAI_API_KEY)
+
+MODEL = "gpt-3.5-turbo"
+SYSTEM_PROMPT = "You are a helpful management assistant, and you name is 'Douze-bot'."
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    if value is None or isinstance(value, (int, float, bool)):
+        return value
+    return str(value)
+
+
+def content_key(kind, role, fields):
+    """Stable hash of the template kind, recipient role and the task fields the prompt uses."""
+    payload = {
+        'kind': kind,
+        'role': role,
+        'model': MODEL,
+        'fields': {name: _normalize(value) for name, value in fields.items()},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def complete(prompt, max_tokens=None):
+    with track_outbound('openai', 'chat.completions'):
+        response = client.chat.completions.create(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=max_tokens or settings.LLM_EMAIL_MAX_TOKENS
+        )
+    return response
+
+
+def generate_cached(kind, role, fields, prompt, max_tokens=None):
+    """Return the email body for this prompt, reusing stored output for identical inputs."""
+    key = content_key(kind, role, fields)
+    now = timezone.now()
+    cached = GeneratedContent.objects.filter(key=key).filter(
+        Q(expires_at__isnull=True) | Q(expires_at__gt=now)
+    ).values_list('pk', 'content').first()
+    if cached is not None:
+        GeneratedContent.objects.filter(pk=cached[0]).update(hits=F('hits') + 1)
+        return cached[1]
+
+    response = complete(prompt, max_tokens=max_tokens)
+    content = response.choices[0].message.content.strip()
+    store_content(key, kind, content, response.usage)
+    return content
+
+
+def _expires_at():
+    ttl = settings.LLM_CACHE_TTL
+    return timezone.now() + timezone.timedelta(seconds=ttl) if ttl else None
+
+
+def store_content(key, kind, content, usage=None):
+    values = {
+        'kind': kind,
+        'content': content,
+        'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+        'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0,
+        'expires_at': _expires_at(),
+    }
+    GeneratedContent.objects.update_or_create(
+        key=key,
+        defaults={**values, 'generations': F('generations') + 1},
+        create_defaults={**values, 'generations': 1},
+    )
+
+
+def _cached_contents(keys):
+    now = timezone.now()
+    hits = dict(GeneratedContent.objects.filter(key__in=keys).filter(
+        Q(expires_at__isnull=True) | Q(expires_at__gt=now)
+    ).values_list('key', 'content'))
+    if hits:
+        GeneratedContent.objects.filter(key__in=hits).update(hits=F('hits') + 1)
+    return hits
+
+
+def _batch_prompt(items):
+    return (
+        'Write one email for every request below. Each request has an "id" and one instruction per '
+        'recipient role. Reply with a JSON object of the form '
+        '{"emails": [{"id": "<id>", "<role>": "<email body>"}]} that has every id and every role asked for. '
+        'Keep each email short.\n\n' + json.dumps(items)
+    )
+
+
+def _parse_batch(text, expected):
+    """Pick valid (id, role) -> body pairs out of the model reply; anything malformed is skipped."""
+    try:
+        entries = json.loads(text).get('emails', [])
+    except (ValueError, AttributeError):
+        return {}
+    if not isinstance(entries, list):
+        return {}
+
+    contents = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        for role, body in entry.items():
+            ref = (str(entry.get('id')), role)
+            if ref in expected and isinstance(body, str) and body.strip():
+                contents[ref] = body.strip()
+    return contents
+
+
+def _upsert_contents(entries):
+    """Insert generated contents, replacing expired rows with the same key, in one query."""
+    # MySQL updates on any unique key conflict and rejects a conflict target; PostgreSQL and SQLite need one
+    unique_fields = ['key'] if connection.features.supports_update_conflicts_with_target else None
+    try:
+        GeneratedContent.objects.bulk_create(
+            entries,
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=['kind', 'content', 'prompt_tokens', 'completion_tokens', 'expires_at'],
+        )
+    except DatabaseError as e:
+        # The emails are already generated, a failed cache write only costs a later regeneration
+        logger.warning(f"Failed to cache {len(entries)} generated contents: {e}")
+
+
+def _generate_chunk(kind, chunk):
+    items = {}
+    for (ref, role), (fields, prompt) in chunk.items():
+        items.setdefault(str(ref), {'id': str(ref)})[role] = prompt
+    expected = {(str(ref), role): (ref, role) for ref, role in chunk}
+
+    try:
+        with track_outbound('openai', 'chat.completions'):
+            response = client.chat.completions.create(
+                model=MODEL,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": _batch_prompt(list(items.values()))}
+                ],
+                max_tokens=min(settings.LLM_BATCH_MAX_TOKENS, settings.LLM_EMAIL_MAX_TOKENS * len(chunk)),
+                response_format={"type": "json_object"},
+            )
+        parsed = _parse_batch(response.choices[0].message.content, expected)
+    except Exception as e:
+        logger.warning(f"Batched {kind} generation failed, falling back per email: {e}")
+        response, parsed = None, {}
+
+    contents = {expected[ref]: body for ref, body in parsed.items()}
+    usage = getattr(response, 'usage', None)
+    share = len(contents) or 1
+    _upsert_contents(
+        [
+            GeneratedContent(
+                key=content_key(kind, role, chunk[(ref, role)][0]),
+                kind=kind,
+                content=body,
+                # Split the call's usage evenly, it's only used for the saved-tokens estimate
+                prompt_tokens=(getattr(usage, 'prompt_tokens', 0) or 0) // share,
+                completion_tokens=(getattr(usage, 'completion_tokens', 0) or 0) // share,
+                expires_at=_expires_at(),
+            )
+            for (ref, role), body in contents.items()
+        ]
+    )
+
+    for ref_role, (fields, prompt) in chunk.items():
+        if ref_role not in contents:
+            contents[ref_role] = generate_cached(kind, ref_role[1], fields, prompt)
+    return contents
+
+
+def generate_batch(kind, email_requests):
+    """Generate many emails with as few LLM calls as the token budget allows.
+
+    `email_requests` maps (ref, role) to the (fields, prompt) pair a single
+    generation would use. Cached bodies are reused; the rest are packed into
+    JSON batches of at most LLM_BATCH_MAX_TOKENS output tokens, and any entry
+    missing or malformed in the reply is generated on its own.
+    """
+    keys = {ref_role: content_key(kind, ref_role[1], fields) for ref_role, (fields, prompt) in email_requests.items()}
+    cached = _cached_contents(list(keys.values()))
+    contents = {ref_role: cached[key] for ref_role, key in keys.items() if key in cached}
+
+    missing = [ref_role for ref_role in email_requests if ref_role not in contents]
+    per_call = max(1, settings.LLM_BATCH_MAX_TOKENS // settings.LLM_EMAIL_MAX_TOKENS)
+    for start in range(0, len(missing), per_call):
+        chunk = {ref_role: email_requests[ref_role] for ref_role in missing[start:start + per_call]}
+        contents.update(_generate_chunk(kind, chunk))
+    return contents
+
+
+def purge_expired_content():
+    deleted, _ = GeneratedContent.objects.filter(expires_at__lt=timezone.now()).delete()
+    return deleted
+
+
+def llm_cache_stats():
+    totals = GeneratedContent.objects.aggregate(
+        entry_count=Count('id'),
+        hit_count=Sum('hits'),
+        generation_count=Sum('generations'),
+        tokens_saved=Sum(F('hits') * (F('prompt_tokens') + F('completion_tokens'))),
+    )
+    hits = totals['hit_count'] or 0
+    generations = totals['generation_count'] or 0
+    return {
+        'entries': totals['entry_count'],
+        'hits': hits,
+        'misses': generations,
+        'hit_rate': hits / (hits + generations) if hits + generations else 0.0,
+        'saved_tokens': totals['tokens_saved'] or 0,
+    }
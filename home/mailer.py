@@ -0,0 +1,116 @@
+# mailer.py
+import logging
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Avg, Count, Min
+from django.utils import timezone
+
+from .metrics import track_outbound
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+
+def _outbound_email(subject, message, from_email, recipient_list):
+    return OutboundEmail(
+        subject=subject[:255],
+        body=message,
+        from_email=from_email,
+        recipients=','.join(recipient_list),
+    )
+
+
+def enqueue_email(subject, message, from_email, recipient_list):
+    email = _outbound_email(subject, message, from_email, recipient_list)
+    email.save()
+    return email
+
+
+def enqueue_emails(messages):
+    """Queue many (subject, message, from_email, recipient_list) emails with one insert."""
+    return OutboundEmail.objects.bulk_create([_outbound_email(*message) for message in messages])
+
+
+def _claim_batch(batch_size):
+    # Push the claimed rows into the future so a concurrent drainer skips them;
+    # if this worker dies they become due again once the claim runs out
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboundEmail.STATUS_PENDING, next_attempt_at__lte=now)
+            .order_by('id')[:batch_size]
+        )
+        OutboundEmail.objects.filter(pk__in=[email.pk for email in batch]).update(
+            next_attempt_at=now + timezone.timedelta(seconds=settings.EMAIL_QUEUE_CLAIM_SECONDS)
+        )
+    return batch
+
+
+def drain_email_queue(batch_size=None):
+    """Send due queued emails in batches over one reused SMTP connection.
+
+    Each message is sent and retried on its own, so one bad recipient doesn't
+    fail the batch. Returns (sent, failed, next_attempt_at of the earliest
+    pending email or None).
+    """
+    batch_size = batch_size or settings.EMAIL_QUEUE_BATCH_SIZE
+    sent = failed = 0
+    connection = get_connection(fail_silently=False)
+
+    try:
+        while True:
+            batch = _claim_batch(batch_size)
+            if not batch:
+                break
+
+            for email in batch:
+                message = EmailMessage(
+                    email.subject, email.body, email.from_email,
+                    email.recipients.split(','), connection=connection,
+                )
+                started = time.monotonic()
+                try:
+                    with track_outbound('smtp', 'send_messages'):
+                        connection.send_messages([message])
+                except Exception as e:
+                    # Drop a possibly broken connection, the next send reopens it
+                    connection.close()
+                    email.attempts += 1
+                    email.last_error = str(e)
+                    if email.attempts >= settings.EMAIL_QUEUE_MAX_ATTEMPTS:
+                        email.status = OutboundEmail.STATUS_FAILED
+                    email.next_attempt_at = timezone.now() + timezone.timedelta(seconds=60 * 2 ** email.attempts)
+                    failed += 1
+                    logger.error(f"Failed to send email '{email.subject}' (attempt {email.attempts}): {e}")
+                else:
+                    email.status = OutboundEmail.STATUS_SENT
+                    email.sent_at = timezone.now()
+                    email.send_latency_ms = (time.monotonic() - started) * 1000
+                    sent += 1
+
+            OutboundEmail.objects.bulk_update(
+                batch, ['status', 'attempts', 'last_error', 'next_attempt_at', 'sent_at', 'send_latency_ms']
+            )
+    finally:
+        connection.close()
+
+    logger.info(f"Email queue drained: {sent} sent, {failed} failed")
+    next_attempt_at = OutboundEmail.objects.filter(status=OutboundEmail.STATUS_PENDING).aggregate(
+        next_attempt_at=Min('next_attempt_at')
+    )['next_attempt_at']
+    return sent, failed, next_attempt_at
+
+
+def email_queue_stats():
+    by_status = dict(OutboundEmail.objects.values_list('status').annotate(count=Count('id')))
+    latency = OutboundEmail.objects.filter(status=OutboundEmail.STATUS_SENT).aggregate(avg=Avg('send_latency_ms'))
+    return {
+        'pending': by_status.get(OutboundEmail.STATUS_PENDING, 0),
+        'sent': by_status.get(OutboundEmail.STATUS_SENT, 0),
+        'failed': by_status.get(OutboundEmail.STATUS_FAILED, 0),
+        'avg_send_latency_ms': latency['avg'],
+    }
@@ -0,0 +1,191 @@
+import json
+import logging
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from home import llm
+from home.mailer import drain_email_queue
+from home.models import TrelloMember
+from home.scoring import recompute_scores
+from home.search_index import chat_system_context
+from home.tasks import after_deadline_, assigned_task, check_tasks_, sync_trello_tasks
+from home.trello_client import trello
+from home.trello_simulator import TrelloSimulator
+from home.trello_utils import board_lists_cache, board_members_cache, member_cache
+
+DATASETS = {'1k': 1000, '10k': 10000, '100k': 100000}
+METRICS = ('seconds', 'queries', 'trello_requests', 'openai_calls', 'smtp_messages')
+CHAT_QUESTION = 'Which overdue tasks does Member 3 still have open?'
+
+
+class StubOpenAI:
+    """Stands in for the OpenAI client: answers instantly and counts calls."""
+
+    def __init__(self):
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, response_format=None, **kwargs):
+        self.calls += 1
+        prompt = messages[-1]['content']
+        if response_format:
+            # A batched email prompt ends with its JSON list of requests
+            items = json.loads(prompt.rsplit('\n\n', 1)[1])
+            content = json.dumps({'emails': [
+                {key: value if key == 'id' else f"Benchmark email for {item['id']}" for key, value in item.items()}
+                for item in items
+            ]})
+        else:
+            content = 'Benchmark email'
+        usage = SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=len(content) // 4)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the Trello sync, the email scanners, scoring and chatbot context on seeded datasets, "
+        "and fail if any result regressed against the JSON baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', action='append', choices=DATASETS,
+                            help='Dataset to run, repeatable (default: all)')
+        parser.add_argument('--baseline', default=str(settings.BASE_DIR / 'benchmarks' / 'baseline.json'))
+        parser.add_argument('--save-baseline', action='store_true', help='Record this run as the new baseline')
+        parser.add_argument('--require-baseline', action='store_true',
+                            help='Fail when the baseline file is missing instead of recording this run as it (for CI)')
+        parser.add_argument('--time-tolerance', type=float, default=0.5,
+                            help='Allowed slowdown as a fraction of the baseline time')
+        parser.add_argument('--min-seconds', type=float, default=0.05,
+                            help='Time differences below this are noise, never a regression')
+        parser.add_argument('--count-tolerance', type=float, default=0.1,
+                            help='Allowed growth of query and outbound call counts as a fraction')
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'BENCHMARK', False):
+            raise CommandError("Run with --settings=mysite.bench_settings, the benchmark flushes the database")
+        baseline_path = Path(options['baseline'])
+        if options['require_baseline'] and not options['save_baseline'] and not baseline_path.exists():
+            raise CommandError(f"No baseline at {baseline_path}, record one with --save-baseline")
+        if options['verbosity'] < 2:
+            logging.disable(logging.INFO)
+
+        call_command('migrate', verbosity=0)
+        datasets = options['dataset'] or list(DATASETS)
+        results = {}
+        for name in datasets:
+            self.stdout.write(f"Dataset {name} ({DATASETS[name]} tasks)")
+            results[name] = self.run_dataset(DATASETS[name])
+
+        if options['save_baseline'] or not baseline_path.exists():
+            baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+            baseline.update(results)
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(f"Baseline saved to {baseline_path}")
+            return
+
+        regressions = compare(json.loads(baseline_path.read_text()), results, options)
+        for regression in regressions:
+            self.stderr.write(f"REGRESSION {regression}")
+        if regressions:
+            raise CommandError(f"{len(regressions)} benchmark results regressed against {baseline_path}")
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {baseline_path}"))
+
+    def run_dataset(self, size):
+        call_command('flush', interactive=False, verbosity=0)
+        cache.clear()
+        for board_cache in (board_lists_cache, board_members_cache, member_cache):
+            board_cache.invalidate()
+        mail.outbox = []
+
+        simulator = TrelloSimulator(board_id=settings.TRELLO_BOARD_ID).generate_board(cards=size, members=20)
+        TrelloMember.objects.bulk_create([
+            TrelloMember(trello_member_id=member['id'], name=member['fullName'], email=f"{member['username']}@example.com")
+            for member in simulator.members.values()
+        ])
+        openai = StubOpenAI()
+        done = next(trello_list['id'] for trello_list in simulator.lists.values() if trello_list['name'] == 'Done')
+
+        def edit_cards():
+            # A busy hour on the board: renames, and every other edited card moved to Done
+            for i, card_id in enumerate(list(simulator.cards)[:max(size // 100, 10)]):
+                simulator.update_card(card_id, name=f"Edited {i}", **({'idList': done} if i % 2 else {}))
+
+        benchmarks = [
+            ('sync_full', sync_trello_tasks),
+            ('sync_incremental', lambda: (edit_cards(), sync_trello_tasks())),
+            ('scoring', recompute_scores),
+            ('check_tasks', check_tasks_),
+            ('assigned_task', assigned_task),
+            ('after_deadline', after_deadline_),
+            ('email_drain', drain_email_queue),
+            ('chat_context_cold', lambda: chat_system_context(CHAT_QUESTION)),
+            ('chat_context_warm', lambda: chat_system_context(CHAT_QUESTION)),
+        ]
+        results = {}
+        with simulator, mock.patch.object(trello, 'base_url', simulator.base_url), \
+                mock.patch.object(llm, 'client', openai):
+            for name, run in benchmarks:
+                results[name] = measure(run, simulator, openai)
+                self.stdout.write(format_result(name, results[name]))
+        return results
+
+
+def measure(run, simulator, openai):
+    """Run once and return the wall time plus the queries and outbound calls it made."""
+    queries = 0
+
+    def count_query(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    trello_before, openai_before, smtp_before = simulator.request_count(), openai.calls, len(mail.outbox)
+    with connection.execute_wrapper(count_query):
+        started = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - started
+    return {
+        'seconds': round(seconds, 4),
+        'queries': queries,
+        'trello_requests': simulator.request_count() - trello_before,
+        'openai_calls': openai.calls - openai_before,
+        'smtp_messages': len(mail.outbox) - smtp_before,
+    }
+
+
+def format_result(name, result):
+    return (
+        f"  {name:<20} {result['seconds']:9.3f}s {result['queries']:7} queries "
+        f"{result['trello_requests']:5} trello {result['openai_calls']:6} openai {result['smtp_messages']:7} smtp"
+    )
+
+
+def compare(baseline, results, options):
+    """Describe every result that got worse than the baseline by more than the tolerances."""
+    regressions = []
+    for dataset, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            expected = baseline.get(dataset, {}).get(name)
+            if expected is None:
+                continue
+            for metric in METRICS:
+                before, now = expected.get(metric, 0), result[metric]
+                if metric == 'seconds':
+                    worse = now > before * (1 + options['time_tolerance']) and now - before > options['min_seconds']
+                else:
+                    # Plus a couple of calls of slack, a cache miss can cost an extra query on small counts
+                    worse = now > before * (1 + options['count_tolerance']) + 2
+                if worse:
+                    regressions.append(f"{dataset} {name} {metric}: {before} -> {now}")
+    return regressions
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.http import JsonResponse
+from django.test import Client, override_settings
+from django.urls import path
+
+from home.trello_client import atrello, trello
+from home.trello_simulator import TrelloSimulator
+from home.trello_utils import board_members_cache, get_board_members
+
+PATH = '/api/members/'
+
+
+def sync_members_list_api(request):
+    # members_list_api as it was before it went async: a worker blocked on the sync client
+    members = get_board_members()
+    return JsonResponse({'members': [{'id': m['id'], 'fullName': m['fullName']} for m in members]})
+
+
+# The WSGI leg is routed here, the project's /api/members/ is async now
+urlpatterns = [path(PATH.lstrip('/'), sync_members_list_api)]
+
+
+def summarize(mode, latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'mode': mode,
+        'requests': len(latencies),
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare concurrent throughput of the board members endpoint as a sync view under WSGI worker "
+        "threads and as the async view under ASGI"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight under ASGI')
+        parser.add_argument('--workers', type=int, default=4, help='Sync worker threads under WSGI')
+        parser.add_argument('--latency', type=float, default=0.1, help='Simulated Trello latency in seconds')
+
+    def handle(self, *args, **options):
+        if options['verbosity'] < 2:
+            # httpx logs every request at INFO
+            logging.disable(logging.INFO)
+        simulator = TrelloSimulator(board_id=settings.TRELLO_BOARD_ID, latency=options['latency'])
+        simulator.add_member('member1', 'Bench Member')
+        with simulator, mock.patch.object(atrello, 'base_url', simulator.base_url), \
+                mock.patch.object(trello, 'base_url', simulator.base_url), \
+                mock.patch.object(atrello.limiter, 'rate', 1e9), mock.patch.object(board_members_cache, 'ttl', 0):
+            # Each request must reach Trello, so the cache and the rate limit are out of the way
+            with override_settings(ROOT_URLCONF=__name__):
+                wsgi = self.run_wsgi(PATH, options['requests'], options['workers'])
+            asgi = asyncio.run(self.run_asgi(PATH, options['requests'], options['concurrency']))
+            results = [wsgi, asgi]
+
+        for result in results:
+            self.stdout.write(
+                f"{result['mode']:<28} {result['requests']} requests  {result['throughput']:8.1f} req/s  "
+                f"p50 {result['p50_ms']:7.1f} ms  p95 {result['p95_ms']:7.1f} ms"
+            )
+        self.stdout.write(f"Trello requests served: {simulator.request_count()}")
+
+    def run_wsgi(self, path, total, workers):
+        # What a gunicorn sync worker does: each thread is blocked for the whole Trello round trip
+        def one(_):
+            # A client per request, test clients keep cookies and aren't meant to be shared between threads
+            client = Client(HTTP_HOST='localhost')
+            started = time.perf_counter()
+            response = client.get(path)
+            assert response.status_code == 200, response.content
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            latencies = list(pool.map(one, range(total)))
+        return summarize(f'wsgi ({workers} sync workers)', latencies, time.perf_counter() - started)
+
+    async def run_asgi(self, path, total, concurrency):
+        from mysite.asgi import application
+
+        semaphore = asyncio.Semaphore(concurrency)
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(transport=transport, base_url='http://localhost') as client:
+            async def one():
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.get(path)
+                    assert response.status_code == 200, response.content
+                    return time.perf_counter() - started
+
+            started = time.perf_counter()
+            latencies = await asyncio.gather(*(one() for _ in range(total)))
+        return summarize(f'asgi ({concurrency} in flight)', latencies, time.perf_counter() - started)
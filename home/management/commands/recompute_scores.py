@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from home.scoring import recompute_scores
+
+
+class Command(BaseCommand):
+    help = "Rebuild every member's historical score from the task table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('members', nargs='*', help='Trello member ids to rebuild, defaults to all members')
+
+    def handle(self, *args, **options):
+        updated = recompute_scores(options['members'] or None)
+        self.stdout.write(self.style.SUCCESS(f"Recomputed scores for {updated} members"))
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from home.tasks import ensure_trello_webhook
+
+
+class Command(BaseCommand):
+    help = "Register the Trello board webhook at TRELLO_WEBHOOK_CALLBACK_URL unless it already exists"
+
+    def handle(self, *args, **options):
+        url = settings.TRELLO_WEBHOOK_CALLBACK_URL
+        if ensure_trello_webhook():
+            self.stdout.write(f"Trello webhook for {url} is already registered")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Registered Trello webhook for {url}"))
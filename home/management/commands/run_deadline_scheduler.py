@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from home.scheduler import deadline_scheduler
+
+
+class Command(BaseCommand):
+    help = "Send overdue task emails as deadlines pass instead of polling every minute"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-idle', type=int, help='Seconds between rebuilds from the database (default DEADLINE_SCHEDULER_MAX_IDLE)'
+        )
+        parser.add_argument(
+            '--poll-interval', type=int,
+            help='Seconds between checks for tasks changed by other processes (default DEADLINE_SCHEDULER_POLL_INTERVAL)',
+        )
+
+    def handle(self, *args, **options):
+        if options['max_idle']:
+            deadline_scheduler.max_idle = options['max_idle']
+        if options['poll_interval']:
+            deadline_scheduler.poll_interval = options['poll_interval']
+        self.stdout.write("Deadline scheduler running, press Ctrl+C to stop")
+        try:
+            deadline_scheduler.run()
+        except KeyboardInterrupt:
+            deadline_scheduler.stop()
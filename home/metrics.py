@@ -0,0 +1,338 @@
+# metrics.py
+import atexit
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.decorators import sync_and_async_middleware
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+# name -> (type, help, label names, histogram buckets)
+METRICS = {
+    'http_requests_total': ('counter', 'HTTP requests served.', ('view', 'method', 'status'), None),
+    'http_request_duration_seconds': (
+        'histogram', 'Time until the response was returned, per view.', ('view', 'method'), LATENCY_BUCKETS,
+    ),
+    'http_request_db_queries': ('histogram', 'Database queries made per request.', ('view',), QUERY_BUCKETS),
+    'outbound_requests_total': ('counter', 'Calls to outside services.', ('service', 'endpoint'), None),
+    'outbound_errors_total': (
+        'counter', 'Calls to outside services that raised or got an error status.', ('service', 'endpoint'), None,
+    ),
+    'outbound_request_duration_seconds': (
+        'histogram', 'Latency of calls to outside services.', ('service', 'endpoint'), LATENCY_BUCKETS,
+    ),
+    'cache_lookups_total': ('counter', 'Lookups in the in-process Trello caches.', ('cache', 'result'), None),
+    'cache_evictions_total': ('counter', 'Entries dropped from a full in-process cache.', ('cache',), None),
+    'background_task_duration_seconds': (
+        'histogram', 'Run time of background tasks.', ('task', 'outcome'), LATENCY_BUCKETS,
+    ),
+}
+
+
+class MetricsRegistry:
+    """Counters and histograms of this process, shared with the others through files.
+
+    Every process writes its samples to METRICS_DIR/<pid>.json at most every
+    METRICS_FLUSH_INTERVAL seconds, and a scrape adds up all the files. Files
+    of exited processes are kept so counters never go backwards; clear the
+    directory when deploying, like Prometheus' multiprocess mode.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._samples = {}  # (name, label values) -> count, or [bucket counts..., +Inf count, sum]
+        self._dirty = False
+        self._flusher = None
+
+    def _check_fork(self):
+        # A forked worker must not report what its parent counted before the fork
+        if os.getpid() != self._pid:
+            self._reset()
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._check_fork()
+            self._samples[key] = self._samples.get(key, 0) + amount
+            self._touch()
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][3]
+        key = (name, tuple(labels))
+        with self._lock:
+            self._check_fork()
+            sample = self._samples.get(key)
+            if sample is None:
+                sample = self._samples[key] = [0] * (len(buckets) + 1) + [0.0]
+            sample[bisect.bisect_left(buckets, value)] += 1
+            sample[-1] += value
+            self._touch()
+
+    def _touch(self):
+        self._dirty = True
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+            self._flusher.start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            if os.getpid() != self._pid:
+                return
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty or os.getpid() != self._pid:
+                return
+            samples = [[name, list(labels), value] for (name, labels), value in self._samples.items()]
+            self._dirty = False
+        directory = Path(settings.METRICS_DIR)
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            # Written aside and renamed, so a scrape never reads half a file
+            tmp = directory / f".{self._pid}.json.tmp"
+            tmp.write_text(json.dumps(samples))
+            os.replace(tmp, directory / f"{self._pid}.json")
+        except OSError as e:
+            self._dirty = True
+            logger.warning(f"Failed to write metrics to {directory}: {e}")
+
+    def collect(self):
+        """Merge the samples of every process into {(name, label values): value}."""
+        self.flush()
+        merged = {}
+        for path in Path(settings.METRICS_DIR).glob('*.json'):
+            try:
+                samples = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in samples:
+                if name not in METRICS:
+                    continue
+                key = (name, tuple(labels))
+                total = merged.get(key)
+                if total is None:
+                    merged[key] = value
+                elif isinstance(value, list):
+                    merged[key] = [a + b for a, b in zip(total, value)]
+                else:
+                    merged[key] = total + value
+        return merged
+
+
+registry = MetricsRegistry()
+atexit.register(registry.flush)
+
+
+def record_outbound(service, endpoint, seconds, error=False):
+    registry.inc('outbound_requests_total', (service, endpoint))
+    registry.observe('outbound_request_duration_seconds', (service, endpoint), seconds)
+    if error:
+        registry.inc('outbound_errors_total', (service, endpoint))
+
+
+def record_cache_lookup(cache, hit):
+    registry.inc('cache_lookups_total', (cache, 'hit' if hit else 'miss'))
+
+
+def record_cache_evictions(cache, count):
+    registry.inc('cache_evictions_total', (cache,), count)
+
+
+@contextmanager
+def track_outbound(service, endpoint):
+    """Time a call to an outside service; an exception counts as an error and is re-raised."""
+    started = time.monotonic()
+    try:
+        yield
+    except Exception:
+        record_outbound(service, endpoint, time.monotonic() - started, error=True)
+        raise
+    record_outbound(service, endpoint, time.monotonic() - started)
+
+
+# Per-request query counter, contextvars follow the request into sync_to_async threads
+_request_queries = contextvars.ContextVar('request_queries', default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def count_connection_queries(sender, connection, **kwargs):
+    # First in line, so the pop() of a connection.execute_wrapper() block open during the connect removes its own
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _count_query)
+
+
+def _view_name(request):
+    # Unmatched URLs share one label, raw paths would make a series per URL
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unmatched'
+
+
+def _record_request(request, response, started, queries):
+    view = _view_name(request)
+    status = response.status_code if response is not None else 500
+    registry.inc('http_requests_total', (view, request.method, str(status)))
+    registry.observe('http_request_duration_seconds', (view, request.method), time.monotonic() - started)
+    registry.observe('http_request_db_queries', (view,), queries[0])
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Record latency and query counts per view. Streamed responses are timed until their headers."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            queries, response = [0], None
+            token = _request_queries.set(queries)
+            started = time.monotonic()
+            try:
+                response = await get_response(request)
+                return response
+            finally:
+                _request_queries.reset(token)
+                _record_request(request, response, started, queries)
+    else:
+        def middleware(request):
+            queries, response = [0], None
+            token = _request_queries.set(queries)
+            started = time.monotonic()
+            try:
+                response = get_response(request)
+                return response
+            finally:
+                _request_queries.reset(token)
+                _record_request(request, response, started, queries)
+    return middleware
+
+
+# Background tasks run one at a time per worker thread, the signals don't say which task started
+_running_task = threading.local()
+
+
+def _task_started(**kwargs):
+    _running_task.started = time.monotonic()
+    _running_task.name, _running_task.outcome = 'unknown', 'success'
+
+
+def _task_successful(sender, completed_task, **kwargs):
+    _running_task.name = completed_task.task_name
+
+
+def _task_error(sender, task, **kwargs):
+    _running_task.name, _running_task.outcome = task.task_name, 'error'
+
+
+def _task_finished(**kwargs):
+    started = getattr(_running_task, 'started', None)
+    if started is not None:
+        registry.observe(
+            'background_task_duration_seconds', (_running_task.name, _running_task.outcome), time.monotonic() - started
+        )
+        _running_task.started = None
+        # The worker may sit idle for a while, don't wait for the flush interval
+        registry.flush()
+
+
+def connect_background_task_signals():
+    from background_task import signals
+
+    signals.task_started.connect(_task_started, dispatch_uid='metrics_task_started')
+    signals.task_successful.connect(_task_successful, dispatch_uid='metrics_task_successful')
+    signals.task_error.connect(_task_error, dispatch_uid='metrics_task_error')
+    signals.task_finished.connect(_task_finished, dispatch_uid='metrics_task_finished')
+
+
+def queue_gauges():
+    """Queue depths read from the database at scrape time, as (name, help, [(labels, value)])."""
+    from background_task.models import Task as BgTask
+    from django.db.models import Count
+
+    from .llm import llm_cache_stats
+    from .mailer import email_queue_stats
+    from .outbox import outbox_stats
+
+    emails = email_queue_stats()
+    outbox = outbox_stats()
+    llm_cache = llm_cache_stats()
+    queued = BgTask.objects.values_list('task_name').annotate(count=Count('id'))
+    return [
+        ('email_queue_messages', 'Queued emails by status.',
+         [({'status': status}, emails[status]) for status in ('pending', 'sent', 'failed')]),
+        ('trello_outbox_changes', 'Trello outbox entries by status.',
+         [({'status': status}, outbox[status]) for status in ('pending', 'sent', 'failed')]),
+        ('trello_outbox_lag_seconds', 'Age of the oldest pending Trello outbox entry.',
+         [({}, outbox['lag_seconds'])]),
+        ('background_tasks_queued', 'Background tasks waiting to run, per task.',
+         [({'task': name}, count) for name, count in queued]),
+        ('llm_cache_entries', 'Generated contents held in the LLM cache.', [({}, llm_cache['entries'])]),
+        ('llm_cache_lookups', 'LLM cache lookups over the cached entries, by result.',
+         [({'result': 'hit'}, llm_cache['hits']), ({'result': 'miss'}, llm_cache['misses'])]),
+        ('llm_cache_hit_ratio', 'Share of LLM cache lookups served from the cache.', [({}, llm_cache['hit_rate'])]),
+        ('llm_cache_saved_tokens', 'Prompt and completion tokens not spent thanks to cache hits.',
+         [({}, llm_cache['saved_tokens'])]),
+    ]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics():
+    """All metrics of every process plus the queue gauges, in the Prometheus text format."""
+    samples = registry.collect()
+    lines = []
+    for name, (kind, help_text, label_names, buckets) in METRICS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for (sample_name, values), value in sorted(samples.items()):
+            if sample_name != name:
+                continue
+            if kind == 'counter':
+                lines.append(f"{name}{_labels(label_names, values)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), value[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(label_names, values, {'le': bound})} {cumulative}")
+            lines.append(f"{name}_sum{_labels(label_names, values)} {_number(value[-1])}")
+            lines.append(f"{name}_count{_labels(label_names, values)} {cumulative}")
+    for name, help_text, gauge_samples in queue_gauges():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for labels, value in gauge_samples:
+            lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+    return '\n'.join(lines) + '\n'
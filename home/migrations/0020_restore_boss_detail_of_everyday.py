@@ -0,0 +1,43 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:02
+
+from django.db import migrations, models
+
+
+def create_missing_tables(apps, schema_editor):
+    # 0018 was emptied after its tables were created, so only create them where they are missing
+    existing_tables = schema_editor.connection.introspection.table_names()
+    for model_name in ('Boss', 'detail_of_everyday'):
+        model = apps.get_model('home', model_name)
+        if model._meta.db_table not in existing_tables:
+            schema_editor.create_model(model)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0019_task_manual_score_override'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Boss',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('username', models.CharField(max_length=150, unique=True)),
+                        ('password', models.CharField(max_length=128)),
+                    ],
+                ),
+                migrations.CreateModel(
+                    name='detail_of_everyday',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('date', models.DateField()),
+                        ('description', models.TextField()),
+                    ],
+                ),
+            ],
+        ),
+        migrations.RunPython(create_missing_tables, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0020_restore_boss_detail_of_everyday'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrelloSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board_id', models.CharField(max_length=255, unique=True)),
+                ('last_action_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('last_action_date', models.DateTimeField(blank=True, null=True)),
+                ('last_full_sync_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
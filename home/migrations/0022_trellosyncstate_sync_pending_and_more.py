@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0021_trellosyncstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trellosyncstate',
+            name='sync_pending',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='trellosyncstate',
+            name='sync_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0022_trellosyncstate_sync_pending_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trellosyncstate',
+            name='sync_needed',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:21
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_score_sum(apps, schema_editor):
+    # Existing averages were kept as historical_score over total_tasks_counted tasks
+    TrelloMember = apps.get_model('home', 'TrelloMember')
+    TrelloMember.objects.filter(historical_score__isnull=False).update(
+        score_sum=F('historical_score') * F('total_tasks_counted')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0025_generatedcontent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trellomember',
+            name='score_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(backfill_score_sum, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0026_trellomember_score_sum'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['completed', 'email_sent', 'deadline'], name='task_pending_deadline_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0027_task_pending_deadline_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskEscalation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.PositiveIntegerField(default=0)),
+                ('deadline', models.DateTimeField()),
+                ('next_escalation_at', models.DateTimeField(db_index=True)),
+                ('last_sent_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('task', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='escalation', to='home.task')),
+            ],
+        ),
+    ]
@@ -1,6 +1,51 @@
 from django.db import models
 from django.contrib.auth.hashers import make_password, check_password
-from django.db import transaction
+from django.utils import timezone
+from datetime import timedelta
+
+from .signals import tasks_bulk_changed
+
+
+class TaskQuerySet(models.QuerySet):
+    def bulk_save(self, tasks, fields, batch_size=500):
+        """Write new and changed tasks with bulk_create/bulk_update, then score them like Task.save().
+
+        Scoring triggers are read from each task's loaded snapshot, so no
+        extra query is needed per task. Returns the number of tasks scored.
+        """
+        triggered = [task for task in tasks if task.score_triggered()]
+        new = [task for task in tasks if task.pk is None]
+        existing = [task for task in tasks if task.pk is not None]
+        self.bulk_create(new, batch_size=batch_size)
+        self.bulk_update(existing, fields, batch_size=batch_size)
+
+        # Backends like MySQL don't return primary keys from bulk_create
+        unsaved = {task.trello_card_id: task for task in triggered if task.pk is None}
+        if unsaved:
+            for card_id, pk in self.filter(trello_card_id__in=unsaved).values_list('trello_card_id', 'pk'):
+                unsaved[card_id].pk = pk
+        for task in tasks:
+            task.take_snapshot()
+        tasks_bulk_changed.send(sender=self.model, tasks=tasks)
+        return self.score(triggered)
+
+    def with_delay_score(self):
+        """Annotate each task with `delay_score`, the same value get_delay_score() returns."""
+        from .scoring import delay_score_expression
+
+        return self.annotate(delay_score=delay_score_expression())
+
+    def score(self, tasks):
+        """Apply the delay scores of many tasks in one locked, set-based pass."""
+        from .scoring import apply_task_scores
+
+        scored = apply_task_scores(
+            [task for task in tasks if not task.score_counted or task.manual_score_override is not None]
+        )
+        for task in tasks:
+            task.take_snapshot()
+        return scored
+
 
 class Task(models.Model):
     title = models.CharField(max_length=255)
@@ -21,6 +66,48 @@ class Task(models.Model):
     score_counted = models.BooleanField(default=False)
     manual_score_override = models.FloatField(null=True, blank=True)  # NEW
 
+    objects = TaskQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Pending deadlines, read by the deadline scheduler and the overdue check
+            models.Index(fields=['completed', 'email_sent', 'deadline'], name='task_pending_deadline_idx'),
+            # Keyset pagination of the task list API
+            models.Index(fields=['updated_at', 'id'], name='task_updated_id_idx'),
+        ]
+
+    # Values as last read from / written to the DB, used to detect changes without a re-read
+    TRACKED_FIELDS = ('manual_score_override', 'score_counted')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values) if name in cls.TRACKED_FIELDS
+        }
+        return instance
+
+    def take_snapshot(self):
+        self._loaded_values = {name: getattr(self, name) for name in self.TRACKED_FIELDS}
+
+    def _previous_values(self):
+        if self.pk is None:
+            return {'manual_score_override': None, 'score_counted': False}
+        loaded = getattr(self, '_loaded_values', {})
+        if all(name in loaded for name in self.TRACKED_FIELDS):
+            return loaded
+        # Built by hand with a pk or loaded with deferred fields, fall back to reading the row
+        previous = Task.objects.filter(pk=self.pk).values(*self.TRACKED_FIELDS).first()
+        return previous or {'manual_score_override': None, 'score_counted': False}
+
+    def score_triggered(self):
+        previous = self._previous_values()
+        is_being_completed = self.completed and self.completed_on and not self.score_counted
+        override_changed = self.manual_score_override is not None and (
+            self.manual_score_override != previous['manual_score_override'] or not previous['score_counted']
+        )
+        return bool(is_being_completed or override_changed)
+
     def get_delay_score(self):
         if self.manual_score_override is not None:
             return self.manual_score_override
@@ -45,23 +132,13 @@ class Task(models.Model):
 
 
     def save(self, *args, **kwargs):
-        previous_manual_override = None
-        previous_score_counted = False
-
-        if self.pk:
-            previous_task = Task.objects.get(pk=self.pk)
-            previous_manual_override = previous_task.manual_score_override
-            previous_score_counted = previous_task.score_counted
-
-        is_being_completed = self.completed and self.completed_on and not self.score_counted
-        override_changed = self.manual_score_override is not None and (
-            self.manual_score_override != previous_manual_override or not previous_score_counted
-        )
+        triggered = self.score_triggered()
 
         super().save(*args, **kwargs)
 
-        if is_being_completed or override_changed:
+        if triggered:
             self.update_score_if_needed()
+        self.take_snapshot()
 
 
 
@@ -72,27 +149,17 @@ class TrelloMember(models.Model):
     name = models.CharField(max_length=100, null=True, blank=True)
     historical_score = models.FloatField(null=True, blank=True)  # allow None
     total_tasks_counted = models.PositiveIntegerField(default=0)
+    # Sum of every counted task's delay score, so new scores are added without reading the average back
+    score_sum = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
 
 
     def update_score_for_single_task(self, task):
-        score = task.get_delay_score()
-        if score is None:
-            return
-
-        with transaction.atomic():
-            if self.historical_score is None:
-                self.historical_score = score
-                self.total_tasks_counted = 1
-            else:
-                combined_total_score = (self.historical_score * self.total_tasks_counted) + score
-                self.total_tasks_counted += 1
-                self.historical_score = round(combined_total_score / self.total_tasks_counted, 2)
+        from .scoring import apply_task_scores
 
-            self.save()
-
-            # Avoid triggering update_score_if_needed again
-            Task.objects.filter(pk=task.pk).update(score_counted=True)
+        if apply_task_scores([task]):
+            self.refresh_from_db(fields=['historical_score', 'total_tasks_counted', 'score_sum'])
 
 
 
@@ -103,9 +170,156 @@ class TrelloMember(models.Model):
             score_counted=True
         ).values_list('id', flat=True)
     
+class TaskEscalation(models.Model):
+    """Follow-up reminders for an overdue task: a day after the deadline, after 3 days, then weekly."""
+    STEPS = (timedelta(days=1), timedelta(days=3))
+    REPEAT = timedelta(days=7)
+
+    task = models.OneToOneField(Task, on_delete=models.CASCADE, related_name='escalation')
+    level = models.PositiveIntegerField(default=0)  # step of the schedule the next reminder is for
+    deadline = models.DateTimeField()  # task deadline the schedule was built from
+    next_escalation_at = models.DateTimeField(db_index=True)
+    last_sent_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def due_at(cls, deadline, level):
+        if level < len(cls.STEPS):
+            return deadline + cls.STEPS[level]
+        return deadline + cls.STEPS[-1] + cls.REPEAT * (level - len(cls.STEPS) + 1)
+
+    def restart(self, deadline):
+        # The deadline moved, start the schedule over from the new one
+        self.deadline = deadline
+        self.level = 0
+        self.next_escalation_at = self.due_at(deadline, 0)
+
+    def advance(self, now):
+        self.last_sent_at = now
+        self.level += 1
+        self.next_escalation_at = self.due_at(self.deadline, self.level)
+        # Steps missed while nothing was running are skipped rather than sent back to back
+        while self.next_escalation_at <= now:
+            self.level += 1
+            self.next_escalation_at = self.due_at(self.deadline, self.level)
+
+    def __str__(self):
+        return f"{self.task} (level {self.level}, next {self.next_escalation_at})"
+
+
+class TrelloSyncState(models.Model):
+    board_id = models.CharField(max_length=255, unique=True)
+    # Cursor into boards/{id}/actions, everything up to this action is already applied
+    last_action_id = models.CharField(max_length=255, null=True, blank=True)
+    last_action_date = models.DateTimeField(null=True, blank=True)
+    last_full_sync_at = models.DateTimeField(null=True, blank=True)
+    # Webhook coalescing: one queued run at a time, and a lease so only one worker syncs
+    sync_pending = models.BooleanField(default=False)
+    # False when queued webhook payloads were already applied and only notifications remain
+    sync_needed = models.BooleanField(default=False)
+    sync_started_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Sync state for board {self.board_id}"
+
+
+class DataVersion(models.Model):
+    """A named change counter shared by every process, e.g. what the chatbot snapshots are keyed on."""
+    name = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+
+class OutboundEmail(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    recipients = models.TextField()  # comma separated
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    # Also used as a claim: a worker pushes it forward while it sends the row
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    send_latency_ms = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.recipients} ({self.status})"
+
+
+class TrelloOutbox(models.Model):
+    """A card change saved with the DB write that caused it, pushed to Trello by the outbox flusher."""
+    OP_CREATE = 'create'
+    OP_UPDATE = 'update'
+    OP_DELETE = 'delete'
+    OP_CHOICES = [
+        (OP_CREATE, 'Create'),
+        (OP_UPDATE, 'Update'),
+        (OP_DELETE, 'Delete'),
+    ]
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    op = models.CharField(max_length=10, choices=OP_CHOICES)
+    card_id = models.CharField(max_length=255, null=True, blank=True)  # set by the flusher for creates
+    payload = models.JSONField(default=dict)  # Trello card fields
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    # Also used as a claim: a flusher pushes it forward while it sends the row
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"{self.op} {self.card_id or 'new card'} ({self.status})"
+
+
+class GeneratedContent(models.Model):
+    # sha256 of the template kind, recipient role and the task fields in the prompt
+    key = models.CharField(max_length=64, unique=True)
+    kind = models.CharField(max_length=50)
+    content = models.TextField()
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    hits = models.PositiveIntegerField(default=0)
+    generations = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.kind} ({self.key[:12]})"
+
+
 class detail_of_everyday(models.Model):
     date = models.DateField()
     description = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
 
 
     def __str__(self):
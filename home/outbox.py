@@ -0,0 +1,161 @@
+# outbox.py
+import logging
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+from .models import TrelloOutbox
+from .trello_client import RETRY_STATUSES, trello
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_card_change(op, payload=None, card_id=None):
+    """Record a Trello card change. Call it inside the transaction that wrote the matching DB change."""
+    return TrelloOutbox.objects.create(op=op, card_id=card_id, payload=payload or {})
+
+
+def _claim_batch(batch_size):
+    # Same claim as the email queue: claimed rows move into the future while they are sent
+    now = timezone.now()
+    pending = TrelloOutbox.objects.select_for_update(skip_locked=True).filter(status=TrelloOutbox.STATUS_PENDING)
+    due = pending.filter(next_attempt_at__lte=now)
+    with transaction.atomic():
+        while True:
+            batch = list(due.order_by('id')[:batch_size])
+            card_ids = {entry.card_id for entry in batch if entry.card_id}
+            # Cards with a change claimed by another flusher or backing off: their later
+            # changes wait until then, sending them now could be overwritten by the older one
+            held = dict(
+                TrelloOutbox.objects.filter(
+                    status=TrelloOutbox.STATUS_PENDING, card_id__in=card_ids, next_attempt_at__gt=now,
+                ).values_list('card_id').annotate(until=Max('next_attempt_at'))
+            )
+            if not held:
+                break
+            for card_id, until in held.items():
+                TrelloOutbox.objects.filter(
+                    status=TrelloOutbox.STATUS_PENDING, card_id=card_id, next_attempt_at__lte=now,
+                ).update(next_attempt_at=until)
+        # Later edits of the same cards come along so they are merged instead of sent out of order
+        if card_ids:
+            batch += list(
+                due.filter(card_id__in=card_ids).exclude(pk__in=[entry.pk for entry in batch]).order_by('id')
+            )
+        TrelloOutbox.objects.filter(pk__in=[entry.pk for entry in batch]).update(
+            next_attempt_at=now + timezone.timedelta(seconds=settings.TRELLO_OUTBOX_CLAIM_SECONDS)
+        )
+    return batch
+
+
+def merge_changes(entries):
+    """Collapse entries into one Trello call per card, oldest change first.
+
+    Returns a list of (op, card_id, payload, entries). Updates merge field by
+    field with later values winning, and a delete replaces anything before
+    it. Creates have no card id yet and are sent one by one.
+    """
+    calls = []
+    by_card = {}
+    for entry in sorted(entries, key=lambda entry: entry.pk):
+        if entry.op == TrelloOutbox.OP_CREATE:
+            calls.append([entry.op, None, dict(entry.payload), [entry]])
+            continue
+        call = by_card.get(entry.card_id)
+        if call is None:
+            call = by_card[entry.card_id] = [entry.op, entry.card_id, {}, []]
+            calls.append(call)
+        if entry.op == TrelloOutbox.OP_DELETE:
+            call[0], call[2] = entry.op, {}
+        elif call[0] == TrelloOutbox.OP_UPDATE:
+            call[2].update(entry.payload)
+        call[3].append(entry)
+    return [tuple(call) for call in calls]
+
+
+def _send(op, card_id, payload):
+    if op == TrelloOutbox.OP_CREATE:
+        return trello.post('cards', data=payload)
+    if op == TrelloOutbox.OP_DELETE:
+        return trello.delete(f'cards/{card_id}')
+    return trello.put(f'cards/{card_id}', data=payload)
+
+
+def _push(op, card_id, payload):
+    """Send one merged change, returns (error or None, retryable, id of the created card)."""
+    try:
+        response = _send(op, card_id, payload)
+    except requests.RequestException as e:
+        return str(e), True, None
+    # A card that's already gone is what a delete wanted
+    if response.status_code >= 400 and not (op == TrelloOutbox.OP_DELETE and response.status_code == 404):
+        return f"{response.status_code}: {response.text[:500]}", response.status_code in RETRY_STATUSES, None
+    return None, False, response.json()['id'] if op == TrelloOutbox.OP_CREATE else None
+
+
+def flush_trello_outbox(batch_size=None):
+    """Push pending card changes to Trello, one API call per changed card.
+
+    Failed calls are retried with exponential backoff until
+    TRELLO_OUTBOX_MAX_ATTEMPTS; client errors other than 429 fail at once.
+    Returns (sent, failed, next_attempt_at of the earliest retry or None).
+    """
+    batch_size = batch_size or settings.TRELLO_OUTBOX_BATCH_SIZE
+    sent = failed = 0
+
+    while True:
+        batch = _claim_batch(batch_size)
+        if not batch:
+            break
+
+        for op, card_id, payload, entries in merge_changes(batch):
+            try:
+                error, retryable, created_id = _push(op, card_id, payload)
+            except Exception as e:
+                # Anything else (e.g. a create answered with something that isn't a card) fails this call
+                # only; not retried, as Trello may have applied it and a create would then be duplicated
+                logger.exception(f"Trello outbox {op} of {card_id or 'new card'} raised")
+                error, retryable, created_id = f"{type(e).__name__}: {e}", False, None
+
+            now = timezone.now()
+            for entry in entries:
+                if error is None:
+                    entry.status = TrelloOutbox.STATUS_SENT
+                    entry.sent_at = now
+                    if op == TrelloOutbox.OP_CREATE:
+                        entry.card_id = created_id
+                    continue
+                entry.attempts += 1
+                entry.last_error = error
+                if not retryable or entry.attempts >= settings.TRELLO_OUTBOX_MAX_ATTEMPTS:
+                    entry.status = TrelloOutbox.STATUS_FAILED
+                entry.next_attempt_at = now + timezone.timedelta(seconds=30 * 2 ** entry.attempts)
+            if error is None:
+                sent += 1
+            else:
+                failed += 1
+                logger.error(f"Trello outbox {op} of {card_id or 'new card'} failed ({len(entries)} changes): {error}")
+
+        TrelloOutbox.objects.bulk_update(batch, ['card_id', 'status', 'attempts', 'last_error', 'next_attempt_at', 'sent_at'])
+
+    stats = outbox_stats()
+    logger.info(f"Trello outbox flushed: {sent} calls sent, {failed} failed, {stats['pending']} pending, lag {stats['lag_seconds']:.1f}s")
+    return sent, failed, stats['next_attempt_at']
+
+
+def outbox_stats():
+    """Pending/failed counts and the lag: how long the oldest pending change has waited."""
+    by_status = dict(TrelloOutbox.objects.values_list('status').annotate(count=Count('id')))
+    pending = TrelloOutbox.objects.filter(status=TrelloOutbox.STATUS_PENDING).aggregate(
+        oldest=Min('created_at'), next_attempt_at=Min('next_attempt_at')
+    )
+    return {
+        'pending': by_status.get(TrelloOutbox.STATUS_PENDING, 0),
+        'sent': by_status.get(TrelloOutbox.STATUS_SENT, 0),
+        'failed': by_status.get(TrelloOutbox.STATUS_FAILED, 0),
+        'lag_seconds': (timezone.now() - pending['oldest']).total_seconds() if pending['oldest'] else 0.0,
+        'next_attempt_at': pending['next_attempt_at'],
+    }
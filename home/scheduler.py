@@ -0,0 +1,190 @@
+# scheduler.py
+import heapq
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Task
+from .signals import tasks_bulk_changed
+
+logger = logging.getLogger(__name__)
+
+
+def is_pending(task):
+    # Same rows check_tasks_() sends overdue emails for
+    return bool(task.deadline and task.trello_member_id and not task.completed and not task.email_sent)
+
+
+def pending_deadlines():
+    return Task.objects.filter(
+        completed=False, email_sent=False, deadline__isnull=False, trello_member_id__isnull=False
+    ).values_list('id', 'deadline')
+
+
+def _check_overdue():
+    from .tasks import check_tasks_
+
+    check_tasks_()
+
+
+class DeadlineScheduler:
+    """Fires overdue handling when the earliest pending deadline passes.
+
+    Deadlines are kept in a min-heap keyed by deadline. Changed tasks push a
+    new entry and superseded entries are skipped when they reach the top, so
+    every update is O(log n). Signals only fire for saves in this process,
+    so the loop also wakes every `poll_interval` seconds to load tasks whose
+    updated_at moved past the last one seen, and rebuilds everything from the
+    database every `max_idle` seconds for what that misses (deletes, update()).
+    """
+
+    def __init__(self, handler=_check_overdue, max_idle=None, poll_interval=None):
+        self.handler = handler
+        self.max_idle = max_idle if max_idle is not None else settings.DEADLINE_SCHEDULER_MAX_IDLE
+        self.poll_interval = poll_interval if poll_interval is not None else settings.DEADLINE_SCHEDULER_POLL_INTERVAL
+        self._heap = []
+        self._deadlines = {}  # task id -> deadline of its live heap entry
+        self._cond = threading.Condition()
+        self._running = False
+        self._stopping = False
+        self._rebuild_at = 0
+        self._poll_at = 0
+        self._seen_updated_at = None  # latest Task.updated_at already loaded
+
+    def _latest_update(self):
+        # Served from the (updated_at, id) index
+        return Task.objects.aggregate(latest=Max('updated_at'))['latest']
+
+    def rebuild(self):
+        # Read before the deadlines, anything saved in between is picked up by the next poll
+        latest = self._latest_update()
+        deadlines = dict(pending_deadlines())
+        with self._cond:
+            self._deadlines = deadlines
+            self._heap = [(deadline, task_id) for task_id, deadline in deadlines.items()]
+            heapq.heapify(self._heap)
+            self._seen_updated_at = latest
+            self._rebuild_at = time.monotonic() + self.max_idle
+            self._poll_at = time.monotonic() + self.poll_interval
+            self._cond.notify()
+        logger.info(f"Deadline heap rebuilt with {len(deadlines)} pending tasks")
+
+    def poll(self):
+        """Schedule tasks saved since the last rebuild or poll, e.g. by another process."""
+        self._poll_at = time.monotonic() + self.poll_interval
+        latest = self._latest_update()
+        if latest is None or latest == self._seen_updated_at:
+            return
+        tasks = Task.objects.only('deadline', 'trello_member_id', 'completed', 'email_sent')
+        if self._seen_updated_at is not None:
+            # Look back one interval for transactions that committed after a later timestamp was seen
+            tasks = tasks.filter(updated_at__gte=self._seen_updated_at - timedelta(seconds=self.poll_interval))
+        for task in tasks:
+            self.schedule(task.pk, task.deadline if is_pending(task) else None)
+        self._seen_updated_at = latest
+
+    def schedule(self, task_id, deadline):
+        """Track a task's new deadline, or stop tracking it when deadline is None."""
+        with self._cond:
+            if deadline is None:
+                self._deadlines.pop(task_id, None)
+                return
+            if self._deadlines.get(task_id) == deadline:
+                return
+            self._deadlines[task_id] = deadline
+            heapq.heappush(self._heap, (deadline, task_id))
+            if self._heap[0] == (deadline, task_id):
+                # New earliest deadline, wake the loop so it sleeps for less
+                self._cond.notify()
+
+    def task_changed(self, task):
+        if self._running:
+            self.schedule(task.pk, task.deadline if is_pending(task) else None)
+
+    def task_deleted(self, task):
+        if self._running:
+            self.schedule(task.pk, None)
+
+    def _next_deadline(self):
+        # Drop superseded entries so the head is a live deadline
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def _pop_due(self, now):
+        due = []
+        while (deadline := self._next_deadline()) is not None and deadline <= now:
+            _, task_id = heapq.heappop(self._heap)
+            del self._deadlines[task_id]
+            due.append(task_id)
+        return due
+
+    def _wait(self):
+        """Sleep until the next deadline, poll or rebuild, returns the ids that fell due."""
+        with self._cond:
+            while not self._stopping:
+                due = self._pop_due(timezone.now())
+                if due:
+                    return due
+                until_check = min(self._rebuild_at, self._poll_at) - time.monotonic()
+                if until_check <= 0:
+                    return []
+                deadline = self._next_deadline()
+                until_deadline = (deadline - timezone.now()).total_seconds() if deadline else until_check
+                self._cond.wait(max(min(until_deadline, until_check), 0))
+            return []
+
+    def run(self):
+        self._running = True
+        self._stopping = False
+        try:
+            self.rebuild()
+            while not self._stopping:
+                due = self._wait()
+                if due:
+                    logger.info(f"{len(due)} task deadlines passed, running overdue check")
+                    try:
+                        # One set-based check covers every task that fell due together
+                        self.handler()
+                    except Exception:
+                        # Tasks still pending come back on the next rebuild
+                        logger.exception("Overdue check failed")
+                if self._stopping:
+                    break
+                if time.monotonic() >= self._rebuild_at:
+                    self.rebuild()
+                elif time.monotonic() >= self._poll_at:
+                    self.poll()
+        finally:
+            self._running = False
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+
+
+deadline_scheduler = DeadlineScheduler()
+
+
+@receiver(post_save, sender=Task)
+def task_saved(sender, instance, **kwargs):
+    deadline_scheduler.task_changed(instance)
+
+
+@receiver(tasks_bulk_changed, sender=Task)
+def tasks_saved(sender, tasks, **kwargs):
+    for task in tasks:
+        deadline_scheduler.task_changed(task)
+
+
+@receiver(post_delete, sender=Task)
+def task_deleted(sender, instance, **kwargs):
+    deadline_scheduler.task_deleted(instance)
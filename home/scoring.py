@@ -0,0 +1,147 @@
+# scoring.py
+import datetime
+import logging
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, DateField, ExpressionWrapper, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast, Round, TruncDate
+
+from .models import Task, TrelloMember
+from .signals import data_changed
+
+logger = logging.getLogger(__name__)
+
+MAX_SCORE = 10
+LATE_PENALTY_PER_DAY = 0.5
+
+# Tasks that get_delay_score() gives a score to
+SCORED_TASKS = Q(manual_score_override__isnull=False) | Q(
+    completed=True, completed_on__isnull=False, deadline__isnull=False
+)
+
+
+def delay_score_expression():
+    """Task.get_delay_score() as a database expression, so scores can be summed in SQL."""
+    # Stored datetimes are UTC, which is what deadline.date() sees on a loaded task
+    deadline_date = TruncDate('deadline', tzinfo=datetime.timezone.utc)
+    whens = [
+        When(manual_score_override__isnull=False, then=F('manual_score_override')),
+        When(~SCORED_TASKS, then=Value(None, output_field=FloatField())),
+    ]
+    # One step per day late until the score bottoms out at 0
+    for days_late in range(int(MAX_SCORE / LATE_PENALTY_PER_DAY) + 1):
+        cutoff = ExpressionWrapper(deadline_date + datetime.timedelta(days=days_late), output_field=DateField())
+        whens.append(When(completed_on__lte=cutoff, then=Value(MAX_SCORE - days_late * LATE_PENALTY_PER_DAY)))
+    return Case(*whens, default=Value(0.0), output_field=FloatField())
+
+
+def _average():
+    return Case(
+        When(total_tasks_counted=0, then=Value(None, output_field=FloatField())),
+        default=Round(F('score_sum') / Cast('total_tasks_counted', FloatField()), 2),
+        output_field=FloatField(),
+    )
+
+
+def apply_task_scores(tasks):
+    """Add the delay score of newly completed tasks to their members' running totals.
+
+    Each task is claimed with a row lock so it is counted once even when two
+    syncs score it at the same time, and member totals are incremented with
+    F() expressions instead of being read and written back. A task that was
+    already counted but got a new manual override has its member rebuilt from
+    the task table instead. Returns the number of tasks scored.
+    """
+    member_ids = {task.trello_member_id for task in tasks if task.trello_member_id}
+    if not member_ids:
+        return 0
+    existing = set(
+        TrelloMember.objects.filter(trello_member_id__in=member_ids).values_list('trello_member_id', flat=True)
+    )
+
+    fresh, rescored = {}, []
+    for task in tasks:
+        if task.pk is None or task.trello_member_id not in existing or task.get_delay_score() is None:
+            continue
+        if task.score_counted and task.manual_score_override is not None:
+            rescored.append(task)
+        elif not task.score_counted:
+            fresh[task.pk] = task
+
+    with transaction.atomic():
+        claimed = list(
+            Task.objects.select_for_update().filter(pk__in=fresh, score_counted=False).values_list('pk', flat=True)
+        )
+        if claimed:
+            Task.objects.filter(pk__in=claimed).update(score_counted=True)
+
+        increments = defaultdict(lambda: [0.0, 0])
+        for pk in claimed:
+            task = fresh[pk]
+            increments[task.trello_member_id][0] += task.get_delay_score()
+            increments[task.trello_member_id][1] += 1
+        for member_id, (score_sum, count) in increments.items():
+            TrelloMember.objects.filter(trello_member_id=member_id).update(
+                score_sum=F('score_sum') + score_sum,
+                total_tasks_counted=F('total_tasks_counted') + count,
+            )
+        if increments:
+            TrelloMember.objects.filter(trello_member_id__in=increments).update(historical_score=_average())
+
+        if rescored:
+            recompute_scores({task.trello_member_id for task in rescored})
+
+    if increments:
+        data_changed.send(sender=TrelloMember)
+
+    # Tasks another worker claimed first are counted there
+    for task in fresh.values():
+        task.score_counted = True
+    return len(claimed) + len(rescored)
+
+
+def recompute_scores(member_ids=None, batch_size=500):
+    """Rebuild members' running scores from the task table with one aggregate query.
+
+    Every task with a delay score counts once at its current score, so manual
+    overrides replace the earlier score instead of adding another sample.
+    Rebuilds every member when member_ids is None. Returns the members updated.
+    """
+    members = TrelloMember.objects.all()
+    tasks = Task.objects.filter(SCORED_TASKS, trello_member_id__isnull=False)
+    if member_ids is not None:
+        members = members.filter(trello_member_id__in=member_ids)
+        tasks = tasks.filter(trello_member_id__in=member_ids)
+
+    totals = {
+        row['trello_member_id']: row
+        for row in tasks.values('trello_member_id').annotate(
+            total=Count('id'), score_sum=Sum(delay_score_expression())
+        )
+    }
+
+    updated = []
+    for member in members.only('id', 'trello_member_id'):
+        row = totals.get(member.trello_member_id)
+        member.score_sum = row['score_sum'] if row else 0.0
+        member.total_tasks_counted = row['total'] if row else 0
+        member.historical_score = round(member.score_sum / member.total_tasks_counted, 2) if row else None
+        updated.append(member)
+
+    with transaction.atomic():
+        TrelloMember.objects.bulk_update(
+            updated, ['score_sum', 'total_tasks_counted', 'historical_score'], batch_size=batch_size
+        )
+        # Tasks of unknown members stay uncounted until the member is synced
+        tasks.filter(
+            score_counted=False, trello_member_id__in=TrelloMember.objects.values('trello_member_id')
+        ).update(score_counted=True)
+        unscored = Task.objects.filter(~SCORED_TASKS, score_counted=True)
+        if member_ids is not None:
+            unscored = unscored.filter(trello_member_id__in=member_ids)
+        unscored.update(score_counted=False)
+    data_changed.send(sender=TrelloMember)
+
+    logger.info(f"Recomputed scores for {len(updated)} members from {sum(r['total'] for r in totals.values())} tasks")
+    return len(updated)
@@ -0,0 +1,337 @@
+# search_index.py
+import hashlib
+import heapq
+import json
+import logging
+import time
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import DataVersion, Task, TrelloMember, detail_of_everyday
+from .signals import data_changed, tasks_bulk_changed
+
+logger = logging.getLogger(__name__)
+
+TOKEN = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset(
+    'a an and are as at be by did do does for from has have how i in is it its me my of on or so that the '
+    'their them there these they this to was were what when where which who whom why will with you your'.split()
+)
+
+
+VERSION_NAME = 'chat'
+
+
+def _seed_data_version():
+    # A missing row (e.g. a flushed database) starts from a value no reader can have cached under
+    row, _ = DataVersion.objects.get_or_create(name=VERSION_NAME, defaults={'version': int(time.time() * 1000)})
+    return row.version
+
+
+def data_version():
+    """Counter in the database, bumped whenever tasks, summaries or members change."""
+    version = DataVersion.objects.filter(name=VERSION_NAME).values_list('version', flat=True).first()
+    return version if version is not None else _seed_data_version()
+
+
+def _bump_data_version():
+    # One atomic UPDATE, concurrent bumps from other processes are never lost
+    if not DataVersion.objects.filter(name=VERSION_NAME).update(version=F('version') + 1):
+        _seed_data_version()
+
+
+def bump_data_version():
+    # After commit, so no reader builds a snapshot under the new version from the old rows,
+    # and the counter row isn't locked for the rest of a long transaction
+    connection = transaction.get_connection()
+    # One bump per transaction is enough. A rolled back transaction or savepoint drops its
+    # callbacks from this list, so a later save still queues its own.
+    if any(func is _bump_data_version for _, func, _ in connection.run_on_commit):
+        return
+    transaction.on_commit(_bump_data_version)
+
+
+def tokenize(text):
+    return [token for token in TOKEN.findall((text or '').lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """In-memory BM25 ranking over short documents, updated one document at a time.
+
+    Postings map each term to the documents containing it, so a search only
+    scores documents sharing a term with the query.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)  # term -> {key: term frequency}
+        self._lengths = {}  # key -> document length in tokens
+        self._terms = {}  # key -> its distinct terms, so removal doesn't scan the vocabulary
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def __contains__(self, key):
+        return key in self._lengths
+
+    def keys(self):
+        return self._lengths.keys()
+
+    def add(self, key, text):
+        self.remove(key)
+        terms = Counter(tokenize(text))
+        for term, count in terms.items():
+            self._postings[term][key] = count
+        length = sum(terms.values())
+        self._terms[key] = tuple(terms)
+        self._lengths[key] = length
+        self._total_length += length
+
+    def remove(self, key):
+        length = self._lengths.pop(key, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for term in self._terms.pop(key):
+            del self._postings[term][key]
+            if not self._postings[term]:
+                del self._postings[term]
+
+    def search(self, query, k=10):
+        """Return up to k (score, key) pairs, best first."""
+        if not self._lengths:
+            return []
+        n = len(self._lengths)
+        avg_length = self._total_length / n or 1
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            docs = self._postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for key, tf in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[key] / avg_length)
+                scores[key] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, ((score, key) for key, score in scores.items()))
+
+
+def task_text(task):
+    status = 'completed done finished' if task['completed'] else 'pending open'
+    return ' '.join(str(task[field] or '') for field in ('title', 'description', 'full_name', 'user_name')) + ' ' + status
+
+
+def summary_text(summary):
+    return f"{summary['date']} {summary['description']}"
+
+
+def member_text(member):
+    return f"{member['name'] or ''} {member['email']} {member['trello_member_id']}"
+
+
+# Source name -> (model, fields read to build the text, text builder)
+SOURCES = {
+    'task': (Task, ('id', 'title', 'description', 'full_name', 'user_name', 'completed'), task_text),
+    'summary': (detail_of_everyday, ('id', 'date', 'description'), summary_text),
+    'member': (TrelloMember, ('id', 'name', 'email', 'trello_member_id'), member_text),
+}
+
+
+class ChatIndex:
+    """Relevance index over tasks, daily summaries and members for chatbot context.
+
+    Saves in this process update it through signals. Changes made by other
+    processes are picked up once the shared data version moves: each source
+    compares a count/max(updated_at) fingerprint and reloads only the rows
+    updated since the last look.
+    """
+
+    def __init__(self):
+        self.index = BM25Index()
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+        self._checked_version = None
+        self._checked_at = 0
+
+    def _fingerprint(self, name):
+        return SOURCES[name][0].objects.aggregate(count=Count('id'), latest=Max('updated_at'))
+
+    def _load(self, name, queryset=None):
+        model, fields, build_text = SOURCES[name]
+        rows = (queryset if queryset is not None else model.objects.all()).values(*fields)
+        loaded = 0
+        for row in rows:
+            self.index.add((name, row['id']), build_text(row))
+            loaded += 1
+        return loaded
+
+    def _reload(self, name):
+        for key in [key for key in self.index.keys() if key[0] == name]:
+            self.index.remove(key)
+        self._load(name)
+
+    def refresh(self):
+        with self._lock:
+            for name, (model, _, _) in SOURCES.items():
+                fingerprint = self._fingerprint(name)
+                previous = self._fingerprints.get(name)
+                if fingerprint == previous:
+                    continue
+                if previous and previous['latest'] and fingerprint['count'] >= previous['count']:
+                    self._load(name, model.objects.filter(updated_at__gte=previous['latest']))
+                    if sum(1 for key in self.index.keys() if key[0] == name) != fingerprint['count']:
+                        # Rows were deleted elsewhere, only a full reload drops them
+                        self._reload(name)
+                else:
+                    self._reload(name)
+                self._fingerprints[name] = fingerprint
+
+    def update(self, name, instance):
+        with self._lock:
+            if name in self._fingerprints:
+                fields, build_text = SOURCES[name][1], SOURCES[name][2]
+                self.index.add((name, instance.pk), build_text({field: getattr(instance, field) for field in fields}))
+
+    def remove(self, name, pk):
+        with self._lock:
+            self.index.remove((name, pk))
+
+    def search(self, question, k=None):
+        version = data_version()
+        # Fingerprints are only compared when something was written, or now and then as a safety net
+        if version != self._checked_version or time.monotonic() - self._checked_at > settings.CHATBOT_INDEX_MAX_AGE:
+            self.refresh()
+            self._checked_version = version
+            self._checked_at = time.monotonic()
+        with self._lock:
+            return self.index.search(question, k or settings.CHATBOT_CONTEXT_TOP_K)
+
+
+chat_index = ChatIndex()
+
+CONTEXT_VALUES = {
+    'task': ('title', 'deadline', 'trello_card_id', 'description', 'completed', 'created_at', 'updated_at',
+             'trello_member_id', 'full_name', 'completed_on'),
+    'summary': ('date', 'description'),
+    'member': ('trello_member_id', 'email', 'historical_score', 'name', 'total_tasks_counted'),
+}
+
+
+def _estimate_tokens(record):
+    # Roughly 4 characters per token for English text and JSON
+    return len(str(record)) // 4 + 1
+
+
+def select_context(question, token_budget=None):
+    """Pick the records most relevant to question that fit in token_budget.
+
+    Ranked matches come first; the most recent tasks and summaries fill any
+    budget left, so broad questions still get some context. Records are read
+    fresh by primary key, so scores and statuses are current. Returns
+    {'task': [...], 'summary': [...], 'member': [...]}.
+    """
+    token_budget = token_budget or settings.CHATBOT_CONTEXT_TOKENS
+    ranked = [key for _, key in chat_index.search(question)]
+    recent = [('task', pk) for pk in Task.objects.order_by('-updated_at').values_list('id', flat=True)[:10]]
+    recent += [('summary', pk) for pk in detail_of_everyday.objects.order_by('-date').values_list('id', flat=True)[:7]]
+    candidates = list(dict.fromkeys(ranked + recent))
+
+    wanted = defaultdict(list)
+    for name, pk in candidates:
+        wanted[name].append(pk)
+    records = {}
+    for name, pks in wanted.items():
+        model = SOURCES[name][0]
+        for row in model.objects.filter(pk__in=pks).values('id', *CONTEXT_VALUES[name]):
+            records[(name, row.pop('id'))] = row
+
+    context = {name: [] for name in SOURCES}
+    used = 0
+    for key in candidates:
+        record = records.get(key)
+        if record is None:
+            continue
+        cost = _estimate_tokens(record)
+        if used + cost > token_budget:
+            continue
+        context[key[0]].append(record)
+        used += cost
+    logger.info(f"Chat context: {sum(len(v) for v in context.values())} records, ~{used} tokens, {len(ranked)} matches")
+    return context
+
+
+def render_context(context):
+    # Compact separators, indentation only costs prompt tokens
+    def dump(records):
+        return json.dumps(records, separators=(',', ':'), default=str)
+
+    return (
+        f"Here are some details of tasks:\n{dump(context['task'])}\n\n"
+        f"And here are recent summaries:\n{dump(context['summary'])}"
+        f"Other details:\n{dump(context['member'])}"
+    )
+
+
+def chat_system_context(question):
+    """The chatbot system prompt for question, cached until the data version changes.
+
+    The selection only depends on the question's tokens, so questions that
+    tokenize the same share a snapshot.
+    """
+    digest = hashlib.sha256(' '.join(sorted(set(tokenize(question)))).encode()).hexdigest()[:32]
+    key = f"chat:context:{data_version()}:{digest}"
+    system_context = cache.get(key)
+    if system_context is None:
+        system_context = render_context(select_context(question))
+        cache.set(key, system_context, timeout=settings.CHATBOT_CONTEXT_CACHE_TTL)
+    return system_context
+
+
+@receiver(post_save, sender=Task)
+def index_task(sender, instance, **kwargs):
+    chat_index.update('task', instance)
+    bump_data_version()
+
+
+@receiver(tasks_bulk_changed, sender=Task)
+def index_tasks(sender, tasks, **kwargs):
+    for task in tasks:
+        if task.pk is not None:
+            chat_index.update('task', task)
+    bump_data_version()
+
+
+@receiver(post_save, sender=detail_of_everyday)
+def index_summary(sender, instance, **kwargs):
+    chat_index.update('summary', instance)
+    bump_data_version()
+
+
+@receiver(post_save, sender=TrelloMember)
+def index_member(sender, instance, **kwargs):
+    chat_index.update('member', instance)
+    bump_data_version()
+
+
+@receiver(post_delete, sender=Task)
+@receiver(post_delete, sender=detail_of_everyday)
+@receiver(post_delete, sender=TrelloMember)
+def unindex(sender, instance, **kwargs):
+    name = {Task: 'task', detail_of_everyday: 'summary', TrelloMember: 'member'}[sender]
+    chat_index.remove(name, instance.pk)
+    bump_data_version()
+
+
+@receiver(data_changed)
+def data_updated(sender, **kwargs):
+    bump_data_version()
@@ -0,0 +1,8 @@
+# signals.py
+from django.dispatch import Signal
+
+# Sent by Task.objects.bulk_save(), which skips post_save, with `tasks` the written instances
+tasks_bulk_changed = Signal()
+
+# Sent after rows change through update()/bulk_update(), which skip post_save
+data_changed = Signal()
@@ -1,34 +1,33 @@
 # tasks.py
 from background_task import background
-from openai import OpenAI
+from background_task.models import Task as BgTask
 import requests
 from django.core.mail import send_mail
 from django.utils import timezone
 from django.conf import settings
-from .models import Task, TrelloMember, detail_of_everyday
-from django.contrib.auth.models import User
-from django.utils.dateparse import parse_datetime
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from .models import Task, TaskEscalation, TrelloMember, detail_of_everyday
+from .trello_client import trello
+from .mailer import drain_email_queue, enqueue_emails
+from .metrics import track_outbound
+from .outbox import flush_trello_outbox
+from .llm import client, generate_batch, generate_cached, purge_expired_content
+from .trello_sync import (
+    acquire_sync_lease, claim_pending_sync, consume_sync_needed, full_board_sync, incremental_sync,
+    mark_sync_needed, release_sync_lease,
+)
 import logging
 from django.utils.timezone import localtime
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+BOSS_EMAIL = 'furqanpersonal@gmail.com'  # You can replace this with the actual boss's email
 
-def parse_trello_datetime(due_str):
-    if due_str:
-        dt = parse_datetime(due_str)
-        if dt:
-            return timezone.make_aware(dt) if timezone.is_naive(dt) else dt
-    return None
 
-
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
-
-TRELLO_API_URL = 'https://api.trello.com/1'
-
-# Generate AI email content
-def generate_email_content(task, recipient, is_boss=False):
+# Build the prompt for AI email content, returns (prompt fields, prompt)
+def overdue_email_prompt(task, is_boss=False):
     role = 'boss' if is_boss else 'employee'
     prompt = f'Write a professional email to {role} about the overdue task, which title is: {task.title}. '
     prompt += f'Task details: {task.description}. Deadline was {task.deadline}. '
@@ -37,48 +36,30 @@ def generate_email_content(task, recipient, is_boss=False):
     else:
         prompt += f'write in short/summarized form, to the employee name: "{task.full_name}", to Please complete the task as soon as possible and also tell your task scoring will also go down as you do more delay in task completion'
 
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "You are a helpful management assistant, and you name is 'Douze-bot'."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=280
-    )
-
-    return response.choices[0].message.content.strip()
-
+    fields = {'title': task.title, 'description': task.description, 'deadline': task.deadline,
+              'name': task.user_name if is_boss else task.full_name}
+    return fields, prompt
 
 
-# Generate AI email content
-def generate_email_content_4(task, recipient, is_boss=False):
-     
+def overdue_followup_email_prompt(task, is_boss=False):
     role = 'boss' if is_boss else 'employee'
     prompt = f'Write a professional email to {role} about the overdue task, which title is: {task.title}. '
-    overdue_duration = timezone.now() - task.deadline
-    days_overdue = overdue_duration.days
-    hours_overdue = overdue_duration.seconds // 3600
+    # Whole days only: the email is cached on these fields, hours would make every run a miss
+    days_overdue = (timezone.now() - task.deadline).days
 
-    prompt += f'Task details: {task.description}. Deadline was {task.deadline} and is already overdue by {days_overdue} days and {hours_overdue} hours.'
+    prompt += f'Task details: {task.description}. Deadline was {task.deadline} and is already overdue by {days_overdue} days.'
     if is_boss:
         prompt += f'write in short/summarized form, to the boss name: "Furqan", that Employee {task.user_name} has not completed the task.'
     else:
         prompt += f'write in short/summarized form, to the employee name: "{task.full_name}", to Please complete the task as soon as possible and also tell your task scoring will also go down as you do more delay in task completion.'
 
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "You are a helpful management assistant, and you name is 'Douze-bot'."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=280
-    )
-
-    return response.choices[0].message.content.strip()
+    fields = {'title': task.title, 'description': task.description, 'deadline': task.deadline,
+              'name': task.user_name if is_boss else task.full_name,
+              'days_overdue': days_overdue}
+    return fields, prompt
 
 
-
-def generate_email_content_2(task, recipient, is_boss=False):
+def assigned_email_prompt(task, is_boss=False):
     role = 'boss' if is_boss else 'employee'
     prompt = f'Write a professional email to {role} that the task is assigned which title is: {task.title}. '
     prompt += f'Task details: {task.description}. Deadline is {task.deadline}. '
@@ -87,281 +68,323 @@ def generate_email_content_2(task, recipient, is_boss=False):
     else:
         prompt += f'write in short/summarized form, to the employee name: "{task.full_name}", about the task.'
 
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "You are a helpful management assistant, and you name is 'Douze-bot'."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=280
-    )
-
-    return response.choices[0].message.content.strip()
+    fields = {'title': task.title, 'description': task.description, 'deadline': task.deadline,
+              'name': task.user_name if is_boss else task.full_name}
+    return fields, prompt
 
 
-def generate_email_content_3(task, recipient):
+def completed_email_prompt(task, is_boss=True):
     prompt = f'Write a professional email to a boss that the task is completed which title is: {task.title}. '
     prompt += f'Task details: {task.description}. Deadline was {task.deadline}. '
     
     prompt += f'write in short/summarized form, to the boss name: "Furqan", that Employee {task.user_name} has completed its task.'
 
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "You are a helpful management assistant, and you name is 'Douze-bot'."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=280
-    )
+    fields = {'title': task.title, 'description': task.description, 'deadline': task.deadline,
+              'name': task.user_name}
+    return fields, prompt
 
-    return response.choices[0].message.content.strip()
 
+EMAIL_PROMPTS = {
+    'overdue': overdue_email_prompt,
+    'overdue_followup': overdue_followup_email_prompt,
+    'assigned': assigned_email_prompt,
+    'completed': completed_email_prompt,
+}
 
-# Fetch tasks from Trello (Only triggered by webhook)
-def sync_trello_tasks():
-    logger.info("Starting sync_trello_tasks...")
-    response = requests.get(
-        f"{TRELLO_API_URL}/boards/{settings.TRELLO_BOARD_ID}/cards",
-        params={"key": settings.TRELLO_API_KEY, "token": settings.TRELLO_API_TOKEN},
-    )
 
-    if response.status_code == 200:
-        trello_cards = response.json()
-        trello_card_ids = {card["id"] for card in trello_cards}
-        
-
-        for card in trello_cards:
-            task, created = Task.objects.get_or_create(trello_card_id=card['id'], defaults={
-                'title': card['name'],
-                'description': card.get('desc', ''),
-                'deadline': parse_trello_datetime(card.get('due')) if card.get('due') else None,  # Example deadline
-                'completed': False
-            })
-            
-            # 🔁 Update task details
-            task.title = card['name']
-            task.description = card.get('desc', '')
-            task.deadline = parse_trello_datetime(card.get('due')) if card.get('due') else None
-            
-
-            # ✅ Check if card is in "Done" list
-            list_id = card.get('idList')
-            if list_id:
-                list_response = requests.get(
-                    f"{TRELLO_API_URL}/lists/{list_id}",
-                    params={"key": settings.TRELLO_API_KEY, "token": settings.TRELLO_API_TOKEN},
-                )
-                if list_response.status_code == 200:
-                    list_data = list_response.json()
-                    is_done = list_data['name'].lower() == "done"
-                    
-                    if is_done and not task.completed:
-                        # Task just completed — set completed_on to today
-                        task.completed = True
-                        task.completed_on = timezone.now().date()
-                    elif not is_done:
-                        # Moved out of "Done" list — reset completed status
-                        task.completed = False
-                        task.completed_on = None
-                else:
-                    logger.warning(f"Failed to get list info for list_id: {list_id}")
-
-
-            if 'idMembers' in card and card['idMembers']:
-                trello_member_id = card['idMembers'][0]
-                logger.info(f"Assigning Trello member with ID: {trello_member_id} to task: {task.title}")
-
-                # Fetch full member details
-                member_response = requests.get(
-                    f"{TRELLO_API_URL}/members/{trello_member_id}",
-                    params={"key": settings.TRELLO_API_KEY, "token": settings.TRELLO_API_TOKEN},
-                )
-
-                if member_response.status_code == 200:
-                    logger.info(f"Fetched member info for ID: {trello_member_id}")
-                    member_data = member_response.json()
-                    task.trello_member_id = trello_member_id
-                    task.full_name = member_data.get("fullName", "")
-                    task.user_name = member_data.get("username", "")
-
-                else:
-                    logger.warning(f"Failed to get member info for member_id: {trello_member_id}")
-                    task.trello_member_id = trello_member_id  # still assign ID
-                task.save()
-
-            if not created:
-                task.title = card['name']
-                task.description = card.get('desc', '')
-                task.save()
-
-        # Delete tasks that no longer exist in Trello
-        deleted_tasks = Task.objects.exclude(trello_card_id__in=trello_card_ids)
-        deleted_tasks_count = deleted_tasks.count()
-        deleted_tasks.delete()
-
-        
-
-        logger.info(f"Deleted {deleted_tasks_count} tasks that no longer exist in Trello")
-    else:
-        logger.error(f"Trello API error: {response.status_code} - {response.text}")
+# Generate AI email content
+def generate_email_content(task, recipient, is_boss=False):
+    return generate_cached('overdue', 'boss' if is_boss else 'employee', *overdue_email_prompt(task, is_boss))
+
+
+def generate_email_content_4(task, recipient, is_boss=False):
+    return generate_cached('overdue_followup', 'boss' if is_boss else 'employee', *overdue_followup_email_prompt(task, is_boss))
+
+
+def generate_email_content_2(task, recipient, is_boss=False):
+    return generate_cached('assigned', 'boss' if is_boss else 'employee', *assigned_email_prompt(task, is_boss))
+
+
+def generate_email_content_3(task, recipient):
+    return generate_cached('completed', 'boss', *completed_email_prompt(task))
+
 
+def prefetch_email_contents(kind, tasks, roles=('employee', 'boss')):
+    """Generate every email a scan needs in a few batched LLM calls, keyed by (task id, role)."""
+    build_prompt = EMAIL_PROMPTS[kind]
+    email_requests = {
+        (task.pk, role): build_prompt(task, is_boss=(role == 'boss'))
+        for task in tasks for role in roles
+    }
+    return generate_batch(kind, email_requests)
+
+
+# Fetch tasks from Trello (Only triggered by webhook)
+def sync_trello_tasks(full=False):
+    logger.info("Starting sync_trello_tasks...")
+    # Incremental sync replays board actions since the stored cursor and falls back to a full sync itself
+    return full_board_sync() if full else incremental_sync()
+
+
+
+def member_email():
+    # Correlated subquery, so scanners read tasks and their member's email in one query
+    return Subquery(TrelloMember.objects.filter(trello_member_id=OuterRef('trello_member_id')).values('email')[:1])
+
+
+def iter_task_batches(queryset, batch_size=None):
+    """Yield the queryset in primary key order, one query per batch of rows."""
+    batch_size = batch_size or settings.NOTIFY_BATCH_SIZE
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1].pk
+
+
+def task_email_messages(kind, tasks, subjects):
+    """Build the queued emails of a batch of tasks, `subjects` maps each role to its subject line."""
+    contents = prefetch_email_contents(kind, tasks, roles=tuple(subjects))
+    messages = []
+    for task in tasks:
+        for role, subject in subjects.items():
+            if role == 'boss':
+                recipients = [BOSS_EMAIL]
+            elif task.member_email:
+                recipients = [task.member_email]
+            else:
+                # Handle case where the member's email is not registered
+                logger.error(f"No email found for trello_member_id: {task.trello_member_id}")
+                continue
+            messages.append((subject.format(title=task.title), contents[(task.pk, role)], settings.EMAIL_HOST_USER, recipients))
+    return messages
+
+
+def notify_tasks(kind, queryset, flag, subjects):
+    """Email every assigned task in queryset whose `flag` isn't set yet, then set it.
+
+    Costs a fixed number of queries per batch however many tasks qualify: one
+    read joined to member emails, the batched LLM lookups, one insert into the
+    email queue and one update of the flags.
+    """
+    queryset = queryset.filter(trello_member_id__isnull=False, **{flag: False}).annotate(member_email=member_email())
+    notified = 0
+    for batch in iter_task_batches(queryset):
+        messages = task_email_messages(kind, batch, subjects)
+        with transaction.atomic():
+            enqueue_emails(messages)
+            Task.objects.filter(pk__in=[task.pk for task in batch]).update(**{flag: True})
+        notified += len(batch)
+    logger.info(f"Queued {kind} emails for {notified} tasks")
+    if notified:
+        schedule_email_drain()
+    return notified
 
 
 def check_tasks_():
     logger.info("Running check_tasks()...")
     logger.info(f"Local time: {localtime(timezone.now())}")
-    for task in Task.objects.all():
-        logger.info(f"{task.title} - Deadline: {task.deadline}")
-    overdue_tasks = Task.objects.filter(completed=False, deadline__lt=timezone.now(), email_sent=False)
-    logger.info(f"Found {overdue_tasks.count()} overdue tasks")  # <-- Add this line
-    for task in overdue_tasks:
-        # Fetch employee email based on trello_member_id
-        if task.trello_member_id:
-            try:
-                trello_member = TrelloMember.objects.get(trello_member_id=task.trello_member_id)
-                email = trello_member.email
-                
-                # Send email to the member
-                employee_email_content = generate_email_content(task, 'boss', is_boss=False)
-                send_mail(
-                    f'Task Overdue: {task.title}',
-                    employee_email_content,
-                    settings.EMAIL_HOST_USER,
-                    [email],
-                    fail_silently=False,
-                )
-            except TrelloMember.DoesNotExist:
-                logger.error(f"No email found for trello_member_id: {task.trello_member_id}")
-                # Handle case where the member's email is not registered
-
-            # Notify boss
-            boss_email_content = generate_email_content(task, 'boss', is_boss=True)
-            send_mail(
-                f'Employee Task Overdue: {task.title}',
-                boss_email_content,
-                settings.EMAIL_HOST_USER,
-                ['furqanpersonal@gmail.com'],  # You can replace this with the actual boss's email
-                fail_silently=False,
-            )
-            task.email_sent = True
-            task.save()
-            logger.info(f"Marked email_sent=True for task: {task.title}")
+    return notify_tasks(
+        'overdue',
+        Task.objects.filter(completed=False, deadline__lt=timezone.now()),
+        'email_sent',
+        {'employee': 'Task Overdue: {title}', 'boss': 'Employee Task Overdue: {title}'},
+    )
 
 
 
-def after_deadline_():
-    logger.info("Checking for tasks past deadline + 1 day...")
-    
-    # Tasks that are not completed and deadline was more than 1 day ago
-    deadline_crossed = Task.objects.filter(
+def seed_escalations(now):
+    """Start a follow-up schedule for tasks that became more than a day overdue."""
+    tasks = Task.objects.filter(
         completed=False,
-        deadline__lt=timezone.now() - timezone.timedelta(days=1)
-    )
+        deadline__lt=now - TaskEscalation.STEPS[0],
+        trello_member_id__isnull=False,
+        escalation__isnull=True,
+    ).values_list('pk', 'deadline')
+    escalations = [
+        TaskEscalation(task_id=pk, deadline=deadline, next_escalation_at=TaskEscalation.due_at(deadline, 0))
+        for pk, deadline in tasks
+    ]
+    TaskEscalation.objects.bulk_create(escalations, ignore_conflicts=True)
+    return len(escalations)
 
-    logger.info(f"Found {deadline_crossed.count()} overdue tasks")
 
-    for task in deadline_crossed:
-        logger.warning(f"Task '{task.title}' assigned to {task.user_name} is overdue by more than 1 day!")
-        if task.trello_member_id:
-            try:
-                trello_member = TrelloMember.objects.get(trello_member_id=task.trello_member_id)
-                email = trello_member.email
-                
-                # Send email to the member
-                employee_email_content = generate_email_content_4(task, 'boss', is_boss=False)
-                send_mail(
-                    f'Task Overdue: {task.title}',
-                    employee_email_content,
-                    settings.EMAIL_HOST_USER,
-                    [email],
-                    fail_silently=False,
-                )
-            
-            except TrelloMember.DoesNotExist:
-                logger.error(f"No email found for trello_member_id: {task.trello_member_id}")
-                # Handle case where the member's email is not registered
+def after_deadline_():
+    logger.info("Checking for due overdue follow-ups...")
+    now = timezone.now()
+    seeded = seed_escalations(now)
+
+    # Only escalations whose next reminder is due, oldest first, at most one batch per run
+    due = list(
+        TaskEscalation.objects.select_related('task')
+        .annotate(member_email=Subquery(
+            TrelloMember.objects.filter(trello_member_id=OuterRef('task__trello_member_id')).values('email')[:1]
+        ))
+        .filter(next_escalation_at__lte=now)
+        .order_by('next_escalation_at')[:settings.ESCALATION_BATCH_SIZE]
+    )
+    finished, to_send, rescheduled = [], [], []
+    for escalation in due:
+        task = escalation.task
+        if task.completed or not task.deadline or not task.trello_member_id:
+            finished.append(escalation.pk)
+            continue
+        if task.deadline != escalation.deadline:
+            escalation.restart(task.deadline)
+            if escalation.next_escalation_at > now:
+                rescheduled.append(escalation)
+                continue
+        task.member_email = escalation.member_email
+        to_send.append(escalation)
+
+    logger.info(f"Found {len(to_send)} due follow-ups ({seeded} new overdue tasks)")
+    messages = task_email_messages(
+        'overdue_followup',
+        [escalation.task for escalation in to_send],
+        {'employee': 'Task Overdue: {title}', 'boss': 'Employee Task Overdue: {title}'},
+    )
+    for escalation in to_send:
+        escalation.advance(now)
 
-            # Notify boss
-            boss_email_content = generate_email_content_4(task, 'boss', is_boss=True)
-            send_mail(
-                f'Employee Task Overdue: {task.title}',
-                boss_email_content,
-                settings.EMAIL_HOST_USER,
-                ['furqanpersonal@gmail.com'],  # You can replace this with the actual boss's email
-                fail_silently=False,
-            )
-            logger.info(f"Mail sent")
+    with transaction.atomic():
+        enqueue_emails(messages)
+        TaskEscalation.objects.bulk_update(
+            to_send + rescheduled, ['level', 'deadline', 'next_escalation_at', 'last_sent_at']
+        )
+    if finished:
+        # Completed or unassigned tasks, a new schedule is seeded if they become overdue again
+        TaskEscalation.objects.filter(pk__in=finished).delete()
+    if to_send:
+        schedule_email_drain()
 
 
 
 def assigned_task():
     logger.info("After webhook triggered")
-    new_tasks = Task.objects.filter(completed=False, email_sent_2=False)
-    for task in new_tasks:
-        # Fetch employee email based on trello_member_id
-        if task.trello_member_id:
-            try:
-                trello_member = TrelloMember.objects.get(trello_member_id=task.trello_member_id)
-                email = trello_member.email
-                
-                # Send email to the member
-                employee_email_content = generate_email_content_2(task, 'boss', is_boss=False)
-                send_mail(
-                    f'Assigned task : {task.title}',
-                    employee_email_content,
-                    settings.EMAIL_HOST_USER,
-                    [email],
-                    fail_silently=False,
-                )
-            except TrelloMember.DoesNotExist:
-                logger.error(f"No email found for trello_member_id: {task.trello_member_id}")
-                # Handle case where the member's email is not registered
-
-            # Notify boss
-            boss_email_content = generate_email_content_2(task, 'boss', is_boss=True)
-            send_mail(
-                f'Task assigned to employee : {task.title}',
-                boss_email_content,
-                settings.EMAIL_HOST_USER,
-                ['furqanpersonal@gmail.com'],  # You can replace this with the actual boss's email
-                fail_silently=False,
-            )
-            task.email_sent_2 = True
-            task.save()
-            logger.info(f"Marked email_sent=True for task: {task.title}")
+    return notify_tasks(
+        'assigned',
+        Task.objects.filter(completed=False),
+        'email_sent_2',
+        {'employee': 'Assigned task : {title}', 'boss': 'Task assigned to employee : {title}'},
+    )
 
 
 def task_completion():
     logger.info("After webhook triggered")
-    completed_tasks = Task.objects.filter(completed=True, email_sent_3=False)
-    for task in completed_tasks:
-        # Fetch employee email based on trello_member_id
-        if task.trello_member_id:
-            boss_email_content = generate_email_content_3(task, 'boss')
-            send_mail(
-                f'Task is completed : {task.title}',
-                boss_email_content,
-                settings.EMAIL_HOST_USER,
-                ['furqanpersonal@gmail.com'],  # You can replace this with the actual boss's email
-                fail_silently=False,
-            )
-            task.email_sent_3= True
-            task.save()
-            logger.info(f"Marked email_sent=True for task: {task.title}")
+    return notify_tasks(
+        'completed',
+        Task.objects.filter(completed=True),
+        'email_sent_3',
+        {'boss': 'Task is completed : {title}'},
+    )
 
 
 # Register a Trello Webhook
 def create_trello_webhook():
-    url = "https://api.trello.com/1/webhooks"
     data = {
-        "key": settings.TRELLO_API_KEY,
-        "token": settings.TRELLO_API_TOKEN,
-        "callbackURL": "https://your-django-app.com/trello-webhook/",
+        "callbackURL": settings.TRELLO_WEBHOOK_CALLBACK_URL,
         "idModel": settings.TRELLO_BOARD_ID
     }
-    response = requests.post(url, data=data)
+    response = trello.post("webhooks", data=data)
     return response.json()
 
+
+# Ensure Trello Webhook is registered (called once at startup)
+def ensure_trello_webhook():
+    trello_webhooks = trello.get(f"tokens/{settings.TRELLO_API_TOKEN}/webhooks").json()
+
+    existing_webhook = any(
+        wh.get("callbackURL") == settings.TRELLO_WEBHOOK_CALLBACK_URL
+        for wh in trello_webhooks
+    )
+    if not existing_webhook:
+        logger.info("Registering Trello webhook...")
+        create_trello_webhook()
+    return existing_webhook
+
+
+def request_trello_sync(sync_needed=True):
+    # Deliveries arriving while a run is already queued ride along with it
+    with transaction.atomic():
+        if not claim_pending_sync(sync_needed):
+            return False
+        # Queued in the same transaction, if that fails the claim rolls back instead of blocking later runs
+        process_trello_webhook(schedule=settings.TRELLO_WEBHOOK_DEBOUNCE)
+    return True
+
+
+def run_trello_sync():
+    if not acquire_sync_lease():
+        # Another worker is syncing, keep this run pending until it's done
+        logger.info("Trello sync already running, retrying later")
+        process_trello_webhook(schedule=settings.TRELLO_WEBHOOK_DEBOUNCE)
+        return None
+
+    try:
+        # Webhook payloads already applied in the request leave only the notifications to do
+        stats = None
+        if consume_sync_needed():
+            try:
+                stats = sync_trello_tasks()
+            except Exception:
+                # Not synced yet: keep the request, the task's retry (or the next run) replays it
+                mark_sync_needed()
+                raise
+            if stats.get('error'):
+                mark_sync_needed()
+                raise RuntimeError(f"Trello sync failed, will retry: {dict(stats)}")
+        assigned_task()
+        task_completion()
+        return stats
+    finally:
+        release_sync_lease()
+
+
+@background(schedule=5)
+def process_trello_webhook():
+    logger.info("Processing queued Trello webhook sync...")
+    run_trello_sync()
+
+def schedule_email_drain(at=None):
+    # One queued drain is enough, it keeps sending until the queue is empty. Only drains
+    # due by `at` count, new emails shouldn't wait behind one queued for a retry backoff
+    at = at or timezone.now()
+    if not BgTask.objects.filter(
+        task_name='home.tasks.send_queued_emails', locked_by__isnull=True, run_at__lte=at
+    ).exists():
+        send_queued_emails(schedule=at)
+
+
+@background(schedule=0)
+def send_queued_emails():
+    logger.info("Draining outbound email queue...")
+    _, _, next_attempt_at = drain_email_queue()
+    if next_attempt_at is not None:
+        # Come back for emails waiting out a retry backoff, like push_trello_outbox
+        schedule_email_drain(max(next_attempt_at, timezone.now()))
+
+
+def schedule_outbox_flush(at=None):
+    # Like the email drain, one queued flush keeps going until nothing is due, and
+    # new changes don't wait behind a flush queued for a retry backoff
+    at = at or timezone.now()
+    if not BgTask.objects.filter(
+        task_name='home.tasks.push_trello_outbox', locked_by__isnull=True, run_at__lte=at
+    ).exists():
+        push_trello_outbox(schedule=at)
+
+
+@background(schedule=0)
+def push_trello_outbox():
+    logger.info("Flushing Trello outbox...")
+    _, _, next_attempt_at = flush_trello_outbox()
+    if next_attempt_at is not None:
+        # Come back for changes waiting out a retry backoff
+        schedule_outbox_flush(max(next_attempt_at, timezone.now()))
+
+
 @background(schedule=60)
 def check_tasks():
     logger.info("........")
@@ -382,8 +405,9 @@ def summarize_yesterday_and_email_boss():
     api_url = f"https://douzebook-api-seven.vercel.app/get-user-update-by-date?date={yesterday}"
 
     try:
-        response = requests.get(api_url)
-        response.raise_for_status()
+        with track_outbound('douzebook', 'get-user-update-by-date'):
+            response = requests.get(api_url)
+            response.raise_for_status()
         updates = response.json()
         logger.info(f"Fetched updates for {yesterday}: {updates}")
     except Exception as e:
@@ -394,14 +418,15 @@ def summarize_yesterday_and_email_boss():
     prompt = f"Summarize the following work updates for the boss Furqan from {yesterday}:\n\n{updates}"
 
     try:
-        gpt_response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant who summarizes daily work for a boss."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=250
-        )
+        with track_outbound('openai', 'chat.completions'):
+            gpt_response = client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant who summarizes daily work for a boss."},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=250
+            )
 
         summary = gpt_response.choices[0].message.content.strip()
 
@@ -418,13 +443,14 @@ def summarize_yesterday_and_email_boss():
 
     # Email it to boss
     try:
-        send_mail(
-            subject=f"Daily Work Summary for {yesterday}",
-            message=summary,
-            from_email=settings.EMAIL_HOST_USER,
-            recipient_list=['furqanpersonal@gmail.com'],  # replace if needed
-            fail_silently=False,
-        )
+        with track_outbound('smtp', 'send_mail'):
+            send_mail(
+                subject=f"Daily Work Summary for {yesterday}",
+                message=summary,
+                from_email=settings.EMAIL_HOST_USER,
+                recipient_list=['furqanpersonal@gmail.com'],  # replace if needed
+                fail_silently=False,
+            )
         logger.info("Successfully sent daily summary to the boss.")
     except Exception as e:
         logger.error(f"Failed to send summary email: {e}")
@@ -435,4 +461,5 @@ def summarize_yesterday_and_email_boss():
 def summarize_yesterday_():
     logger.info("Scheduling summarize_yesterday_and_email_boss...")
     summarize_yesterday_and_email_boss()
+    purge_expired_content()
 
@@ -1,3 +1,941 @@
-from django.test import TestCase
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import random
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import urlencode
 
-# Create your tests here.
+import requests
+from asgiref.sync import sync_to_async
+from background_task.models import Task as BgTask
+from django.conf import settings
+from django.db import NotSupportedError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import llm, metrics, views
+from .llm import content_key
+from .mailer import enqueue_email
+from .models import (
+    DataVersion, GeneratedContent, OutboundEmail, Task, TaskEscalation, TrelloMember, TrelloOutbox, TrelloSyncState,
+    detail_of_everyday,
+)
+from .outbox import flush_trello_outbox
+from .scheduler import DeadlineScheduler
+from .scoring import apply_task_scores, recompute_scores
+from .search_index import ChatIndex, data_version
+from .tasks import (
+    BOSS_EMAIL, after_deadline_, check_tasks_, ensure_trello_webhook, iter_task_batches, member_email,
+    overdue_followup_email_prompt, push_trello_outbox, request_trello_sync, run_trello_sync, schedule_email_drain,
+    schedule_outbox_flush, send_queued_emails,
+)
+from .trello_client import atrello, backoff_delay, trello
+from .trello_simulator import TrelloSimulator
+from .trello_sync import SyncStats, incremental_sync
+from .trello_utils import DONE_LIST_ID, board_lists_cache, board_members_cache, member_cache
+
+
+class DelayScoreAnnotationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(20240611)
+        now = timezone.now()
+        tasks = []
+        for i in range(400):
+            deadline = now + datetime.timedelta(minutes=rng.randint(-60 * 24 * 60, 60 * 24 * 60))
+            completed = rng.random() < 0.7
+            completed_on = None
+            if completed and rng.random() < 0.9:
+                # Spread completions from early to well past the point where the score reaches 0
+                completed_on = deadline.astimezone(datetime.timezone.utc).date() + datetime.timedelta(days=rng.randint(-5, 30))
+            tasks.append(Task(
+                title=f'Task {i}',
+                description='',
+                trello_member_id=rng.choice(['m1', 'm2', None]),
+                deadline=deadline if rng.random() < 0.9 else None,
+                completed=completed,
+                completed_on=completed_on,
+                manual_score_override=rng.choice([None] * 6 + [0.0, 2.5, 9.0]),
+            ))
+        Task.objects.bulk_create(tasks)
+
+    def test_annotation_matches_get_delay_score(self):
+        tasks = list(Task.objects.with_delay_score())
+        self.assertEqual(len(tasks), 400)
+        for task in tasks:
+            expected = task.get_delay_score()
+            if expected is None:
+                self.assertIsNone(task.delay_score, task.pk)
+            else:
+                self.assertAlmostEqual(task.delay_score, expected, msg=task.pk)
+
+    def test_scores_api_sorts_and_paginates_in_sql(self):
+        expected = sorted(
+            (task.get_delay_score(), task.pk) for task in Task.objects.all() if task.get_delay_score() is not None
+        )
+        response = self.client.get('/api/scores/', {'page': 2, 'page_size': 25})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['total'], len(expected))
+        self.assertEqual([row['id'] for row in data['results']], [pk for _, pk in expected[25:50]])
+
+    def test_scores_api_groups_by_member(self):
+        response = self.client.get('/api/scores/', {'group': 'member', 'sort': '-tasks'})
+        self.assertEqual(response.status_code, 200)
+        for row in response.json()['results']:
+            scores = [
+                task.get_delay_score() for task in Task.objects.filter(trello_member_id=row['trello_member_id'])
+                if task.get_delay_score() is not None
+            ]
+            self.assertEqual(row['task_count'], len(scores))
+            self.assertAlmostEqual(row['avg_score'], sum(scores) / len(scores))
+
+
+
+class TaskScoringTests(TestCase):
+    def setUp(self):
+        self.member = TrelloMember.objects.create(trello_member_id='m1', email='m1@example.com')
+        self.deadline = datetime.datetime(2030, 1, 10, 12, tzinfo=datetime.timezone.utc)
+
+    def task(self, card_id, late_days=None, **fields):
+        completed_on = self.deadline.date() + datetime.timedelta(days=late_days) if late_days is not None else None
+        return Task(
+            title=card_id, description='', trello_card_id=card_id, trello_member_id='m1', deadline=self.deadline,
+            completed=completed_on is not None, completed_on=completed_on, **fields,
+        )
+
+    def test_bulk_save_scores_only_changed_tasks(self):
+        Task.objects.bulk_save([self.task('done', late_days=0), self.task('open')], ['title'])
+        self.member.refresh_from_db()
+        self.assertEqual((self.member.total_tasks_counted, self.member.score_sum), (1, 10))
+
+        tasks = list(Task.objects.order_by('trello_card_id'))
+        # Triggers come from the snapshot taken when the rows were loaded, not from re-reading them
+        with self.assertNumQueries(0):
+            self.assertEqual([task.score_triggered() for task in tasks], [False, False])
+        self.assertEqual(Task.objects.bulk_save(tasks, ['title']), 0)
+
+        done, still_open = tasks
+        still_open.completed, still_open.completed_on = True, self.deadline.date() + datetime.timedelta(days=2)
+        self.assertEqual([task.score_triggered() for task in tasks], [False, True])
+        self.assertEqual(Task.objects.bulk_save(tasks, ['completed', 'completed_on']), 1)
+        self.member.refresh_from_db()
+        self.assertEqual((self.member.total_tasks_counted, self.member.score_sum), (2, 19))
+        # Saved values become the new snapshot
+        self.assertFalse(any(task.score_triggered() for task in tasks))
+
+    def assertMemberScore(self, total, score_sum, average):
+        self.member.refresh_from_db()
+        self.assertEqual((self.member.total_tasks_counted, self.member.score_sum), (total, score_sum))
+        self.assertEqual(self.member.historical_score, average)
+
+    def test_scores_are_added_once(self):
+        on_time, late = self.task('on-time', late_days=0), self.task('late', late_days=2)
+        Task.objects.bulk_create([on_time, late])
+        # Counted by another worker after self.member was loaded, increments must not overwrite it
+        TrelloMember.objects.filter(pk=self.member.pk).update(score_sum=5, total_tasks_counted=1)
+
+        self.assertEqual(apply_task_scores([on_time, late]), 2)
+        self.assertMemberScore(3, 24, 8.0)
+        self.assertFalse(Task.objects.filter(score_counted=False).exists())
+
+        # A stale copy of an already counted task, like a second sync scoring it at the same time
+        stale = Task.objects.get(pk=late.pk)
+        stale.score_counted = False
+        self.assertEqual(apply_task_scores([stale]), 0)
+        self.assertMemberScore(3, 24, 8.0)
+
+    def test_override_replaces_the_counted_score(self):
+        on_time, late = self.task('on-time', late_days=0), self.task('late', late_days=2)
+        Task.objects.bulk_create([on_time, late])
+        apply_task_scores([on_time, late])
+
+        late.manual_score_override = 2.0
+        late.save()
+
+        self.assertMemberScore(2, 12, 6.0)
+
+    def test_recompute_rebuilds_totals_from_tasks(self):
+        Task.objects.bulk_create([self.task('on-time', late_days=0), self.task('late', late_days=2), self.task('open')])
+        TrelloMember.objects.filter(pk=self.member.pk).update(score_sum=100, total_tasks_counted=7)
+
+        self.assertEqual(recompute_scores(), 1)
+
+        self.assertMemberScore(2, 19, 9.5)
+        self.assertEqual(
+            dict(Task.objects.values_list('trello_card_id', 'score_counted')),
+            {'on-time': True, 'late': True, 'open': False},
+        )
+
+
+class DeadlineSchedulerTests(TestCase):
+    def test_poll_picks_up_tasks_saved_by_other_processes(self):
+        scheduler = DeadlineScheduler(handler=mock.Mock(), poll_interval=10)
+        soon = timezone.now() + datetime.timedelta(hours=1)
+        task = Task.objects.create(title='Later', description='', trello_member_id='m1', deadline=soon + datetime.timedelta(days=1))
+        scheduler.rebuild()
+        self.assertEqual(scheduler._next_deadline(), task.deadline)
+
+        # Written without signals reaching this scheduler, like a save in a web worker
+        Task.objects.filter(pk=task.pk).update(deadline=soon, updated_at=timezone.now() + datetime.timedelta(seconds=1))
+        scheduler.poll()
+
+        self.assertEqual(scheduler._next_deadline(), soon)
+
+
+class TaskListApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Task.objects.bulk_create([Task(title=f'Task {i}', description='') for i in range(150)])
+
+    def test_without_limit_or_cursor_every_task_is_returned(self):
+        data = self.client.get('/api/tasks/').json()
+        self.assertEqual(list(data), ['tasks'])
+        self.assertEqual(len(data['tasks']), 150)
+
+    def test_limit_pages_through_tasks(self):
+        first = self.client.get('/api/tasks/', {'limit': 100, 'fields': 'title'}).json()
+        second = self.client.get('/api/tasks/', {'cursor': first['next_cursor'], 'fields': 'title'}).json()
+        self.assertEqual((len(first['tasks']), len(second['tasks'])), (100, 50))
+        self.assertIsNone(second['next_cursor'])
+
+
+class ChatIndexTests(TestCase):
+    def test_saves_bump_the_version_once_committed(self):
+        before = data_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Task.objects.create(title='New', description='')
+            self.assertEqual(data_version(), before)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(data_version(), before + 1)
+
+    def test_one_bump_per_transaction(self):
+        before = data_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Task.objects.create(title='First', description='')
+            detail_of_everyday.objects.create(date=datetime.date(2030, 1, 1), description='Quiet day')
+            try:
+                with transaction.atomic():
+                    TrelloMember.objects.create(trello_member_id='m1', email='m1@example.com')
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(data_version(), before + 1)
+
+    def test_rolled_back_savepoint_does_not_swallow_the_bump(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            try:
+                with transaction.atomic():
+                    Task.objects.create(title='Rolled back', description='')
+                    raise ValueError
+            except ValueError:
+                pass
+            Task.objects.create(title='Kept', description='')
+        self.assertEqual(len(callbacks), 1)
+
+    def test_missing_version_is_reseeded_past_old_values(self):
+        old = data_version()
+        DataVersion.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            Task.objects.create(title='New', description='')
+        self.assertGreater(data_version(), old)
+
+    def test_summary_edits_from_other_processes_are_indexed(self):
+        summary = detail_of_everyday.objects.create(date=datetime.date(2030, 1, 1), description='Quiet day')
+        index = ChatIndex()
+        index.refresh()
+        # A bulk update() skips the signals, like an edit saved by another process
+        detail_of_everyday.objects.filter(pk=summary.pk).update(
+            description='Server migration finished', updated_at=timezone.now() + datetime.timedelta(seconds=1),
+        )
+        index.refresh()
+        self.assertEqual([key for _, key in index.index.search('migration', 5)], [('summary', summary.pk)])
+
+    def test_refresh_reloads_only_changed_rows(self):
+        detail_of_everyday.objects.bulk_create(
+            [detail_of_everyday(date=datetime.date(2030, 1, day), description=f'Day {day}') for day in range(1, 11)]
+        )
+        TrelloMember.objects.create(trello_member_id='m1', email='m1@example.com', name='Ada')
+        index = ChatIndex()
+        index.refresh()
+
+        with mock.patch.object(index, '_load', wraps=index._load) as load:
+            index.refresh()
+            load.assert_not_called()
+            TrelloMember.objects.filter(trello_member_id='m1').update(
+                name='Grace', updated_at=timezone.now() + datetime.timedelta(seconds=1),
+            )
+            index.refresh()
+        self.assertEqual([call.args[0] for call in load.call_args_list], ['member'])
+        self.assertEqual(len(index.index.search('grace', 5)), 1)
+        self.assertEqual(index.index.search('ada', 5), [])
+
+
+class AsyncTrelloViewTests(TestCase):
+    def setUp(self):
+        self.trello = TrelloSimulator(board_id=settings.TRELLO_BOARD_ID).start()
+        self.addCleanup(self.trello.stop)
+        for client in (atrello, trello):
+            patcher = mock.patch.object(client, 'base_url', self.trello.base_url)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        board_members_cache.invalidate()
+        self.addCleanup(board_members_cache.invalidate)
+
+    async def test_members_list_is_cached(self):
+        self.trello.add_member('m1', 'Ada Lovelace')
+        for _ in range(2):
+            response = await self.async_client.get('/api/members/')
+            self.assertEqual(response.json(), {'members': [{'id': 'm1', 'fullName': 'Ada Lovelace'}]})
+        self.assertEqual(self.trello.request_count('GET boards/{id}/members'), 1)
+
+    async def test_assign_creates_card(self):
+        response = await self.async_client.post(
+            '/assign-task/', json.dumps({'title': 'Write report', 'description': 'Q3', 'members': ['m1']}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.trello.cards, {})
+        await sync_to_async(flush_trello_outbox)()
+        [card] = self.trello.cards.values()
+        self.assertEqual((card['name'], card['idMembers']), ('Write report', ['m1']))
+        self.assertTrue(card['due'].endswith('Z'))
+
+    async def test_update_saves_task_and_card(self):
+        card = self.trello.add_card(name='Old')
+        task = await Task.objects.acreate(title='Old', description='', trello_card_id=card['id'])
+        response = await self.async_client.put(
+            f"/api/tasks/update/{card['id']}/", json.dumps({'title': 'New', 'completed': True}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.json(), {'status': 'updated'})
+        await task.arefresh_from_db()
+        self.assertEqual((task.title, task.completed), ('New', True))
+        await sync_to_async(flush_trello_outbox)()
+        self.assertEqual(self.trello.cards[card['id']]['name'], 'New')
+
+    async def test_update_missing_task(self):
+        response = await self.async_client.put('/api/tasks/update/nope/', '{}', content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.trello.request_count(), 0)
+
+    async def test_delete_removes_card_and_task(self):
+        card = self.trello.add_card(name='Gone')
+        await Task.objects.acreate(title='Gone', description='', trello_card_id=card['id'])
+        response = await self.async_client.delete(f"/api/tasks/delete/{card['id']}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(card['id'], self.trello.cards)
+        self.assertFalse(await Task.objects.filter(trello_card_id=card['id']).aexists())
+
+    async def test_bulk_validates_everything_first(self):
+        response = await self.async_client.post(
+            '/api/tasks/bulk/', json.dumps({'tasks': [{'title': 'Fine'}, {'deadline': 'soon'}]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([item['index'] for item in response.json()['invalid']], [1])
+        self.assertEqual(self.trello.request_count(), 0)
+
+    async def test_bulk_rejects_repeated_card_ids(self):
+        card = self.trello.add_card(name='Old')
+        specs = [{'card_id': card['id'], 'title': 'One'}, {'card_id': card['id'], 'title': 'Two'}]
+        response = await self.async_client.post(
+            '/api/tasks/bulk/', json.dumps({'tasks': specs}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([item['index'] for item in response.json()['invalid']], [1])
+        self.assertEqual(self.trello.request_count(), 0)
+
+    async def test_bulk_reads_naive_deadline_as_utc(self):
+        response = await self.async_client.post(
+            '/api/tasks/bulk/', json.dumps({'tasks': [{'title': 'a', 'deadline': '2030-01-01T09:00:00'}]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.json()['succeeded'], 1)
+        task = await Task.objects.aget(title='a')
+        self.assertEqual(task.deadline, datetime.datetime(2030, 1, 1, 9, tzinfo=datetime.timezone.utc))
+        card = next(iter(self.trello.cards.values()))
+        self.assertEqual(card['due'], '2030-01-01T09:00:00.000Z')
+
+    async def test_bulk_partial_update_keeps_other_fields(self):
+        self.trello.add_member('m1', 'Ada Lovelace')
+        card = self.trello.add_card(
+            name='Report', desc='Q3', idList=DONE_LIST_ID, idMembers=['m1'], due='2030-01-01T09:00:00.000Z'
+        )
+        deadline = datetime.datetime(2030, 1, 1, 9, tzinfo=datetime.timezone.utc)
+        done_on = datetime.date(2029, 12, 30)
+        await Task.objects.acreate(
+            title='Report', description='Q3', trello_card_id=card['id'], trello_member_id='m1',
+            deadline=deadline, completed=True, completed_on=done_on,
+        )
+
+        response = await self.async_client.post(
+            '/api/tasks/bulk/', json.dumps({'tasks': [{'card_id': card['id'], 'description': 'Q3 numbers'}]}),
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.json()['succeeded'], 1)
+        card = self.trello.cards[card['id']]
+        self.assertEqual(
+            (card['name'], card['desc'], card['idList'], card['idMembers'], card['due']),
+            ('Report', 'Q3 numbers', DONE_LIST_ID, ['m1'], '2030-01-01T09:00:00.000Z'),
+        )
+        task = await Task.objects.aget(trello_card_id=card['id'])
+        self.assertEqual(
+            (task.title, task.description, task.deadline, task.completed, task.completed_on, task.trello_member_id),
+            ('Report', 'Q3 numbers', deadline, True, done_on, 'm1'),
+        )
+
+    async def test_bulk_writes_cards_and_tasks(self):
+        self.trello.add_member('m1', 'Ada Lovelace')
+        existing = self.trello.add_card(name='Old')
+        await Task.objects.acreate(title='Old', description='', trello_card_id=existing['id'])
+        specs = [{'title': f'Import {i}', 'members': ['m1'], 'deadline': '2030-01-01T09:00:00Z'} for i in range(12)]
+        specs.append({'card_id': existing['id'], 'title': 'Renamed', 'completed': True})
+        specs.append({'card_id': 'missing', 'title': 'Nope'})
+
+        response = await self.async_client.post(
+            '/api/tasks/bulk/', json.dumps({'tasks': specs}), content_type='application/json'
+        )
+
+        data = response.json()
+        self.assertEqual((data['succeeded'], data['failed']), (13, 1))
+        self.assertEqual([r['status'] for r in data['results']], ['created'] * 12 + ['updated', 'error'])
+        self.assertEqual(await Task.objects.filter(title__startswith='Import', full_name='Ada Lovelace').acount(), 12)
+        renamed = await Task.objects.aget(trello_card_id=existing['id'])
+        self.assertEqual((renamed.title, renamed.completed), ('Renamed', True))
+        self.assertEqual(await Task.objects.acount(), 13)
+
+
+class ChatbotStreamTests(TestCase):
+    class FakeStream:
+        def __init__(self, tokens):
+            self.tokens = tokens
+            self.closed = False
+
+        async def __aiter__(self):
+            for token in self.tokens:
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+
+        async def close(self):
+            self.closed = True
+
+    async def test_stream_relays_tokens_as_they_arrive(self):
+        stream = self.FakeStream(['Two ', 'tasks'])
+        create = mock.AsyncMock(return_value=stream)
+        with mock.patch.object(views.client.chat.completions, 'create', create):
+            response = await self.async_client.post(
+                '/chatbot_api/', json.dumps({'question': 'What is overdue?', 'stream': True}),
+                content_type='application/json',
+            )
+            self.assertTrue(response.is_async)
+            body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(
+            body, 'data: {"token": "Two "}\n\ndata: {"token": "tasks"}\n\nevent: done\ndata: {}\n\n'
+        )
+        self.assertTrue(stream.closed)
+        self.assertTrue(create.call_args.kwargs['stream'])
+
+
+def openai_reply(content):
+    usage = SimpleNamespace(prompt_tokens=100, completion_tokens=20)
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+class GeneratedContentCacheTests(TestCase):
+    def setUp(self):
+        reply = openai_reply(json.dumps({'emails': [{'id': '1', 'employee': 'Please finish the report'}]}))
+        patcher = mock.patch.object(llm.client.chat.completions, 'create', return_value=reply)
+        self.create = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.requests = {('1', 'employee'): ({'title': 'Report'}, 'Write an email about Report')}
+
+    def test_batch_upsert_names_no_conflict_target_where_unsupported(self):
+        # MySQL raises NotSupportedError for unique_fields on conflict updates
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                mock.patch.object(GeneratedContent.objects, 'bulk_create') as bulk_create:
+            llm.generate_batch('overdue', self.requests)
+        self.assertIsNone(bulk_create.call_args.kwargs['unique_fields'])
+        self.assertTrue(bulk_create.call_args.kwargs['update_conflicts'])
+
+    def test_failed_cache_write_still_returns_the_emails(self):
+        with mock.patch.object(GeneratedContent.objects, 'bulk_create', side_effect=NotSupportedError('no upsert')):
+            contents = llm.generate_batch('overdue', self.requests)
+        self.assertEqual(contents, {('1', 'employee'): 'Please finish the report'})
+        self.assertEqual(self.create.call_count, 1)
+
+    def test_expired_entries_are_replaced(self):
+        key = content_key('overdue', 'employee', {'title': 'Report'})
+        GeneratedContent.objects.create(
+            key=key, kind='overdue', content='Old', expires_at=timezone.now() - datetime.timedelta(days=1)
+        )
+        llm.generate_batch('overdue', self.requests)
+        self.assertEqual(GeneratedContent.objects.get(key=key).content, 'Please finish the report')
+
+    def test_followup_emails_share_a_cache_key_within_a_day(self):
+        deadline = timezone.now() - datetime.timedelta(days=2)
+        task = Task(title='Report', description='Q3', deadline=deadline, full_name='Ada Lovelace')
+        keys = []
+        for hours in (1, 5, 23):
+            with mock.patch('home.tasks.timezone.now', return_value=deadline + datetime.timedelta(days=2, hours=hours)):
+                fields, _ = overdue_followup_email_prompt(task)
+            keys.append(content_key('overdue_followup', 'employee', fields))
+        self.assertEqual(len(set(keys)), 1)
+
+class EmailQueueTests(TestCase):
+    def test_failed_email_gets_a_drain_at_its_retry_time(self):
+        enqueue_email('Overdue', 'Body', 'boss@example.com', ['member@example.com'])
+        connection = mock.Mock(**{'send_messages.side_effect': OSError('SMTP down')})
+        with mock.patch('home.mailer.get_connection', return_value=connection):
+            send_queued_emails.now()
+
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.STATUS_PENDING, 1))
+        retry = BgTask.objects.get(task_name='home.tasks.send_queued_emails')
+        self.assertEqual(retry.run_at, email.next_attempt_at)
+
+        # New emails don't wait for the retry
+        schedule_email_drain()
+        self.assertEqual(BgTask.objects.filter(task_name='home.tasks.send_queued_emails').count(), 2)
+
+
+    def test_overdue_emails_use_the_joined_member_email(self):
+        TrelloMember.objects.create(trello_member_id='m1', email='m1@example.com')
+        overdue = timezone.now() - datetime.timedelta(hours=1)
+        Task.objects.bulk_create(
+            [Task(title=f'Known {i}', description='', trello_member_id='m1', deadline=overdue) for i in range(3)]
+            + [Task(title='Unknown', description='', trello_member_id='m2', deadline=overdue)]
+        )
+
+        batches = list(iter_task_batches(Task.objects.annotate(member_email=member_email()), batch_size=3))
+        self.assertEqual([len(batch) for batch in batches], [3, 1])
+        self.assertEqual([task.member_email for task in batches[0] + batches[1]], ['m1@example.com'] * 3 + [None])
+
+        with override_settings(NOTIFY_BATCH_SIZE=2), \
+                mock.patch('home.tasks.generate_batch', side_effect=lambda kind, requests: dict.fromkeys(requests, 'Body')), \
+                CaptureQueriesContext(connection) as queries:
+            self.assertEqual(check_tasks_(), 4)
+
+        # One read joined to member emails per batch of 2, plus the empty read that ends the loop
+        reads = [sql for sql in (query['sql'] for query in queries) if 'FROM "home_task"' in sql and 'home_trellomember' in sql]
+        self.assertEqual(len(reads), 3)
+        recipients = sorted(OutboundEmail.objects.exclude(recipients=BOSS_EMAIL).values_list('recipients', flat=True))
+        self.assertEqual(recipients, ['m1@example.com'] * 3)
+        self.assertEqual(OutboundEmail.objects.filter(recipients=BOSS_EMAIL).count(), 4)
+        self.assertFalse(Task.objects.filter(email_sent=False).exists())
+
+    def run_after_deadline(self, now):
+        with mock.patch('home.tasks.timezone.now', return_value=now), \
+                mock.patch('home.tasks.generate_batch', side_effect=lambda kind, requests: dict.fromkeys(requests, 'Body')):
+            after_deadline_()
+        return TaskEscalation.objects.filter(task__title='Report').first()
+
+    def test_followups_follow_the_escalation_schedule(self):
+        TrelloMember.objects.create(trello_member_id='m1', email='m1@example.com')
+        deadline = datetime.datetime(2030, 1, 10, 12, tzinfo=datetime.timezone.utc)
+        task = Task.objects.create(title='Report', description='', trello_member_id='m1', deadline=deadline)
+        day = datetime.timedelta(days=1)
+
+        self.assertIsNone(self.run_after_deadline(deadline + day / 2))
+        escalation = self.run_after_deadline(deadline + day * 1.5)
+        self.assertEqual((escalation.level, escalation.next_escalation_at), (1, deadline + 3 * day))
+        self.assertEqual(OutboundEmail.objects.count(), 2)
+
+        # Nothing new is due until the third day
+        self.run_after_deadline(deadline + 2 * day)
+        self.assertEqual(OutboundEmail.objects.count(), 2)
+
+        # Down for a week: one reminder, and the weekly step that was missed is skipped
+        escalation = self.run_after_deadline(deadline + 10 * day)
+        self.assertEqual((escalation.level, escalation.next_escalation_at), (3, deadline + 17 * day))
+        self.assertEqual(OutboundEmail.objects.count(), 4)
+
+        # A moved deadline starts the schedule over
+        Task.objects.filter(pk=task.pk).update(deadline=deadline + 16.5 * day)
+        escalation = self.run_after_deadline(deadline + 17 * day)
+        self.assertEqual((escalation.level, escalation.next_escalation_at), (0, deadline + 17.5 * day))
+        self.assertEqual(OutboundEmail.objects.count(), 4)
+
+        Task.objects.filter(pk=task.pk).update(completed=True)
+        self.assertIsNone(self.run_after_deadline(deadline + 18 * day))
+        self.assertEqual(OutboundEmail.objects.count(), 4)
+
+
+class TrelloOutboxTests(TestCase):
+    def setUp(self):
+        self.trello = TrelloSimulator(board_id=settings.TRELLO_BOARD_ID).start()
+        self.addCleanup(self.trello.stop)
+        patcher = mock.patch.object(trello, 'base_url', self.trello.base_url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_edits_to_one_card_are_merged(self):
+        card = self.trello.add_card(name='Draft', desc='')
+        TrelloOutbox.objects.create(op=TrelloOutbox.OP_UPDATE, card_id=card['id'], payload={'name': 'First'})
+        TrelloOutbox.objects.create(op=TrelloOutbox.OP_UPDATE, card_id=card['id'], payload={'name': 'Second', 'desc': 'x'})
+        TrelloOutbox.objects.create(op=TrelloOutbox.OP_CREATE, payload={'name': 'Brand new'})
+
+        sent, failed, next_attempt_at = flush_trello_outbox()
+
+        self.assertEqual((sent, failed, next_attempt_at), (2, 0, None))
+        self.assertEqual(self.trello.request_count('PUT cards/{id}'), 1)
+        self.assertEqual((self.trello.cards[card['id']]['name'], self.trello.cards[card['id']]['desc']), ('Second', 'x'))
+        created = TrelloOutbox.objects.get(op=TrelloOutbox.OP_CREATE)
+        self.assertIn(created.card_id, self.trello.cards)
+        self.assertFalse(TrelloOutbox.objects.exclude(status=TrelloOutbox.STATUS_SENT).exists())
+
+    def test_delete_supersedes_earlier_edits(self):
+        card = self.trello.add_card(name='Doomed')
+        TrelloOutbox.objects.create(op=TrelloOutbox.OP_UPDATE, card_id=card['id'], payload={'name': 'Renamed'})
+        TrelloOutbox.objects.create(op=TrelloOutbox.OP_DELETE, card_id=card['id'])
+
+        flush_trello_outbox()
+
+        self.assertEqual(self.trello.request_count(), 1)
+        self.assertNotIn(card['id'], self.trello.cards)
+
+    def test_failed_change_is_retried_later(self):
+        TrelloOutbox.objects.create(op=TrelloOutbox.OP_UPDATE, card_id='missing', payload={'name': 'x'})
+        with mock.patch.object(trello, 'max_retries', 0), \
+                mock.patch.object(self.trello, 'handle', return_value=(503, 'Service unavailable')):
+            sent, failed, next_attempt_at = flush_trello_outbox()
+
+        self.assertEqual((sent, failed), (0, 1))
+        entry = TrelloOutbox.objects.get()
+        self.assertEqual((entry.status, entry.attempts), (TrelloOutbox.STATUS_PENDING, 1))
+        self.assertEqual(next_attempt_at, entry.next_attempt_at)
+        self.assertGreater(entry.next_attempt_at, timezone.now())
+
+
+    def test_changes_held_by_another_flusher_are_left_alone(self):
+        card = self.trello.add_card(name='Busy')
+        other = self.trello.add_card(name='Idle')
+        claimed_until = timezone.now() + timezone.timedelta(seconds=120)
+        TrelloOutbox.objects.create(
+            op=TrelloOutbox.OP_UPDATE, card_id=card['id'], payload={'name': 'First'}, next_attempt_at=claimed_until
+        )
+        later = TrelloOutbox.objects.create(op=TrelloOutbox.OP_UPDATE, card_id=card['id'], payload={'name': 'Second'})
+        TrelloOutbox.objects.create(op=TrelloOutbox.OP_UPDATE, card_id=other['id'], payload={'name': 'Renamed'})
+
+        sent, failed, _ = flush_trello_outbox()
+
+        self.assertEqual((sent, failed), (1, 0))
+        self.assertEqual((self.trello.cards[card['id']]['name'], self.trello.cards[other['id']]['name']), ('Busy', 'Renamed'))
+        later.refresh_from_db()
+        self.assertEqual((later.status, later.next_attempt_at), (TrelloOutbox.STATUS_PENDING, claimed_until))
+
+    def test_unexpected_error_fails_only_its_call(self):
+        card = self.trello.add_card(name='Draft')
+        TrelloOutbox.objects.create(op=TrelloOutbox.OP_CREATE, payload={'name': 'Brand new'})
+        TrelloOutbox.objects.create(op=TrelloOutbox.OP_UPDATE, card_id=card['id'], payload={'name': 'Final'})
+        handle = self.trello.handle
+
+        def garbled_creates(method, path, params):
+            return (200, 'not json') if method == 'POST' else handle(method, path, params)
+
+        with mock.patch.object(self.trello, 'handle', side_effect=garbled_creates):
+            sent, failed, _ = flush_trello_outbox()
+
+        self.assertEqual((sent, failed), (1, 1))
+        self.assertEqual(self.trello.cards[card['id']]['name'], 'Final')
+        created = TrelloOutbox.objects.get(op=TrelloOutbox.OP_CREATE)
+        self.assertEqual((created.status, created.attempts), (TrelloOutbox.STATUS_FAILED, 1))
+
+    def test_retry_flush_does_not_hold_back_new_changes(self):
+        TrelloOutbox.objects.create(op=TrelloOutbox.OP_UPDATE, card_id='missing', payload={'name': 'x'})
+        with mock.patch.object(trello, 'max_retries', 0), \
+                mock.patch.object(self.trello, 'handle', return_value=(503, 'Service unavailable')):
+            push_trello_outbox.now()
+        retry = BgTask.objects.get(task_name='home.tasks.push_trello_outbox')
+        self.assertEqual(retry.run_at, TrelloOutbox.objects.get().next_attempt_at)
+
+        schedule_outbox_flush()
+        schedule_outbox_flush()
+        self.assertEqual(BgTask.objects.filter(task_name='home.tasks.push_trello_outbox').count(), 2)
+
+class TrelloSyncBudgetTests(TestCase):
+    def setUp(self):
+        self.trello = TrelloSimulator(board_id=settings.TRELLO_BOARD_ID).start()
+        self.addCleanup(self.trello.stop)
+        patcher = mock.patch.object(trello, 'base_url', self.trello.base_url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for cache in (board_lists_cache, board_members_cache, member_cache):
+            cache.invalidate()
+            self.addCleanup(cache.invalidate)
+
+    def _list_id(self, name):
+        return next(trello_list['id'] for trello_list in self.trello.lists.values() if trello_list['name'] == name)
+
+    def test_first_sync_of_large_board(self):
+        self.trello.generate_board(cards=10500)
+
+        stats = incremental_sync()
+
+        # Head of the actions feed, the nested board request, then 1000-card pages
+        self.assertEqual(self.trello.request_count(), 12)
+        self.assertEqual(self.trello.request_count('GET boards/{id}/cards'), 10)
+        self.assertEqual(stats['requests'], 12)
+        self.assertEqual(Task.objects.count(), 10500)
+
+    def test_incremental_sync_reads_only_the_actions_feed(self):
+        self.trello.generate_board(cards=200)
+        incremental_sync()
+        self.trello.reset_counts()
+        moved = next(card for card in self.trello.cards.values() if card['idList'] == self._list_id('To Do'))
+        gone = next(card_id for card_id in self.trello.cards if card_id != moved['id'])
+        self.trello.update_card(moved['id'], name='Renamed', idList=self._list_id('Done'))
+        created = self.trello.create_card(
+            name='Fresh', desc='Brand new', due='2030-06-01T12:00:00.000Z',
+            idList=self._list_id('Doing'), idMembers=[next(iter(self.trello.members))],
+        )
+        self.trello.delete_card(gone)
+
+        stats = incremental_sync()
+
+        # The actions feed, plus a refetch of the new card its createCard action can't describe
+        self.assertEqual(self.trello.request_count(), 2)
+        self.assertEqual(self.trello.request_count('GET cards/{id}'), 1)
+        self.assertEqual((stats['created'], stats['updated'], stats['deleted']), (1, 1, 1))
+        task = Task.objects.get(trello_card_id=moved['id'])
+        self.assertEqual((task.title, task.completed), ('Renamed', True))
+        fresh = Task.objects.get(trello_card_id=created['id'])
+        self.assertEqual((fresh.full_name, fresh.description), ('Member 0', 'Brand new'))
+        self.assertEqual(fresh.deadline, datetime.datetime(2030, 6, 1, 12, tzinfo=datetime.timezone.utc))
+        self.assertFalse(Task.objects.filter(trello_card_id=gone).exists())
+
+    def test_incremental_sync_fills_in_new_cards(self):
+        self.trello.generate_board(cards=10)
+        incremental_sync()
+        member_id = next(iter(self.trello.members))
+        card = self.trello.create_card(
+            name='Quarterly report', desc='Numbers for Q3', due='2030-01-01T09:00:00.000Z',
+            idList=self._list_id('To Do'), idMembers=[member_id],
+        )
+
+        incremental_sync()
+
+        task = Task.objects.get(trello_card_id=card['id'])
+        self.assertEqual(task.description, 'Numbers for Q3')
+        self.assertEqual(task.deadline, datetime.datetime(2030, 1, 1, 9, tzinfo=datetime.timezone.utc))
+        self.assertEqual((task.trello_member_id, task.full_name), (member_id, 'Member 0'))
+
+    def test_rate_limited_requests_are_retried(self):
+        self.trello.generate_board(cards=20)
+        incremental_sync()
+        self.trello.reset_counts()
+        self.trello.throttle(2)
+
+        stats = incremental_sync()
+
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(self.trello.request_count('GET boards/{id}/actions'), 3)
+        self.assertEqual(sum(self.trello.throttled.values()), 2)
+
+    def test_card_creation_is_not_retried_after_server_errors(self):
+        list_id = self.trello.add_list('To Do')['id']
+        self.trello.fail(1)
+        response = trello.post('cards', data={'name': 'Once', 'idList': list_id})
+        self.assertEqual(response.status_code, 503)
+        self.trello.throttle(1)
+        response = trello.post('cards', data={'name': 'Once', 'idList': list_id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.trello.request_count('POST cards'), 3)
+        self.assertEqual(len(self.trello.cards), 1)
+
+        self.trello.fail(1)
+        self.assertEqual(trello.get(f"boards/{self.trello.board_id}/lists").status_code, 200)
+
+    @override_settings(TRELLO_MAX_RETRY_AFTER=5)
+    def test_retry_after_is_capped(self):
+        response = mock.Mock(headers={'Retry-After': '3600'})
+        self.assertEqual(backoff_delay(0, response), 5)
+
+    def test_credentials_stay_out_of_urls_and_retry_logs(self):
+        calls = []
+
+        def request(method, url, params=None, **kwargs):
+            calls.append(kwargs['headers'])
+            if len(calls) == 1:
+                raise requests.ConnectionError(f"Max retries exceeded with url: {url}?{urlencode(params or {})}")
+            return mock.Mock(status_code=200)
+
+        with mock.patch.object(trello, 'token', 's3cret-token'), mock.patch.object(trello, '_backoff', return_value=0), \
+                mock.patch.object(trello.session, 'request', side_effect=request), \
+                self.assertLogs('home.trello_client', 'WARNING') as logs:
+            trello.get('boards/abc/lists', params={'fields': 'name'})
+
+        self.assertEqual(len(calls), 2)
+        self.assertIn('oauth_token="s3cret-token"', calls[0]['Authorization'])
+        self.assertNotIn('s3cret-token', '\n'.join(logs.output))
+
+    def post_webhook(self, action, secret='app-secret'):
+        body = json.dumps({'action': action}).encode()
+        digest = hmac.new(secret.encode(), body + settings.TRELLO_WEBHOOK_CALLBACK_URL.encode(), hashlib.sha1).digest()
+        return self.client.post(
+            '/trello-webhook/', body, content_type='application/json',
+            HTTP_X_TRELLO_WEBHOOK=base64.b64encode(digest).decode(),
+        )
+
+    @override_settings(TRELLO_API_SECRET='app-secret')
+    def test_webhook_applies_action_without_trello_requests(self):
+        self.trello.generate_board(cards=20)
+        incremental_sync()
+        self.trello.reset_counts()
+        card = next(iter(self.trello.cards.values()))
+        self.trello.update_card(card['id'], name='From webhook')
+
+        response = self.post_webhook(self.trello.actions[-1])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.trello.request_count(), 0)
+        self.assertEqual(Task.objects.get(trello_card_id=card['id']).title, 'From webhook')
+
+    @override_settings(TRELLO_API_SECRET='app-secret')
+    def test_webhook_leaves_new_cards_to_the_queued_sync(self):
+        self.trello.generate_board(cards=5)
+        incremental_sync()
+        card = self.trello.create_card(
+            name='Fresh', desc='From the board', due='2030-06-01T12:00:00.000Z', idList=next(iter(self.trello.lists)),
+        )
+        create = next(action for action in self.trello.actions if action['type'] == 'createCard'
+                      and action['data']['card']['id'] == card['id'])
+
+        response = self.post_webhook(create)
+
+        self.assertEqual(response.json()['message'], 'Trello sync queued!')
+        self.assertFalse(Task.objects.filter(trello_card_id=card['id']).exists())
+        # What the queued run does
+        incremental_sync()
+        task = Task.objects.get(trello_card_id=card['id'])
+        self.assertEqual(task.description, 'From the board')
+        self.assertEqual(task.deadline, datetime.datetime(2030, 6, 1, 12, tzinfo=datetime.timezone.utc))
+
+    @override_settings(TRELLO_API_SECRET='app-secret')
+    def test_webhook_rejects_unsigned_and_foreign_payloads(self):
+        self.trello.generate_board(cards=5)
+        incremental_sync()
+        card = next(iter(self.trello.cards.values()))
+        self.trello.update_card(card['id'], name='Forged')
+        action = self.trello.actions[-1]
+
+        self.assertEqual(self.post_webhook(action, secret='guess').status_code, 401)
+        foreign = {**action, 'data': {**action['data'], 'board': {'id': 'someone-elses-board'}}}
+        self.assertEqual(self.post_webhook(foreign).status_code, 200)
+
+        self.assertNotEqual(Task.objects.get(trello_card_id=card['id']).title, 'Forged')
+
+    def test_webhook_is_registered_once(self):
+        self.assertFalse(ensure_trello_webhook())
+        self.assertTrue(ensure_trello_webhook())
+        self.assertEqual(self.trello.request_count('GET tokens/{id}/webhooks'), 2)
+        self.assertEqual(self.trello.request_count('POST webhooks'), 1)
+        self.assertEqual(len(self.trello.webhooks), 1)
+
+
+    def test_failed_scheduling_releases_the_pending_sync(self):
+        with mock.patch('home.tasks.process_trello_webhook', side_effect=RuntimeError('queue down')):
+            with self.assertRaises(RuntimeError):
+                request_trello_sync()
+        self.assertFalse(TrelloSyncState.objects.filter(sync_pending=True).exists())
+        with mock.patch('home.tasks.process_trello_webhook') as process:
+            self.assertTrue(request_trello_sync())
+        process.assert_called_once()
+
+    def test_failed_sync_keeps_the_sync_request(self):
+        for outcome in (RuntimeError('Trello down'), SyncStats(error=True)):
+            with mock.patch('home.tasks.process_trello_webhook'):
+                request_trello_sync()
+            sync = mock.patch('home.tasks.sync_trello_tasks', **(
+                {'side_effect': outcome} if isinstance(outcome, Exception) else {'return_value': outcome}
+            ))
+            with sync, self.assertRaises(RuntimeError):
+                run_trello_sync()
+            state = TrelloSyncState.objects.get()
+            self.assertEqual((state.sync_needed, state.sync_started_at), (True, None))
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = override_settings(METRICS_TOKEN='secret', METRICS_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch.object(metrics, 'registry', metrics.MetricsRegistry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def scrape(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_requires_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 404)
+
+    def test_requests_and_queries_per_view(self):
+        Task.objects.create(title='Counted', description='')
+        self.client.get('/api/scores/')
+        self.client.get('/api/scores/')
+
+        text = self.scrape()
+
+        self.assertIn('http_requests_total{view="scores_api",method="GET",status="200"} 2', text)
+        self.assertIn('http_request_duration_seconds_count{view="scores_api",method="GET"} 2', text)
+        self.assertRegex(text, r'http_request_db_queries_sum\{view="scores_api"\} [1-9]')
+        self.assertIn('email_queue_messages{status="pending"} 0', text)
+
+    def test_outbound_trello_calls(self):
+        simulator = TrelloSimulator(board_id=settings.TRELLO_BOARD_ID)
+        with simulator, mock.patch.object(trello, 'base_url', simulator.base_url):
+            trello.get('members/abc')
+            trello.get(f'boards/{settings.TRELLO_BOARD_ID}/members')
+
+        text = self.scrape()
+
+        self.assertIn('outbound_requests_total{service="trello",endpoint="GET members/abc"} 1', text)
+        self.assertIn('outbound_errors_total{service="trello",endpoint="GET members/abc"} 1', text)
+        self.assertNotIn('outbound_errors_total{service="trello",endpoint="GET boards/{id}/members"}', text)
+
+    def test_trello_cache_lookups(self):
+        board_members_cache.invalidate()
+        self.addCleanup(board_members_cache.invalidate)
+        for _ in range(3):
+            board_members_cache.get('board', lambda: [{'id': 'm1'}])
+
+        text = self.scrape()
+
+        self.assertIn('cache_lookups_total{cache="board_members",result="hit"} 2', text)
+        self.assertIn('cache_lookups_total{cache="board_members",result="miss"} 1', text)
+
+    def test_llm_cache_savings(self):
+        GeneratedContent.objects.create(key='a' * 64, kind='overdue', content='Hi', prompt_tokens=80, completion_tokens=20, hits=3)
+        GeneratedContent.objects.create(key='b' * 64, kind='overdue', content='Hi', prompt_tokens=50, completion_tokens=10)
+
+        text = self.scrape()
+
+        self.assertIn('llm_cache_entries 2', text)
+        self.assertIn('llm_cache_lookups{result="hit"} 3', text)
+        self.assertIn('llm_cache_lookups{result="miss"} 2', text)
+        self.assertIn('llm_cache_hit_ratio 0.6', text)
+        self.assertIn('llm_cache_saved_tokens 300', text)
+
+    def test_samples_of_other_processes_are_added(self):
+        metrics.registry.inc('outbound_requests_total', ('smtp', 'send_messages'))
+        other = [['outbound_requests_total', ['smtp', 'send_messages'], 4]]
+        with open(os.path.join(self.directory, '99999.json'), 'w') as f:
+            json.dump(other, f)
+
+        self.assertIn('outbound_requests_total{service="smtp",endpoint="send_messages"} 5', self.scrape())
@@ -0,0 +1,258 @@
+# trello_client.py
+import asyncio
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from .metrics import record_outbound
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Safe to send twice; a POST that failed midway may already have created its card
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+ID_SEGMENT = re.compile(r'^[0-9a-fA-F]{24,}$')
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` requests per second with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take one token and return how many seconds the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Tokens may go negative, later callers then queue up behind the earlier ones
+            self._tokens -= 1
+            return 0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+
+def should_retry(method, response):
+    """Whether a failed attempt may be sent again; `response` is None when the request raised.
+
+    A 429 is rejected before Trello does anything, so every method retries
+    it. Connection errors, timeouts and 5xx can happen after Trello applied
+    the request, so only idempotent methods retry those.
+    """
+    if response is not None and response.status_code == 429:
+        return True
+    if method.upper() not in IDEMPOTENT_METHODS:
+        return False
+    return response is None or response.status_code in RETRY_STATUSES
+
+
+def backoff_delay(attempt, response):
+    """Seconds to wait before retry `attempt`, honouring a Retry-After header up to TRELLO_MAX_RETRY_AFTER."""
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0), settings.TRELLO_MAX_RETRY_AFTER)
+        except ValueError:
+            pass
+    return (2 ** attempt) * 0.5 + random.uniform(0, 0.25)
+
+
+def auth_headers(key, token):
+    # In a header rather than the query string, where request URLs (and exceptions quoting them) would log them
+    return {'Authorization': f'OAuth oauth_consumer_key="{key}", oauth_token="{token}"'}
+
+
+def endpoint_name(method, path):
+    """Collapse ids out of a path so request counts group per endpoint, e.g. 'GET cards/{id}'."""
+    secrets = {settings.TRELLO_BOARD_ID, settings.TRELLO_API_TOKEN}
+    parts = ['{id}' if ID_SEGMENT.match(part) or part in secrets else part for part in path.strip('/').split('/')]
+    return f"{method} {'/'.join(parts)}"
+
+
+class TrelloClient:
+    """Shared Trello REST client.
+
+    Keeps connections alive through a pooled session, applies a default
+    timeout, spaces requests with a token bucket shared by every thread and
+    retries failures with exponential backoff (see should_retry()).
+    """
+
+    def __init__(self, base_url=None, key=None, token=None, timeout=None, max_retries=None, limiter=None):
+        self.base_url = (base_url or settings.TRELLO_API_URL).rstrip('/')
+        self.key = key if key is not None else settings.TRELLO_API_KEY
+        self.token = token if token is not None else settings.TRELLO_API_TOKEN
+        self.timeout = timeout if timeout is not None else settings.TRELLO_HTTP_TIMEOUT
+        self.max_retries = max_retries if max_retries is not None else settings.TRELLO_MAX_RETRIES
+        self.limiter = limiter or TokenBucket(settings.TRELLO_RATE_LIMIT, settings.TRELLO_RATE_BURST)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.TRELLO_POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._counts = Counter()
+        self._errors = Counter()
+        self._lock = threading.Lock()
+
+    def request(self, method, path, params=None, data=None, **kwargs):
+        headers = auth_headers(self.key, self.token)
+        headers.update(kwargs.pop('headers', None) or {})
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        endpoint = endpoint_name(method, path)
+        kwargs.setdefault('timeout', self.timeout)
+
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            with self._lock:
+                self._counts[endpoint] += 1
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, params=params, data=data, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                record_outbound('trello', endpoint, time.monotonic() - started, error=True)
+                if attempt >= self.max_retries or not should_retry(method, None):
+                    with self._lock:
+                        self._errors[endpoint] += 1
+                    raise
+                logger.warning(f"Trello {endpoint} failed ({e}), retrying")
+                response = None
+            else:
+                record_outbound('trello', endpoint, time.monotonic() - started, error=response.status_code >= 400)
+                if response.status_code < 400 or attempt >= self.max_retries or not should_retry(method, response):
+                    if response.status_code >= 400:
+                        with self._lock:
+                            self._errors[endpoint] += 1
+                    return response
+
+            time.sleep(self._backoff(attempt, response))
+            attempt += 1
+
+    def _backoff(self, attempt, response):
+        return backoff_delay(attempt, response)
+
+    def get(self, path, params=None, **kwargs):
+        return self.request('GET', path, params=params, **kwargs)
+
+    def post(self, path, data=None, **kwargs):
+        return self.request('POST', path, data=data, **kwargs)
+
+    def put(self, path, data=None, **kwargs):
+        return self.request('PUT', path, data=data, **kwargs)
+
+    def delete(self, path, params=None, **kwargs):
+        return self.request('DELETE', path, params=params, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return {'requests': dict(self._counts), 'errors': dict(self._errors)}
+
+
+trello = TrelloClient()
+
+
+class AsyncTrelloClient:
+    """asyncio counterpart of TrelloClient for async views.
+
+    Waits on the same token bucket as the sync client, so both together stay
+    under the per-process rate limit. httpx clients are bound to the event
+    loop that created them, so one pooled client is kept per running loop.
+    """
+
+    def __init__(self, base_url=None, key=None, token=None, timeout=None, max_retries=None, limiter=None):
+        self.base_url = (base_url or settings.TRELLO_API_URL).rstrip('/')
+        self.key = key if key is not None else settings.TRELLO_API_KEY
+        self.token = token if token is not None else settings.TRELLO_API_TOKEN
+        self.timeout = timeout if timeout is not None else settings.TRELLO_HTTP_TIMEOUT
+        self.max_retries = max_retries if max_retries is not None else settings.TRELLO_MAX_RETRIES
+        self.limiter = limiter or trello.limiter
+
+        self._clients = {}  # event loop -> httpx.AsyncClient
+        self._counts = Counter()
+        self._errors = Counter()
+        self._lock = threading.Lock()
+
+    def _client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            # Forget clients of loops that are gone, e.g. one per async_to_sync call under WSGI
+            self._clients = {other: c for other, c in self._clients.items() if not other.is_closed()}
+            client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=settings.TRELLO_POOL_SIZE),
+            )
+            self._clients[loop] = client
+        return client
+
+    async def request(self, method, path, params=None, data=None, **kwargs):
+        # httpx also logs request URLs at INFO
+        headers = auth_headers(self.key, self.token)
+        headers.update(kwargs.pop('headers', None) or {})
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        endpoint = endpoint_name(method, path)
+        client = self._client()
+
+        attempt = 0
+        while True:
+            wait = self.limiter.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            with self._lock:
+                self._counts[endpoint] += 1
+            started = time.monotonic()
+            try:
+                response = await client.request(method, url, params=params, data=data, headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                record_outbound('trello', endpoint, time.monotonic() - started, error=True)
+                if attempt >= self.max_retries or not should_retry(method, None):
+                    with self._lock:
+                        self._errors[endpoint] += 1
+                    raise
+                logger.warning(f"Trello {endpoint} failed ({e}), retrying")
+                response = None
+            else:
+                record_outbound('trello', endpoint, time.monotonic() - started, error=response.status_code >= 400)
+                if response.status_code < 400 or attempt >= self.max_retries or not should_retry(method, response):
+                    if response.status_code >= 400:
+                        with self._lock:
+                            self._errors[endpoint] += 1
+                    return response
+
+            await asyncio.sleep(backoff_delay(attempt, response))
+            attempt += 1
+
+    async def get(self, path, params=None, **kwargs):
+        return await self.request('GET', path, params=params, **kwargs)
+
+    async def post(self, path, data=None, **kwargs):
+        return await self.request('POST', path, data=data, **kwargs)
+
+    async def put(self, path, data=None, **kwargs):
+        return await self.request('PUT', path, data=data, **kwargs)
+
+    async def delete(self, path, params=None, **kwargs):
+        return await self.request('DELETE', path, params=params, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return {'requests': dict(self._counts), 'errors': dict(self._errors)}
+
+
+atrello = AsyncTrelloClient()
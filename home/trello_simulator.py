@@ -0,0 +1,393 @@
+# trello_simulator.py
+import datetime
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .trello_client import endpoint_name
+
+# Most cards a board or cards request returns at once, like the real API
+PAGE_LIMIT = 1000
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _isoformat(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f"{moment.microsecond // 1000:03d}Z"
+
+
+def _pick(obj, fields):
+    """Copy of obj limited to a `fields` param ('all' or missing keeps everything); the id always stays."""
+    if not fields or fields == 'all':
+        return dict(obj)
+    wanted = set(fields.split(',')) | {'id'}
+    return {key: value for key, value in obj.items() if key in wanted}
+
+
+def _flag(value):
+    return str(value).lower() == 'true'
+
+
+class TrelloSimulator:
+    """Fake Trello REST API on localhost for tests and benchmarks.
+
+    Serves the endpoints this app calls from an in-memory board: the nested
+    board request, card pages, lists, members, actions, cards CRUD and
+    webhooks. Card changes made through the API or the `create_card` /
+    `update_card` / `delete_card` helpers are recorded as board actions, so
+    incremental syncs and webhook payloads see them. Every request is counted
+    per endpoint; latency, 429 and server error responses can be injected. Point a client
+    at `base_url` to use it.
+    """
+
+    def __init__(self, board_id='board1', latency=0.0, jitter=0.0, rate_limit_every=0, retry_after=0):
+        self.board_id = board_id
+        self.latency = latency
+        self.jitter = jitter
+        # Answer every Nth request with a 429, on top of any queued with throttle()
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.members = {}
+        self.lists = {}
+        self.cards = {}
+        self.actions = []  # oldest first
+        self.webhooks = {}
+        self.requests = Counter()
+        self.throttled = Counter()
+        self._throttle_next = 0
+        self._failures = []  # statuses to answer the next requests with
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+        self._server = None
+        self._thread = None
+
+    def new_id(self):
+        """A 24 hex digit id; later ids sort after earlier ones, as Trello's do."""
+        return f"{int(time.time()):08x}{next(self._ids):016x}"
+
+    def add_member(self, member_id, full_name, username=None):
+        self.members[member_id] = {'id': member_id, 'fullName': full_name, 'username': username or member_id}
+        return self.members[member_id]
+
+    def add_list(self, name, list_id=None):
+        trello_list = {'id': list_id or self.new_id(), 'name': name, 'closed': False, 'idBoard': self.board_id}
+        self.lists[trello_list['id']] = trello_list
+        return trello_list
+
+    def add_card(self, **fields):
+        """Put a card on the board without recording an action, for test fixtures."""
+        card = {'id': fields.pop('id', None) or self.new_id(), 'name': '', 'desc': '', 'due': None,
+                'idList': None, 'closed': False, 'idMembers': [], 'idBoard': self.board_id, **fields}
+        self.cards[card['id']] = card
+        return card
+
+    def generate_board(self, cards=10000, members=20, lists=('To Do', 'Doing', 'Done'), seed=0):
+        """Fill the board with synthetic members, lists and cards, each card with its createCard action."""
+        rng = random.Random(seed)
+        with self._lock:
+            member_ids = [
+                self.add_member(self.new_id(), f"Member {i}", f"member{i}")['id'] for i in range(members)
+            ]
+            list_ids = [self.add_list(name)['id'] for name in lists]
+            now = _now()
+            for i in range(cards):
+                due = now + datetime.timedelta(hours=rng.randint(-24 * 60, 24 * 60)) if rng.random() < 0.8 else None
+                card = self.add_card(
+                    name=f"Task {i}",
+                    desc=f"Synthetic card {i}" if rng.random() < 0.5 else '',
+                    due=_isoformat(due) if due else None,
+                    idList=rng.choice(list_ids),
+                    idMembers=[rng.choice(member_ids)] if member_ids and rng.random() < 0.9 else [],
+                )
+                self._record('createCard', {'id': card['id'], 'name': card['name']}, list=self._list_ref(card['idList']))
+        return self
+
+    def _list_ref(self, list_id):
+        trello_list = self.lists.get(list_id)
+        return {'id': list_id, 'name': trello_list['name']} if trello_list else None
+
+    def _record(self, action_type, card, member=None, **data):
+        action = {
+            'id': self.new_id(),
+            'type': action_type,
+            'date': _isoformat(_now()),
+            'data': {'card': card, 'board': {'id': self.board_id}, **{k: v for k, v in data.items() if v is not None}},
+        }
+        if member is not None:
+            action['member'] = dict(member)
+        self.actions.append(action)
+        return action
+
+    def create_card(self, **fields):
+        with self._lock:
+            card = self.add_card(**fields)
+            self._record('createCard', {'id': card['id'], 'name': card['name']}, list=self._list_ref(card['idList']))
+            for member_id in card['idMembers']:
+                self._record_member('addMemberToCard', card, member_id)
+            return card
+
+    def _record_member(self, action_type, card, member_id):
+        self._record(action_type, {'id': card['id'], 'name': card['name']},
+                     member=self.members.get(member_id), idMember=member_id)
+
+    def update_card(self, card_id, **fields):
+        """Change a card and record one updateCard action per changed field, as Trello does."""
+        with self._lock:
+            card = self.cards[card_id]
+            for field, value in fields.items():
+                old = card.get(field)
+                if value == old:
+                    continue
+                card[field] = value
+                if field == 'idMembers':
+                    for member_id in [m for m in value if m not in old]:
+                        self._record_member('addMemberToCard', card, member_id)
+                    for member_id in [m for m in old if m not in value]:
+                        self._record_member('removeMemberFromCard', card, member_id)
+                    continue
+                moved = {'listBefore': self._list_ref(old), 'listAfter': self._list_ref(value)} if field == 'idList' else {}
+                self._record('updateCard', {'id': card_id, 'name': card['name'], field: value}, old={field: old}, **moved)
+            return card
+
+    def delete_card(self, card_id):
+        with self._lock:
+            card = self.cards.pop(card_id)
+            self._record('deleteCard', {'id': card_id}, list=self._list_ref(card['idList']))
+            return card
+
+    def throttle(self, count=1):
+        """Answer the next `count` requests with 429 Too Many Requests."""
+        with self._lock:
+            self._throttle_next += count
+
+    def fail(self, count=1, status=503):
+        """Answer the next `count` requests with a server error, without applying them."""
+        with self._lock:
+            self._failures += [status] * count
+
+    def _next_failure(self):
+        with self._lock:
+            return self._failures.pop(0) if self._failures else None
+
+    def _should_throttle(self, endpoint):
+        with self._lock:
+            throttle = self._throttle_next > 0 or (
+                self.rate_limit_every and sum(self.requests.values()) % self.rate_limit_every == 0
+            )
+            if throttle:
+                self._throttle_next = max(self._throttle_next - 1, 0)
+                self.throttled[endpoint] += 1
+            return throttle
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/1"
+
+    def start(self):
+        handler = type('Handler', (_Handler,), {'simulator': self})
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def request_count(self, endpoint=None):
+        with self._lock:
+            return self.requests[endpoint] if endpoint else sum(self.requests.values())
+
+    def reset_counts(self):
+        with self._lock:
+            self.requests.clear()
+            self.throttled.clear()
+
+    def handle(self, method, path, params):
+        """Return (status, payload) for one request. `path` is relative to /1/."""
+        parts = path.strip('/').split('/')
+        route = (method, parts[0], len(parts))
+        if parts[0] == 'boards' and len(parts) >= 2 and parts[1] != self.board_id:
+            return 404, 'The requested resource was not found.'
+
+        if route == ('GET', 'boards', 2):
+            return 200, self._board(params)
+        if route == ('GET', 'boards', 3):
+            collection = {'cards': self._board_cards, 'lists': self._board_lists,
+                          'members': self._board_members, 'actions': self._board_actions}.get(parts[2])
+            if collection is not None:
+                return 200, collection(params)
+        if route == ('GET', 'members', 2):
+            member = self.members.get(parts[1])
+            return (200, _pick(member, params.get('fields'))) if member else (404, 'The requested resource was not found.')
+
+        if route == ('POST', 'cards', 1):
+            fields = _card_fields(params)
+            fields.setdefault('idList', next(iter(self.lists), None))
+            return 200, self.create_card(**fields)
+        if parts[0] == 'cards' and len(parts) == 2:
+            card = self.cards.get(parts[1])
+            if card is None:
+                return 404, 'The requested resource was not found.'
+            if method == 'GET':
+                return 200, self._card(card, params)
+            if method == 'PUT':
+                return 200, self.update_card(card['id'], **_card_fields(params))
+            if method == 'DELETE':
+                self.delete_card(card['id'])
+                return 200, {'_value': None}
+
+        if route == ('GET', 'tokens', 3) and parts[2] == 'webhooks':
+            return 200, list(self.webhooks.values())
+        if route == ('POST', 'webhooks', 1):
+            webhook = {'id': self.new_id(), 'description': params.get('description', ''), 'active': True,
+                       'callbackURL': params.get('callbackURL'), 'idModel': params.get('idModel')}
+            self.webhooks[webhook['id']] = webhook
+            return 200, webhook
+        if route == ('DELETE', 'webhooks', 2):
+            return (200, {'_value': None}) if self.webhooks.pop(parts[1], None) else (404, 'The requested resource was not found.')
+        return 404, 'Cannot route request'
+
+    def _open_cards(self, card_filter='open'):
+        # Newest first, the order Trello pages cards in
+        cards = sorted(self.cards.values(), key=lambda card: card['id'], reverse=True)
+        if card_filter == 'all':
+            return cards
+        closed = card_filter == 'closed'
+        return [card for card in cards if card['closed'] == closed]
+
+    def _board(self, params):
+        board = _pick({'id': self.board_id, 'name': 'Simulated board', 'closed': False}, params.get('fields'))
+        if params.get('cards', 'none') != 'none':
+            board['cards'] = [_pick(card, params.get('card_fields')) for card in self._open_cards(params['cards'])[:PAGE_LIMIT]]
+        if params.get('lists', 'none') != 'none':
+            board['lists'] = self._board_lists({'filter': params['lists'], 'fields': params.get('list_fields')})
+        if params.get('members', 'none') != 'none':
+            board['members'] = self._board_members({'fields': params.get('member_fields')})
+        return board
+
+    def _board_cards(self, params):
+        cards = self._open_cards(params.get('filter', 'open'))
+        if params.get('before'):
+            cards = [card for card in cards if card['id'] < params['before']]
+        if params.get('since'):
+            cards = [card for card in cards if card['id'] > params['since']]
+        limit = min(int(params.get('limit', PAGE_LIMIT)), PAGE_LIMIT)
+        return [_pick(card, params.get('fields')) for card in cards[:limit]]
+
+    def _board_lists(self, params):
+        lists = self.lists.values()
+        if params.get('filter', 'open') == 'open':
+            lists = [trello_list for trello_list in lists if not trello_list['closed']]
+        return [_pick(trello_list, params.get('fields')) for trello_list in lists]
+
+    def _board_members(self, params):
+        return [_pick(member, params.get('fields')) for member in self.members.values()]
+
+    def _board_actions(self, params):
+        types = set(params['filter'].split(',')) if params.get('filter', 'all') != 'all' else None
+        limit = min(int(params.get('limit', 50)), PAGE_LIMIT)
+        since, before = params.get('since'), params.get('before')
+        page = []
+        for action in reversed(self.actions):
+            if since and _position(action, since) <= since:
+                break
+            if before and _position(action, before) >= before:
+                continue
+            if types is None or action['type'] in types:
+                found = _pick(action, params.get('fields'))
+                if 'member' in action:
+                    found['member'] = _pick(action['member'], params.get('member_fields'))
+                page.append(found)
+                if len(page) >= limit:
+                    break
+        return page
+
+    def _card(self, card, params):
+        result = _pick(card, params.get('fields'))
+        if _flag(params.get('list')):
+            result['list'] = _pick(self.lists[card['idList']], params.get('list_fields')) if card['idList'] in self.lists else None
+        if _flag(params.get('members')):
+            result['members'] = [
+                _pick(self.members[member_id], params.get('member_fields'))
+                for member_id in card['idMembers'] if member_id in self.members
+            ]
+        return result
+
+
+def _position(action, reference):
+    # since/before take an action id or a date; either compares as a string with its own kind
+    return action['date'] if '-' in reference else action['id']
+
+
+def _card_fields(params):
+    fields = {key: value for key, value in params.items() if key in ('name', 'desc', 'due', 'idList')}
+    if 'idMembers' in params:
+        fields['idMembers'] = [member for member in params['idMembers'].split(',') if member]
+    if 'closed' in params:
+        fields['closed'] = _flag(params['closed'])
+    return fields
+
+
+class _Handler(BaseHTTPRequestHandler):
+    simulator = None
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+    def _dispatch(self):
+        simulator = self.simulator
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            params.update({key: values[-1] for key, values in parse_qs(self.rfile.read(length).decode()).items()})
+
+        path = url.path[len('/1/'):] if url.path.startswith('/1/') else url.path
+        endpoint = endpoint_name(self.command, path)
+        with simulator._lock:
+            simulator.requests[endpoint] += 1
+        if simulator.latency or simulator.jitter:
+            time.sleep(simulator.latency + random.uniform(0, simulator.jitter))
+
+        headers = {}
+        if simulator._should_throttle(endpoint):
+            status, payload = 429, 'API_TOKEN_LIMIT_EXCEEDED'
+            body = payload
+            headers['Retry-After'] = str(simulator.retry_after)
+        elif (failure := simulator._next_failure()) is not None:
+            status, payload = failure, 'Internal Server Error'
+            body = payload
+        else:
+            with simulator._lock:
+                status, payload = simulator.handle(self.command, path, params)
+                # Serialized under the lock, the payload may share dicts with the board
+                body = json.dumps(payload) if not isinstance(payload, str) else payload
+        body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json' if not isinstance(payload, str) else 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,488 @@
+# trello_sync.py
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Task, TrelloSyncState
+from .trello_client import trello
+from .trello_utils import board_lists_cache, member_cache, remember_board
+
+logger = logging.getLogger(__name__)
+
+# Trello caps one cards page at 1000, ask for more pages only when a page is full
+CARDS_PAGE_SIZE = 1000
+CARD_FIELDS = 'name,desc,due,idList,idMembers'
+SYNCED_FIELDS = [
+    'title', 'description', 'deadline', 'completed', 'completed_on',
+    'trello_member_id', 'full_name', 'user_name', 'updated_at',
+]
+DONE_LIST_NAME = 'done'
+
+ACTIONS_PAGE_SIZE = 1000
+# Past this many cards that need a refetch, one nested board request is cheaper
+STALE_REFRESH_LIMIT = 25
+CURSOR_FIELDS = ['last_action_id', 'last_action_date', 'last_full_sync_at', 'updated_at']
+ACTION_TYPES = [
+    'createCard', 'copyCard', 'moveCardToBoard', 'updateCard', 'deleteCard',
+    'moveCardFromBoard', 'addMemberToCard', 'removeMemberFromCard',
+]
+
+
+def parse_trello_datetime(due_str):
+    if due_str:
+        dt = parse_datetime(due_str)
+        if dt:
+            return timezone.make_aware(dt) if timezone.is_naive(dt) else dt
+    return None
+
+
+class SyncStats(dict):
+    """Counters reported by a sync run (HTTP requests made and rows touched)."""
+
+    def __init__(self, **kwargs):
+        super().__init__(mode='full', requests=0, actions=0, cards=0, created=0, updated=0, unchanged=0, deleted=0, scored=0)
+        self.update(kwargs)
+
+
+def _trello_get(path, stats, **params):
+    stats['requests'] += 1
+    return trello.get(path, params=params)
+
+
+def fetch_board_snapshot(stats):
+    """Fetch cards, lists and members of the board with one nested request.
+
+    Extra `/boards/{id}/cards` pages are only requested when the nested card
+    list hits Trello's page cap. Returns (cards, lists, members) or None.
+    """
+    board_id = settings.TRELLO_BOARD_ID
+    response = _trello_get(
+        f"boards/{board_id}", stats,
+        fields='id',
+        cards='open', card_fields=CARD_FIELDS,
+        lists='all', list_fields='name',
+        members='all', member_fields='fullName,username',
+    )
+    if response.status_code != 200:
+        logger.error(f"Trello API error: {response.status_code} - {response.text}")
+        return None
+
+    board = response.json()
+    cards = {card['id']: card for card in board.get('cards', [])}
+    page = board.get('cards', [])
+    while len(page) >= CARDS_PAGE_SIZE:
+        response = _trello_get(
+            f"boards/{board_id}/cards", stats,
+            filter='open', fields=CARD_FIELDS, limit=CARDS_PAGE_SIZE,
+            before=min(card['id'] for card in page),
+        )
+        if response.status_code != 200:
+            logger.error(f"Trello API error: {response.status_code} - {response.text}")
+            return None
+        page = response.json()
+        cards.update((card['id'], card) for card in page)
+
+    return list(cards.values()), board.get('lists', []), board.get('members', [])
+
+
+def _fetch_member(member_id, stats):
+    response = _trello_get(f"members/{member_id}", stats, fields='fullName,username')
+    if response.status_code != 200:
+        logger.warning(f"Failed to get member info for member_id: {member_id}")
+        return None
+    return response.json()
+
+
+def _resolve_members(member_ids, members_by_id, stats):
+    # Members who left the board are missing from the nested list, fetch each unknown id once
+    for member_id in member_ids - members_by_id.keys():
+        member = member_cache.get(member_id, lambda: _fetch_member(member_id, stats))
+        if member is not None:
+            members_by_id[member_id] = member
+
+
+def apply_card(task, card, list_names, members_by_id, today):
+    """Copy the Trello card state onto `task` in memory. Returns True if anything changed."""
+    values = {
+        'title': card['name'],
+        'description': card.get('desc', ''),
+        'deadline': parse_trello_datetime(card.get('due')),
+    }
+
+    list_name = list_names.get(card.get('idList'))
+    if list_name is not None:
+        is_done = list_name.lower() == DONE_LIST_NAME
+        if is_done and not task.completed:
+            # Task just completed — set completed_on to today
+            values['completed'] = True
+            values['completed_on'] = today
+        elif not is_done:
+            # Moved out of "Done" list — reset completed status
+            values['completed'] = False
+            values['completed_on'] = None
+    elif card.get('idList'):
+        logger.warning(f"Failed to get list info for list_id: {card.get('idList')}")
+
+    if card.get('idMembers'):
+        trello_member_id = card['idMembers'][0]
+        values['trello_member_id'] = trello_member_id
+        member = members_by_id.get(trello_member_id)
+        if member is not None:
+            values['full_name'] = member.get('fullName', '')
+            values['user_name'] = member.get('username', '')
+
+    changed = False
+    for field, value in values.items():
+        if getattr(task, field) != value:
+            setattr(task, field, value)
+            changed = True
+    return changed
+
+
+def full_board_sync(stats=None):
+    """Mirror the whole Trello board into `Task` rows.
+
+    Costs one nested board request (plus card pages on very large boards and
+    one request per unknown member) and a constant number of bulk queries.
+    """
+    logger.info("Starting full Trello board sync...")
+    stats = stats if stats is not None else SyncStats()
+    snapshot = fetch_board_snapshot(stats)
+    if snapshot is None:
+        stats['error'] = True
+        return stats
+
+    cards, lists, members = snapshot
+    stats['cards'] = len(cards)
+    remember_board(lists, members)
+    list_names = {trello_list['id']: trello_list['name'] for trello_list in lists}
+    members_by_id = {member['id']: member for member in members}
+    _resolve_members({card['idMembers'][0] for card in cards if card.get('idMembers')}, members_by_id, stats)
+
+    now = timezone.now()
+    today = now.date()
+    existing = {task.trello_card_id: task for task in Task.objects.exclude(trello_card_id__isnull=True)}
+    to_create, to_update = [], []
+
+    for card in cards:
+        task = existing.get(card['id'])
+        if task is None:
+            task = Task(trello_card_id=card['id'], completed=False)
+            apply_card(task, card, list_names, members_by_id, today)
+            to_create.append(task)
+        elif apply_card(task, card, list_names, members_by_id, today):
+            task.updated_at = now
+            to_update.append(task)
+
+    card_ids = {card['id'] for card in cards}
+    with transaction.atomic():
+        stats['scored'] = Task.objects.bulk_save(to_create + to_update, SYNCED_FIELDS)
+
+        # Like Task.save() used to on every sync, retry scoring completed tasks that weren't counted yet
+        changed = set(map(id, to_update))
+        pending = [
+            task for card_id, task in existing.items()
+            if card_id in card_ids and id(task) not in changed and task.score_triggered()
+        ]
+        stats['scored'] += Task.objects.score(pending)
+
+        # Delete tasks that no longer exist in Trello
+        stale_ids = [task.pk for card_id, task in existing.items() if card_id not in card_ids]
+        stats['deleted'], _ = Task.objects.filter(pk__in=stale_ids).delete() if stale_ids else (0, None)
+
+    stats['created'] = len(to_create)
+    stats['updated'] = len(to_update)
+    stats['unchanged'] = len(cards) - len(to_create) - len(to_update)
+    logger.info(f"Trello sync finished: {dict(stats)}")
+    return stats
+
+
+def _done_flag(trello_list):
+    if not trello_list:
+        return None
+    name = trello_list.get('name')
+    if name is None:
+        # Only trust a cached name here, loading it would cost a request on the webhook path
+        name = (board_lists_cache.peek(settings.TRELLO_BOARD_ID) or {}).get(trello_list.get('id'))
+    return None if name is None else name.lower() == DONE_LIST_NAME
+
+
+class ActionBatch:
+    """Applies a chronological run of Trello actions to `Task` rows in memory.
+
+    Cards the actions don't describe well enough (copies, unarchived cards,
+    removal of the assignee) are collected in `stale` so the caller can refresh them.
+    """
+
+    def __init__(self, actions):
+        card_ids = {action['data']['card']['id'] for action in actions if action.get('data', {}).get('card')}
+        self.tasks = {task.trello_card_id: task for task in Task.objects.filter(trello_card_id__in=card_ids)}
+        self.created = {}
+        self.changed = {}
+        self.deleted = set()
+        self.stale = set()
+        self.now = timezone.now()
+
+    def apply(self, action):
+        card = action.get('data', {}).get('card')
+        if not card:
+            return
+        handler = getattr(self, f"_on_{action['type']}", None)
+        if handler is not None:
+            handler(action, card)
+
+    def _set(self, task, field, value):
+        if getattr(task, field) != value:
+            setattr(task, field, value)
+            if task.trello_card_id not in self.created:
+                task.updated_at = self.now
+                self.changed[task.trello_card_id] = task
+
+    def _set_done(self, task, is_done, action):
+        if is_done and not task.completed:
+            self._set(task, 'completed', True)
+            self._set(task, 'completed_on', parse_trello_datetime(action['date']).date())
+        elif is_done is False:
+            self._set(task, 'completed', False)
+            self._set(task, 'completed_on', None)
+
+    def _on_createCard(self, action, card):
+        self.deleted.discard(card['id'])
+        # The payload only names the card; its due date, description and members come from a refetch
+        self.stale.add(card['id'])
+        if card['id'] in self.tasks:
+            return
+        task = Task(trello_card_id=card['id'], title=card.get('name', ''), description='', completed=False)
+        self.tasks[card['id']] = self.created[card['id']] = task
+        self._set_done(task, _done_flag(action['data'].get('list')), action)
+
+    _on_copyCard = _on_createCard
+
+    _on_moveCardToBoard = _on_copyCard
+
+    def _on_updateCard(self, action, card):
+        task = self.tasks.get(card['id'])
+        if task is None:
+            self.stale.add(card['id'])
+            return
+        old = action['data'].get('old', {})
+        if 'name' in old:
+            self._set(task, 'title', card['name'])
+        if 'desc' in old:
+            self._set(task, 'description', card.get('desc') or '')
+        if 'due' in old:
+            self._set(task, 'deadline', parse_trello_datetime(card.get('due')))
+        if 'idList' in old:
+            self._set_done(task, _done_flag(action['data'].get('listAfter')), action)
+        if 'closed' in old:
+            if card.get('closed'):
+                # Archived cards drop out of the open cards a full sync mirrors
+                self._on_deleteCard(action, card)
+            else:
+                self.stale.add(card['id'])
+
+    def _on_deleteCard(self, action, card):
+        self.tasks.pop(card['id'], None)
+        self.created.pop(card['id'], None)
+        self.changed.pop(card['id'], None)
+        self.stale.discard(card['id'])
+        self.deleted.add(card['id'])
+
+    _on_moveCardFromBoard = _on_deleteCard
+
+    def _on_addMemberToCard(self, action, card):
+        task = self.tasks.get(card['id'])
+        if task is None:
+            self.stale.add(card['id'])
+            return
+        if not task.trello_member_id:
+            member = action.get('member') or {}
+            self._set(task, 'trello_member_id', action['data'].get('idMember'))
+            self._set(task, 'full_name', member.get('fullName', ''))
+            self._set(task, 'user_name', member.get('username', ''))
+
+    def _on_removeMemberFromCard(self, action, card):
+        task = self.tasks.get(card['id'])
+        if task is None or task.trello_member_id == action['data'].get('idMember'):
+            # The next assignee is whichever member remains on the card
+            self.stale.add(card['id'])
+
+    def refresh_stale(self, stats):
+        """Refetch each stale card individually. Returns False if Trello couldn't answer."""
+        today = timezone.now().date()
+        for card_id in list(self.stale):
+            response = _trello_get(
+                f"cards/{card_id}", stats,
+                fields=f"{CARD_FIELDS},closed", list='true', list_fields='name',
+                members='true', member_fields='fullName,username',
+            )
+            if response.status_code == 404:
+                self._on_deleteCard(None, {'id': card_id})
+                continue
+            if response.status_code != 200:
+                logger.warning(f"Failed to refresh card {card_id}: {response.status_code}")
+                return False
+
+            card = response.json()
+            if card.get('closed'):
+                self._on_deleteCard(None, card)
+                continue
+            task = self.tasks.get(card_id)
+            if task is None:
+                task = Task(trello_card_id=card_id, completed=False)
+                self.tasks[card_id] = self.created[card_id] = task
+                self.deleted.discard(card_id)
+            list_names = {card['list']['id']: card['list']['name']} if card.get('list') else {}
+            members_by_id = {member['id']: member for member in card.get('members', [])}
+            if apply_card(task, card, list_names, members_by_id, today) and card_id not in self.created:
+                task.updated_at = self.now
+                self.changed[card_id] = task
+            self.stale.discard(card_id)
+        return True
+
+    def save(self, stats):
+        created = [task for card_id, task in self.created.items() if card_id not in self.deleted]
+        changed = list(self.changed.values())
+        stats['scored'] += Task.objects.bulk_save(created + changed, SYNCED_FIELDS)
+        if self.deleted:
+            stats['deleted'] += Task.objects.filter(trello_card_id__in=self.deleted).delete()[0]
+        stats['created'] += len(created)
+        stats['updated'] += len(changed)
+
+
+def fetch_board_actions(stats, since=None, limit=ACTIONS_PAGE_SIZE):
+    """Return board actions newer than `since` (an action id), oldest first, or None on error."""
+    params = {
+        'filter': ','.join(ACTION_TYPES), 'fields': 'type,date,data',
+        'memberCreator': 'false', 'member_fields': 'fullName,username', 'limit': limit,
+    }
+    if since:
+        params['since'] = since
+    actions, before = [], None
+    while True:
+        if before:
+            params['before'] = before
+        response = _trello_get(f"boards/{settings.TRELLO_BOARD_ID}/actions", stats, **params)
+        if response.status_code != 200:
+            logger.error(f"Trello actions API error: {response.status_code} - {response.text}")
+            return None
+        page = response.json()
+        actions.extend(page)
+        # Trello pages newest first; a full page may have older actions behind it
+        if not since or len(page) < limit:
+            break
+        before = page[-1]['id']
+    actions.sort(key=lambda action: (action['date'], action['id']))
+    return actions
+
+
+def _save_cursor(state, action):
+    state.last_action_id = action['id']
+    state.last_action_date = parse_trello_datetime(action['date'])
+
+
+def incremental_sync():
+    """Apply Trello board actions recorded since the stored cursor.
+
+    Cards that can't be rebuilt from their actions alone are refetched one by
+    one. Falls back to `full_board_sync` when there is no cursor yet, the
+    actions feed fails, or too many cards need a refetch.
+    """
+    stats = SyncStats(mode='incremental')
+    state, _ = TrelloSyncState.objects.get_or_create(board_id=settings.TRELLO_BOARD_ID)
+
+    if not state.last_action_id:
+        # Read the head of the feed before the snapshot so nothing falls in between
+        head = fetch_board_actions(stats, limit=1)
+        return _full_sync_from(state, head, stats)
+
+    actions = fetch_board_actions(stats, since=state.last_action_id)
+    if actions is None:
+        return _full_sync_from(state, None, stats)
+    stats['actions'] = len(actions)
+    if not actions:
+        return stats
+
+    batch = ActionBatch(actions)
+    for action in actions:
+        batch.apply(action)
+    if len(batch.stale) > STALE_REFRESH_LIMIT or not batch.refresh_stale(stats):
+        logger.info(f"{len(batch.stale)} cards need a refresh, falling back to a full sync")
+        return _full_sync_from(state, actions, stats)
+
+    with transaction.atomic():
+        batch.save(stats)
+        _save_cursor(state, actions[-1])
+        state.save(update_fields=CURSOR_FIELDS)
+    logger.info(f"Trello incremental sync finished: {dict(stats)}")
+    return stats
+
+
+def _full_sync_from(state, actions, stats):
+    stats['mode'] = 'full'
+    full_board_sync(stats)
+    if stats.get('error'):
+        return stats
+    if actions:
+        _save_cursor(state, actions[-1])
+    state.last_full_sync_at = timezone.now()
+    state.save(update_fields=CURSOR_FIELDS)
+    return stats
+
+
+def apply_webhook_action(action):
+    """Apply one webhook action payload straight onto its `Task` row.
+
+    No Trello request is made; cards the payload can't fully describe are
+    reported in stats['stale'] so the caller can queue a sync for them. Only
+    pass actions from a delivery whose signature and board were checked.
+    """
+    stats = SyncStats(mode='webhook', actions=1)
+    batch = ActionBatch([action])
+    batch.apply(action)
+    # A new card the payload can't fully describe is left to the queued sync, rather than saved half-filled
+    for card_id in batch.stale:
+        batch.created.pop(card_id, None)
+    with transaction.atomic():
+        batch.save(stats)
+    stats['stale'] = len(batch.stale)
+    return stats
+
+
+def claim_pending_sync(sync_needed=True):
+    """Mark a run as pending. Returns False when a queued run already covers this request.
+
+    `sync_needed` asks that run to replay board actions rather than only send
+    notifications. The conditional UPDATE is atomic, so concurrent workers
+    can't both claim the run.
+    """
+    board_id = settings.TRELLO_BOARD_ID
+    TrelloSyncState.objects.get_or_create(board_id=board_id)
+    if sync_needed:
+        mark_sync_needed()
+    return TrelloSyncState.objects.filter(board_id=board_id, sync_pending=False).update(sync_pending=True) == 1
+
+
+def mark_sync_needed():
+    TrelloSyncState.objects.filter(board_id=settings.TRELLO_BOARD_ID).update(sync_needed=True)
+
+
+def consume_sync_needed():
+    return TrelloSyncState.objects.filter(board_id=settings.TRELLO_BOARD_ID, sync_needed=True).update(sync_needed=False) == 1
+
+
+def acquire_sync_lease():
+    """Take the single-flight sync lease and consume the pending flag; False if another run holds it."""
+    now = timezone.now()
+    expired = now - timezone.timedelta(seconds=settings.TRELLO_SYNC_LEASE)
+    return TrelloSyncState.objects.filter(board_id=settings.TRELLO_BOARD_ID).filter(
+        Q(sync_started_at__isnull=True) | Q(sync_started_at__lt=expired)
+    ).update(sync_started_at=now, sync_pending=False) == 1
+
+
+def release_sync_lease():
+    TrelloSyncState.objects.filter(board_id=settings.TRELLO_BOARD_ID).update(sync_started_at=None)
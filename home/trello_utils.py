@@ -1,36 +1,194 @@
 #trello_utils.py
-import requests
+import logging
+import threading
+import time
+from collections import OrderedDict
+
 from django.conf import settings
 
+from .metrics import record_cache_evictions, record_cache_lookup
+from .trello_client import atrello, trello
+
+logger = logging.getLogger(__name__)
 
-TRELLO_API_BASE = 'https://api.trello.com/1'
 BOARD_ID = settings.TRELLO_BOARD_ID
 API_KEY = settings.TRELLO_API_KEY
 TOKEN = settings.TRELLO_API_TOKEN
 LIST_ID = '67d0065d01438695cdc2430a'
+DONE_LIST_NAME = 'done'
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire `ttl` seconds after they are stored.
+
+    Process-local: webhook invalidation only reaches the worker that got the
+    event, the TTL bounds how stale the other workers can be. Lookups and
+    evictions are also counted in the metrics registry under `name`.
+    """
+
+    def __init__(self, name, ttl, maxsize):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def peek(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            return entry[1]
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            found = entry is not None and entry[0] >= time.monotonic()
+            if found:
+                self._data.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        record_cache_lookup(self.name, found)
+        return (True, entry[1]) if found else (False, None)
+
+    def get(self, key, loader):
+        """Return the cached value for `key`, calling `loader()` on a miss. None results aren't cached."""
+        found, value = self._lookup(key)
+        if found:
+            return value
+
+        # Load outside the lock so one slow Trello call doesn't block other keys
+        value = loader()
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    async def aget(self, key, loader):
+        """get() for async callers, `loader` is a coroutine function."""
+        found, value = self._lookup(key)
+        if found:
+            return value
+        value = await loader()
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        evicted = 0
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        if evicted:
+            record_cache_evictions(self.name, evicted)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self._data), 'maxsize': self.maxsize, 'ttl': self.ttl,
+            }
+
+
+board_members_cache = TTLCache('board_members', settings.TRELLO_CACHE_TTL, 16)
+board_lists_cache = TTLCache('board_lists', settings.TRELLO_CACHE_TTL, 16)
+member_cache = TTLCache('members', settings.TRELLO_CACHE_TTL, settings.TRELLO_CACHE_MAXSIZE)
+
+# Webhook action types that make a cached entry stale
+LIST_ACTIONS = {'createList', 'updateList', 'moveListToBoard', 'moveListFromBoard'}
+MEMBER_ACTIONS = {'addMemberToBoard', 'removeMemberFromBoard', 'makeNormalMemberOfBoard', 'makeAdminOfBoard', 'updateMember'}
+
+
+def _fetch_json(path, **params):
+    response = trello.get(path, params=params)
+    if response.status_code != 200:
+        return None
+    return response.json()
 
 
 def get_board_members():
-    url = f'{TRELLO_API_BASE}/boards/{BOARD_ID}/members'
-    params = {'key': API_KEY, 'token': TOKEN}
-    response = requests.get(url, params=params)
+    members = board_members_cache.get(BOARD_ID, lambda: _fetch_json(f'boards/{BOARD_ID}/members'))
+    return members if members is not None else []
+
+
+async def _afetch_json(path, **params):
+    response = await atrello.get(path, params=params)
+    if response.status_code != 200:
+        return None
     return response.json()
 
-DONE_LIST_ID = '67d0065d01438695cdc2430c'  # ✅ Replace with your real Done list ID
 
-def create_or_update_card(card_id=None, name='', desc='', due=None, member_ids=[], completed=False):  # ✅ updated
-    if card_id:
-        url = f"{TRELLO_API_BASE}/cards/{card_id}"
-        method = requests.put
-    else:
-        url = f"{TRELLO_API_BASE}/cards"
-        method = requests.post
+async def aget_board_members():
+    members = await board_members_cache.aget(BOARD_ID, lambda: _afetch_json(f'boards/{BOARD_ID}/members'))
+    return members if members is not None else []
+
+
+def get_board_lists():
+    """Map of list id -> list name for the board, including archived lists."""
+    def load():
+        lists = _fetch_json(f'boards/{BOARD_ID}/lists', filter='all', fields='name')
+        return {trello_list['id']: trello_list['name'] for trello_list in lists} if lists is not None else None
+
+    lists = board_lists_cache.get(BOARD_ID, load)
+    return lists if lists is not None else {}
+
+
+def is_done_list(list_id):
+    name = get_board_lists().get(list_id)
+    return None if name is None else name.lower() == DONE_LIST_NAME
+
+
+def get_member(member_id):
+    return member_cache.get(member_id, lambda: _fetch_json(f'members/{member_id}', fields='fullName,username'))
+
+
+def remember_board(lists=None, members=None):
+    """Prime the caches with lists/members another request already fetched."""
+    if lists is not None:
+        board_lists_cache.set(BOARD_ID, {trello_list['id']: trello_list['name'] for trello_list in lists})
+    if members is not None:
+        board_members_cache.set(BOARD_ID, members)
+        for member in members:
+            member_cache.set(member['id'], member)
+
+
+def invalidate_for_action(action):
+    action_type = action.get('type')
+    if action_type in LIST_ACTIONS:
+        board_lists_cache.invalidate()
+    elif action_type in MEMBER_ACTIONS:
+        board_members_cache.invalidate()
+        member_id = action.get('data', {}).get('idMember') or (action.get('member') or {}).get('id')
+        member_cache.invalidate(member_id)
+
 
+def cache_stats():
+    return {
+        'board_members': board_members_cache.stats(),
+        'board_lists': board_lists_cache.stats(),
+        'members': member_cache.stats(),
+    }
+
+DONE_LIST_ID = '67d0065d01438695cdc2430c'  # ✅ Replace with your real Done list ID
+
+def card_payload(name, desc, due, member_ids, completed):
     list_id = DONE_LIST_ID if completed else LIST_ID  # ✅ NEW conditional logic
 
     data = {
-        'key': API_KEY,
-        'token': TOKEN,
         'name': name,
         'desc': desc,
         'idMembers': ','.join(member_ids),
@@ -40,11 +198,11 @@ def create_or_update_card(card_id=None, name='', desc='', due=None, member_ids=[
     # ✅ Only include 'due' if not None or empty
     if due:
         data['due'] = due
+    return data
 
-    response = method(url, data=data)
 
-    print("Status Code:", response.status_code)
-    print("Response Text:", response.text)
+def _card_json(response):
+    logger.debug(f"Trello card response {response.status_code}: {response.text}")
 
     try:
         return response.json()
@@ -52,13 +210,23 @@ def create_or_update_card(card_id=None, name='', desc='', due=None, member_ids=[
         raise Exception(f"Trello API returned non-JSON: {response.text}")
 
 
+def create_or_update_card(card_id=None, name='', desc='', due=None, member_ids=[], completed=False):  # ✅ updated
+    data = card_payload(name, desc, due, member_ids, completed)
+    if card_id:
+        response = trello.put(f"cards/{card_id}", data=data)
+    else:
+        response = trello.post("cards", data=data)
+    return _card_json(response)
+
+
 def delete_card(card_id):
-    url = f"{TRELLO_API_BASE}/cards/{card_id}"
-    params = {'key': API_KEY, 'token': TOKEN}
-    response = requests.delete(url, params=params)
-    
-    # Logging for debugging
-    print("Delete Status Code:", response.status_code)
-    print("Delete Response:", response.text)
+    response = trello.delete(f"cards/{card_id}")
+    logger.debug(f"Trello card delete {response.status_code}: {response.text}")
+
+    return response.status_code == 200
+
 
+async def adelete_card(card_id):
+    response = await atrello.delete(f"cards/{card_id}")
+    logger.debug(f"Trello card delete {response.status_code}: {response.text}")
     return response.status_code == 200
@@ -1,38 +1,52 @@
 # views.py
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
-from django.http import JsonResponse, Http404
+from django.http import HttpResponse, JsonResponse, Http404, StreamingHttpResponse
 from django.utils import timezone
-from datetime import timedelta, datetime
+from datetime import timedelta, datetime, timezone as dt_timezone
 from background_task.models import Task as BgTask
-from .tasks import create_trello_webhook, sync_trello_tasks, check_tasks, assigned_task, task_completion, after_deadline, summarize_yesterday_
-from .models import Task, detail_of_everyday, Boss, TrelloMember
-import requests
+from .tasks import create_trello_webhook, sync_trello_tasks, check_tasks, assigned_task, task_completion, after_deadline, summarize_yesterday_, request_trello_sync, schedule_outbox_flush
+from .models import Task, TrelloOutbox, detail_of_everyday, Boss, TrelloMember
+from .outbox import enqueue_card_change
 from django.views.decorators.csrf import csrf_exempt, csrf_protect
-from django.views.decorators.http import require_POST, require_GET
+from django.views.decorators.http import condition, require_POST, require_GET
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, Max, Min, Q
+import asyncio
+import base64
+import hashlib
+import hmac
 import logging
 import secrets
+import time
 from dateutil.relativedelta import relativedelta  # requires python-dateutil
 
 import json
-from openai import OpenAI
-from django.utils.dateparse import parse_datetime
+from openai import AsyncOpenAI
+from django.utils.dateparse import parse_date, parse_datetime
 
 # Schedule it to run every day at 8 AM
 
 
 from django.shortcuts import render, redirect
-from .trello_utils import get_board_members, create_or_update_card, delete_card
+from .trello_utils import (
+    DONE_LIST_ID, LIST_ID, adelete_card, aget_board_members, card_payload, delete_card, invalidate_for_action,
+)
+from .trello_sync import apply_webhook_action
+from .trello_client import atrello
+from .search_index import chat_system_context
+from .metrics import record_outbound, render_metrics, track_outbound
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
 
 
-def members_list_api(request):
-    members = get_board_members()
+async def members_list_api(request):
+    members = await aget_board_members()
     members_list = [{'id': m['id'], 'fullName': m['fullName']} for m in members]
     return JsonResponse({'members': members_list})
 
@@ -41,13 +55,254 @@ def task_list(request):
     tasks = Task.objects.all()
     return render(request, 'task_list.html', {'tasks': tasks})
 
+TASK_API_FIELDS = (
+    'id', 'title', 'description', 'deadline', 'trello_card_id', 'completed', 'completed_on',
+    'trello_member_id', 'user_name', 'full_name', 'manual_score_override', 'created_at', 'updated_at',
+)
+TASK_API_DEFAULT_FIELDS = ('title', 'deadline', 'trello_card_id', 'completed', 'full_name')
+TASK_API_MAX_LIMIT = 500
+
+
+def _encode_cursor(updated_at, pk):
+    raw = json.dumps([updated_at.isoformat(), pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    updated_at, pk = json.loads(raw)
+    updated_at = parse_datetime(updated_at)
+    if updated_at is None or not isinstance(pk, int):
+        raise ValueError("Invalid cursor")
+    return updated_at, pk
+
+
+def _parse_moment(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value}")
+        moment = datetime.combine(day, datetime.min.time())
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+def _task_list_query(request):
+    """The filtered (not yet paginated) task queryset, cached on the request for the ETag and the view."""
+    if not hasattr(request, '_task_list_query'):
+        tasks = Task.objects.all()
+        params = request.GET
+        if params.get('completed') in ('true', 'false'):
+            tasks = tasks.filter(completed=params['completed'] == 'true')
+        if params.get('member'):
+            tasks = tasks.filter(trello_member_id=params['member'])
+        if params.get('deadline_after'):
+            tasks = tasks.filter(deadline__gte=_parse_moment(params['deadline_after']))
+        if params.get('deadline_before'):
+            tasks = tasks.filter(deadline__lt=_parse_moment(params['deadline_before']))
+        request._task_list_query = tasks
+    return request._task_list_query
+
+
+def _task_list_version(request):
+    # One aggregate per request, the count catches deletes that leave max(updated_at) unchanged
+    if not hasattr(request, '_task_list_version'):
+        try:
+            request._task_list_version = _task_list_query(request).aggregate(
+                last_modified=Max('updated_at'), count=Count('id')
+            )
+        except ValueError:
+            request._task_list_version = None
+    return request._task_list_version
+
+
+def _task_list_etag(request):
+    version = _task_list_version(request)
+    if version is None:
+        return None
+    key = f"{version['last_modified']}|{version['count']}|{request.GET.urlencode()}"
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def _task_list_last_modified(request):
+    version = _task_list_version(request)
+    return version['last_modified'] if version else None
+
+
+@require_GET
+@condition(etag_func=_task_list_etag, last_modified_func=_task_list_last_modified)
 def task_list_api(request):
-    tasks = Task.objects.all().values('title', 'deadline', 'trello_card_id', 'completed', 'full_name')
-    return JsonResponse({'tasks': list(tasks)})
+    """Tasks as {'tasks': [...]}, or ordered by (updated_at, id) a page at a time.
+
+    ?fields= picks the columns, ?completed=, ?member=, ?deadline_after= and
+    ?deadline_before= filter. Passing ?limit= or ?cursor= pages the results
+    and adds next_cursor; ?cursor= continues from a previous page. Unchanged
+    results answer conditional requests with a 304.
+    """
+    fields = request.GET.get('fields')
+    fields = tuple(field for field in fields.split(',') if field) if fields else TASK_API_DEFAULT_FIELDS
+    unknown = set(fields) - set(TASK_API_FIELDS)
+    if unknown:
+        return JsonResponse({'error': f"Unknown fields: {', '.join(sorted(unknown))}"}, status=400)
+
+    paginated = 'limit' in request.GET or 'cursor' in request.GET
+    try:
+        limit = min(max(int(request.GET.get('limit', 100)), 1), TASK_API_MAX_LIMIT)
+        tasks = _task_list_query(request)
+        if request.GET.get('cursor'):
+            updated_at, pk = _decode_cursor(request.GET['cursor'])
+            tasks = tasks.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=pk))
+    except (ValueError, TypeError):
+        return JsonResponse({'error': 'Invalid limit, cursor or date'}, status=400)
+
+    if not paginated:
+        # The dashboard reads every task in one response, as before pagination existed
+        return JsonResponse({'tasks': list(tasks.order_by('id').values(*fields))})
+
+    # One row past the page tells whether there is a next one
+    rows = list(tasks.order_by('updated_at', 'id').values(*set(fields) | {'id', 'updated_at'})[:limit + 1])
+    next_cursor = _encode_cursor(rows[limit - 1]['updated_at'], rows[limit - 1]['id']) if len(rows) > limit else None
+    return JsonResponse({
+        'tasks': [{field: row[field] for field in fields} for row in rows[:limit]],
+        'next_cursor': next_cursor,
+    })
+
+SCORE_SORTS = {
+    'score': ('delay_score', 'id'),
+    '-score': ('-delay_score', '-id'),
+    'deadline': ('deadline', 'id'),
+    '-deadline': ('-deadline', '-id'),
+    'completed_on': ('completed_on', 'id'),
+    '-completed_on': ('-completed_on', '-id'),
+}
+MEMBER_SCORE_SORTS = {
+    'score': ('avg_score', 'trello_member_id'),
+    '-score': ('-avg_score', 'trello_member_id'),
+    'tasks': ('task_count', 'trello_member_id'),
+    '-tasks': ('-task_count', 'trello_member_id'),
+}
+
+
+def _float_param(request, name):
+    value = request.GET.get(name)
+    return float(value) if value not in (None, '') else None
+
+
+@require_GET
+def scores_api(request):
+    """Delay scores computed in SQL, filtered, sorted and paginated.
+
+    ?member=&completed=&min_score=&max_score= filter the tasks, ?sort= picks
+    the order (worst scores first by default) and ?group=member returns one
+    row per member with their average instead of one row per task.
+    """
+    try:
+        min_score = _float_param(request, 'min_score')
+        max_score = _float_param(request, 'max_score')
+        page = max(int(request.GET.get('page', 1)), 1)
+        page_size = min(max(int(request.GET.get('page_size', 50)), 1), 500)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid number in query string'}, status=400)
+
+    tasks = Task.objects.with_delay_score().filter(delay_score__isnull=False)
+    if request.GET.get('member'):
+        tasks = tasks.filter(trello_member_id=request.GET['member'])
+    if request.GET.get('completed') in ('true', 'false'):
+        tasks = tasks.filter(completed=request.GET['completed'] == 'true')
+    if min_score is not None:
+        tasks = tasks.filter(delay_score__gte=min_score)
+    if max_score is not None:
+        tasks = tasks.filter(delay_score__lte=max_score)
+
+    summary = tasks.aggregate(
+        task_count=Count('id'), avg_score=Avg('delay_score'), min_score=Min('delay_score'), max_score=Max('delay_score')
+    )
+
+    if request.GET.get('group') == 'member':
+        sorts = MEMBER_SCORE_SORTS
+        rows = tasks.values('trello_member_id').annotate(
+            full_name=Max('full_name'), task_count=Count('id'), avg_score=Avg('delay_score'), min_score=Min('delay_score')
+        )
+        total = tasks.values('trello_member_id').distinct().count()
+    else:
+        sorts = SCORE_SORTS
+        rows = tasks.values(
+            'id', 'title', 'trello_card_id', 'trello_member_id', 'full_name', 'deadline', 'completed_on', 'delay_score'
+        )
+        total = summary['task_count']
+
+    sort = request.GET.get('sort', 'score')
+    if sort not in sorts:
+        return JsonResponse({'error': f"sort must be one of {', '.join(sorts)}"}, status=400)
+
+    offset = (page - 1) * page_size
+    results = list(rows.order_by(*sorts[sort])[offset:offset + page_size])
+    return JsonResponse({
+        'results': results,
+        'summary': summary,
+        'page': page,
+        'page_size': page_size,
+        'total': total,
+        'has_next': offset + page_size < total,
+    })
+
+
+@require_GET
+def metrics_view(request):
+    """Prometheus metrics of every worker process, for `Authorization: Bearer <METRICS_TOKEN>`."""
+    if not settings.METRICS_TOKEN:
+        raise Http404
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not secrets.compare_digest(token.encode(), settings.METRICS_TOKEN.encode()):
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _sse(data, event=None):
+    prefix = f"event: {event}\n" if event else ''
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+async def _chat_event_stream(messages):
+    """Relay completion tokens as server-sent events.
+
+    Sends `data: {"token": ...}` per chunk, then an `event: done` (or
+    `event: error`) message. Async, so ASGI sends each chunk as it arrives
+    instead of collecting a sync generator in a thread. If the client goes
+    away the task is cancelled, and closing the upstream stream stops the
+    completion there.
+    """
+    started = time.monotonic()
+    first_token_at = None
+    finished = failed = False
+    stream = None
+    try:
+        stream = await client.chat.completions.create(model="gpt-3.5-turbo", messages=messages, stream=True)
+        async for chunk in stream:
+            token = chunk.choices[0].delta.content if chunk.choices else None
+            if not token:
+                continue
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+            yield _sse({'token': token})
+        finished = True
+        yield _sse({}, event='done')
+    except Exception as e:
+        failed = True
+        logger.exception("Error in chatbot stream")
+        yield _sse({'error': str(e)}, event='error')
+    finally:
+        if stream is not None:
+            await stream.close()
+        record_outbound('openai', 'chat.completions.stream', time.monotonic() - started, error=failed)
+        ttft = f"{first_token_at - started:.2f}s" if first_token_at else 'n/a'
+        outcome = 'finished' if finished else 'cancelled'
+        logger.info(f"Chatbot stream {outcome}: first token {ttft}, total {time.monotonic() - started:.2f}s")
+
 
 @csrf_exempt
 @require_POST
-def chatbot_api(request):
+async def chatbot_api(request):
     try:
         body = json.loads(request.body)
         user_question = body.get('question')
@@ -55,29 +310,31 @@ def chatbot_api(request):
         if not user_question:
             return JsonResponse({'error': 'Question not provided.'}, status=400)
 
-        # Fetch tasks and summaries
-        tasks = list(Task.objects.all().values('title', 'deadline', 'trello_card_id','description','completed', 'created_at', 'updated_at', 'trello_member_id','full_name', 'completed_on'))[-10:]
-        summaries = list(detail_of_everyday.objects.all().values_list('description', flat=True))[-7:]
-        details = list(TrelloMember.objects.all().values('trello_member_id', 'email', 'historical_score', 'name', 'total_tasks_counted'))
+        # Relevant tasks, summaries and members within the token budget, cached per data version
+        system_context = await sync_to_async(chat_system_context)(user_question)
 
+        messages = [
+            {"role": "system", "content": system_context},
+            {"role": "user", "content": user_question}
+        ]
 
-        # Prepare system content
-        system_context = (
-            f"Here are some details of tasks:\n{json.dumps(tasks, indent=2, default=str)}\n\n"
-            f"And here are recent summaries:\n{json.dumps(summaries, indent=2)}"
-            f"Other details:\n{json.dumps(details, indent=2)}"
-        )
+        # Opt-in server-sent events, JSON stays the default
+        if body.get('stream') or 'text/event-stream' in request.headers.get('Accept', ''):
+            response = StreamingHttpResponse(_chat_event_stream(messages), content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'  # keep nginx from buffering the stream
+            return response
 
         # OpenAI GPT-3.5 Turbo call
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_context},
-                {"role": "user", "content": user_question}
-            ]
-        )
+        started = time.monotonic()
+        with track_outbound('openai', 'chat.completions'):
+            response = await client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=messages
+            )
         
         answer = response.choices[0].message.content.strip()
+        logger.info(f"Chatbot answered in {time.monotonic() - started:.2f}s")
 
         return JsonResponse({'answer': answer})
 
@@ -120,11 +377,11 @@ def logout_view(request):
 
 
 @csrf_exempt
-def delete_trello_task_api(request, card_id):
+async def delete_trello_task_api(request, card_id):
     if request.method == 'DELETE':
         try:
-            delete_card(card_id)  # Delete from Trello
-            Task.objects.filter(trello_card_id=card_id).delete()  # Delete from DB
+            await adelete_card(card_id)  # Delete from Trello
+            await sync_to_async(Task.objects.filter(trello_card_id=card_id).delete)()  # Delete from DB
             return JsonResponse({'message': 'Task deleted successfully'})
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
@@ -143,11 +400,20 @@ def get_task_by_card_id(request, card_id):
 
 
 
+def queue_card_change(op, payload, card_id=None, task=None):
+    """Save task (if given) and record its Trello change in one transaction, then wake the flusher."""
+    with transaction.atomic():
+        if task is not None:
+            task.save()
+        enqueue_card_change(op, payload, card_id=card_id)
+        transaction.on_commit(schedule_outbox_flush)
+
+
 @csrf_exempt
-def update_task(request, card_id):
+async def update_task(request, card_id):
     if request.method == 'PUT':
         try:
-            task = Task.objects.get(trello_card_id=card_id)
+            task = await sync_to_async(Task.objects.get)(trello_card_id=card_id)
             data = json.loads(request.body)
             task.title = data.get('title', task.title)
             deadline_str = data.get('deadline')
@@ -160,15 +426,15 @@ def update_task(request, card_id):
                 task.manual_score_override = float(manual_score_override)
 
             
-            task.save()
-            create_or_update_card(
-                card_id=card_id,
+            payload = card_payload(
                 name=task.title,
                 desc=task.description,
                 due=task.deadline.isoformat() if task.deadline else None,
                 member_ids=[task.trello_member_id] if task.trello_member_id else [],
                 completed=task.completed,
             )
+            # The card is updated by the outbox flusher, committed together with the task
+            await sync_to_async(queue_card_change)(TrelloOutbox.OP_UPDATE, payload, card_id=card_id, task=task)
             return JsonResponse({'status': 'updated'})
         except Task.DoesNotExist:
             return JsonResponse({'error': 'Task not found'}, status=404)
@@ -177,6 +443,17 @@ def update_task(request, card_id):
     return JsonResponse({'error': 'Invalid method'}, status=405)
 
 
+def _trello_signature_valid(request):
+    # Trello signs body + callback URL with the app secret: base64(HMAC-SHA1)
+    digest = hmac.new(
+        settings.TRELLO_API_SECRET.encode(),
+        request.body + settings.TRELLO_WEBHOOK_CALLBACK_URL.encode(),
+        hashlib.sha1,
+    ).digest()
+    signature = request.headers.get('X-Trello-Webhook', '')
+    return hmac.compare_digest(base64.b64encode(digest).decode(), signature)
+
+
 @csrf_exempt
 def trello_webhook(request):
 
@@ -184,29 +461,36 @@ def trello_webhook(request):
     if request.method == "HEAD":
         return JsonResponse({"message": "Webhook registered!"})
 
-    # Ensure Trello Webhook is registered (Call only if needed)
-    trello_webhooks = requests.get(
-        f"https://api.trello.com/1/tokens/{settings.TRELLO_API_TOKEN}/webhooks",
-        params={"key": settings.TRELLO_API_KEY},
-    ).json()
+    if settings.TRELLO_API_SECRET and not _trello_signature_valid(request):
+        logger.warning("Rejected Trello webhook with a bad signature")
+        return JsonResponse({"error": "Invalid signature"}, status=401)
 
-    existing_webhook = any(
-        wh.get("callbackURL") == "https://your-django-app.com/trello-webhook/"
-        for wh in trello_webhooks
+    try:
+        action = json.loads(request.body)['action']
+    except (ValueError, KeyError, TypeError):
+        action = None
+
+    # Only signed payloads about our board are applied, anything else is just a hint to sync
+    trusted = (
+        settings.TRELLO_API_SECRET and isinstance(action, dict)
+        and ((action.get('data') or {}).get('board') or {}).get('id') == settings.TRELLO_BOARD_ID
     )
 
-    if not existing_webhook:
-        create_trello_webhook()  # Register only if it doesn’t exist
-        
-    # Sync Trello tasks immediately when webhook triggers
-    sync_trello_tasks()
-
-    assigned_task()
-
-    task_completion()
-    
+    # Emails, LLM calls and any Trello refetch run in the background worker; bursts share one queued run
+    if not trusted:
+        queued = request_trello_sync()
+    else:
+        invalidate_for_action(action)
+        # Most payloads carry the changed card fields, so apply them without asking Trello
+        stats = apply_webhook_action(action)
+        if stats['stale']:
+            queued = request_trello_sync()
+        elif stats['created'] or stats['updated'] or stats['deleted']:
+            queued = request_trello_sync(sync_needed=False)
+        else:
+            return JsonResponse({"message": "Nothing to sync"})
 
-    return JsonResponse({"message": "Trello sync triggered!"})
+    return JsonResponse({"message": "Trello sync queued!" if queued else "Trello sync already pending"})
 
 
 
@@ -230,17 +514,15 @@ def trello_webhook(request):
 
 
 # Helper to fetch one card
-def get_trello_card(card_id):
-    url = f"{settings.TRELLO_API_URL}/cards/{card_id}"
-    params = {'key': settings.TRELLO_API_KEY, 'token': settings.TRELLO_API_TOKEN}
-    response = requests.get(url, params=params)
+async def get_trello_card(card_id):
+    response = await atrello.get(f"cards/{card_id}")
     if response.status_code == 200:
         return response.json()
     return None
 
 
 @csrf_exempt
-def assign_trello_task(request, card_id=None):
+async def assign_trello_task(request, card_id=None):
     if request.method == 'POST':
         try:
             # Parse the JSON body
@@ -258,14 +540,15 @@ def assign_trello_task(request, card_id=None):
                 deadline = default_deadline.isoformat() + "Z" # Trello expects ISO with Zulu time
 
 
-            card = create_or_update_card(
-                card_id=card_id,
+            payload = card_payload(
                 name=title,
                 desc=description,
                 due=deadline,
                 member_ids=members,
                 completed=completed  
             )
+            op = TrelloOutbox.OP_UPDATE if card_id else TrelloOutbox.OP_CREATE
+            await sync_to_async(queue_card_change)(op, payload, card_id=card_id)
 
 
 
@@ -277,6 +560,181 @@ def assign_trello_task(request, card_id=None):
     else:
         return JsonResponse({'error': 'Only POST method allowed'}, status=405)
 
+def _validate_task_spec(spec):
+    """Check one bulk task spec, returns (cleaned spec, errors).
+
+    Creates get defaults for what they leave out. Updates (card_id set) keep
+    only the keys given, so a partial update leaves the other card fields alone.
+    """
+    if not isinstance(spec, dict):
+        return None, ['must be an object']
+    errors = []
+    card_id = spec.get('card_id')
+    cleaned = {'card_id': card_id}
+    title = spec.get('title')
+    if not card_id or 'title' in spec:
+        if not (isinstance(title, str) and title.strip()):
+            errors.append('title is required')
+        cleaned['title'] = title
+    if not card_id or 'description' in spec:
+        cleaned['description'] = spec.get('description') or ''
+    if not card_id or 'members' in spec:
+        members = spec.get('members', [])
+        if not isinstance(members, list) or not all(isinstance(member, str) for member in members):
+            errors.append('members must be a list of Trello member ids')
+        cleaned['members'] = members
+    if not card_id or 'completed' in spec:
+        cleaned['completed'] = bool(spec.get('completed', False))
+    deadline = spec.get('deadline')
+    if deadline:
+        parsed = parse_datetime(deadline) if isinstance(deadline, str) else None
+        if parsed is None:
+            errors.append('deadline must be an ISO 8601 datetime')
+    elif not card_id:
+        parsed = timezone.now() + relativedelta(months=1)
+    else:
+        parsed = None
+    if errors:
+        return None, errors
+    if parsed is not None:
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, dt_timezone.utc)
+        # Send Trello the same instant the task stores, naive input is read as UTC
+        cleaned['deadline'] = parsed.astimezone(dt_timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        cleaned['deadline_at'] = parsed
+    return cleaned, []
+
+
+def _card_update_payload(spec):
+    # Only the fields the spec names, Trello keeps the rest of the card as it is
+    data = {}
+    if 'title' in spec:
+        data['name'] = spec['title']
+    if 'description' in spec:
+        data['desc'] = spec['description']
+    if 'members' in spec:
+        data['idMembers'] = ','.join(spec['members'])
+    if 'completed' in spec:
+        data['idList'] = DONE_LIST_ID if spec['completed'] else LIST_ID
+    if 'deadline' in spec:
+        data['due'] = spec['deadline']
+    return data
+
+
+async def _write_card(spec, semaphore):
+    async with semaphore:
+        try:
+            if spec['card_id']:
+                response = await atrello.put(f"cards/{spec['card_id']}", data=_card_update_payload(spec))
+            else:
+                payload = card_payload(
+                    name=spec['title'],
+                    desc=spec['description'],
+                    due=spec['deadline'],
+                    member_ids=spec['members'],
+                    completed=spec['completed'],
+                )
+                response = await atrello.post("cards", data=payload)
+        except Exception as e:
+            return None, str(e)
+    if response.status_code >= 400:
+        return None, f"Trello returned {response.status_code}: {response.text[:200]}"
+    return response.json(), None
+
+
+def _save_bulk_tasks(written, members_by_id):
+    """Write the Task rows of successfully written cards, new ones in a single bulk_create.
+
+    Fields an update spec left out keep the task's value, or the card's for a
+    card that had no task yet.
+    """
+    card_ids = [card['id'] for _, card in written]
+    existing = {task.trello_card_id: task for task in Task.objects.filter(trello_card_id__in=card_ids)}
+    now = timezone.now()
+    today = now.date()
+    tasks = []
+    for spec, card in written:
+        task = existing.get(card['id'])
+        is_new = task is None
+        if is_new:
+            task = Task(trello_card_id=card['id'], title='', description='')
+        task.updated_at = now  # bulk_update doesn't apply auto_now
+        task.title = card.get('name', spec.get('title', task.title))
+        task.description = card.get('desc', spec.get('description', task.description))
+        if 'deadline_at' in spec:
+            task.deadline = spec['deadline_at']
+        elif is_new:
+            task.deadline = parse_datetime(card['due']) if card.get('due') else None
+        completed = spec.get('completed', card.get('idList') == DONE_LIST_ID if is_new else task.completed)
+        if completed and not task.completed:
+            task.completed_on = today
+        elif not completed:
+            task.completed_on = None
+        task.completed = completed
+        if spec.get('members'):
+            member = members_by_id.get(spec['members'][0], {})
+            task.trello_member_id = spec['members'][0]
+            task.full_name = member.get('fullName', task.full_name)
+            task.user_name = member.get('username', task.user_name)
+        elif 'members' in spec and not is_new:
+            task.trello_member_id = task.full_name = task.user_name = None
+        tasks.append(task)
+    Task.objects.bulk_save(tasks, [
+        'title', 'description', 'deadline', 'completed', 'completed_on',
+        'trello_member_id', 'full_name', 'user_name', 'updated_at',
+    ])
+    return tasks
+
+
+@csrf_exempt
+@require_POST
+async def bulk_tasks_api(request):
+    """Create or update many cards and tasks: POST {"tasks": [{title, description, members, deadline, completed, card_id}, ...]}.
+
+    Every spec is validated before anything is sent. Cards are then written
+    with at most TRELLO_BULK_CONCURRENCY requests in flight, all under the
+    shared Trello rate limit, and the task rows are saved in bulk. Returns
+    one result per spec, in order.
+    """
+    try:
+        specs = json.loads(request.body)['tasks']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Body must be {"tasks": [...]}'}, status=400)
+    if not isinstance(specs, list) or not specs:
+        return JsonResponse({'error': 'tasks must be a non-empty list'}, status=400)
+    if len(specs) > settings.TRELLO_BULK_MAX_ITEMS:
+        return JsonResponse({'error': f'At most {settings.TRELLO_BULK_MAX_ITEMS} tasks per request'}, status=400)
+
+    validated = [_validate_task_spec(spec) for spec in specs]
+    # One spec per card, two would write the card twice and save two task rows for it
+    seen = set()
+    for spec, errors in validated:
+        if spec and spec['card_id']:
+            if spec['card_id'] in seen:
+                errors.append('card_id is repeated in this request')
+            seen.add(spec['card_id'])
+    invalid = [{'index': index, 'errors': errors} for index, (_, errors) in enumerate(validated) if errors]
+    if invalid:
+        return JsonResponse({'error': 'Invalid tasks, nothing was sent', 'invalid': invalid}, status=400)
+
+    members_by_id = {member['id']: member for member in await aget_board_members()}
+    semaphore = asyncio.Semaphore(settings.TRELLO_BULK_CONCURRENCY)
+    cleaned = [spec for spec, _ in validated]
+    outcomes = await asyncio.gather(*(_write_card(spec, semaphore) for spec in cleaned))
+
+    written = [(spec, card) for spec, (card, error) in zip(cleaned, outcomes) if error is None]
+    await sync_to_async(_save_bulk_tasks)(written, members_by_id)
+
+    results = []
+    for index, (spec, (card, error)) in enumerate(zip(cleaned, outcomes)):
+        if error is not None:
+            results.append({'index': index, 'status': 'error', 'card_id': spec['card_id'], 'error': error})
+        else:
+            results.append({'index': index, 'status': 'updated' if spec['card_id'] else 'created', 'card_id': card['id']})
+    failed = sum(1 for result in results if result['status'] == 'error')
+    return JsonResponse({'results': results, 'succeeded': len(results) - failed, 'failed': failed})
+
+
 def task_list(request):
     tasks = Task.objects.all()
     return render(request, 'task_list.html', {'tasks': tasks})
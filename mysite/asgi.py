@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
+
+The Trello-facing API views are async, serve them with e.g.
+``gunicorn mysite.asgi:application -k uvicorn.workers.UvicornWorker``.
 """
 
 import os
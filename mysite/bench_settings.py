@@ -0,0 +1,38 @@
+"""
+Settings for `manage.py bench --settings=mysite.bench_settings`.
+
+Runs against a throwaway SQLite database with every outside service stubbed:
+emails stay in memory, Trello is the local simulator and OpenAI is replaced
+by the benchmark command itself.
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+# The bench command flushes the database between datasets, it refuses to run without this
+BENCHMARK = True
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv("BENCH_DATABASE", str(BASE_DIR / 'bench.sqlite3')),
+    }
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+
+OPENAI_API_KEY = 'bench'
+TRELLO_API_KEY = 'bench'
+TRELLO_API_TOKEN = 'bench'
+TRELLO_BOARD_ID = 'benchboard'
+TRELLO_WEBHOOK_AUTO_REGISTER = False
+# The simulator doesn't rate limit, so neither does the client
+TRELLO_RATE_LIMIT = 1e9
+TRELLO_RATE_BURST = 1000
@@ -27,14 +27,82 @@ EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 EMAIL_HOST_USER = 'muhammad.mehdi@douzetech.com'  # Generic HR or system email
 EMAIL_HOST_PASSWORD = 'Karachi@123'
+# Outbound email queue: messages per SMTP connection, retries, and how long a worker owns a claimed row
+EMAIL_QUEUE_BATCH_SIZE = int(os.getenv("EMAIL_QUEUE_BATCH_SIZE", "50"))
+EMAIL_QUEUE_MAX_ATTEMPTS = int(os.getenv("EMAIL_QUEUE_MAX_ATTEMPTS", "5"))
+EMAIL_QUEUE_CLAIM_SECONDS = int(os.getenv("EMAIL_QUEUE_CLAIM_SECONDS", "300"))
 
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 HUGGINGFACE_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
+# Generated email bodies are reused for identical prompts for this many seconds (0 keeps them forever)
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# Token budgets: one email, and one batched call generating many emails
+LLM_EMAIL_MAX_TOKENS = int(os.getenv("LLM_EMAIL_MAX_TOKENS", "280"))
+LLM_BATCH_MAX_TOKENS = int(os.getenv("LLM_BATCH_MAX_TOKENS", "3000"))
 TRELLO_API_KEY = os.getenv("TRELLO_API_KEY")
 TRELLO_API_TOKEN = os.getenv("TRELLO_API_TOKEN")
 TRELLO_BOARD_ID = os.getenv("TRELLO_BOARD_ID")
 TRELLO_API_URL = 'https://api.trello.com/1'
+TRELLO_WEBHOOK_CALLBACK_URL = os.getenv("TRELLO_WEBHOOK_CALLBACK_URL", "https://your-django-app.com/trello-webhook/")
+# Trello app secret, signs webhook deliveries. Without it payloads only queue a sync and are never applied directly
+TRELLO_API_SECRET = os.getenv("TRELLO_API_SECRET")
+# Check the webhook registration once when the app starts instead of on every delivery. Off by default
+# so tests and one-off commands don't call Trello: enable it on the web workers, or run
+# `manage.py register_trello_webhook` once per deploy
+TRELLO_WEBHOOK_AUTO_REGISTER = os.getenv("TRELLO_WEBHOOK_AUTO_REGISTER", "false").lower() == "true"
+# Webhook bursts inside this window (seconds) collapse into one queued sync
+TRELLO_WEBHOOK_DEBOUNCE = int(os.getenv("TRELLO_WEBHOOK_DEBOUNCE", "5"))
+# A sync holding the lease longer than this (seconds) is considered dead
+TRELLO_SYNC_LEASE = int(os.getenv("TRELLO_SYNC_LEASE", "600"))
+# Shared Trello HTTP client: timeouts (seconds), retries on 429/5xx and a per-process rate limit.
+# Trello allows 100 requests per 10 seconds per token.
+TRELLO_HTTP_TIMEOUT = float(os.getenv("TRELLO_HTTP_TIMEOUT", "10"))
+TRELLO_MAX_RETRIES = int(os.getenv("TRELLO_MAX_RETRIES", "3"))
+# Longest Retry-After (seconds) a retry waits for, a larger value from Trello is cut down to this
+TRELLO_MAX_RETRY_AFTER = float(os.getenv("TRELLO_MAX_RETRY_AFTER", "30"))
+TRELLO_RATE_LIMIT = float(os.getenv("TRELLO_RATE_LIMIT", "9"))
+TRELLO_RATE_BURST = int(os.getenv("TRELLO_RATE_BURST", "20"))
+TRELLO_POOL_SIZE = int(os.getenv("TRELLO_POOL_SIZE", "10"))
+# Board members, lists and member profiles are cached per process
+TRELLO_CACHE_TTL = int(os.getenv("TRELLO_CACHE_TTL", "300"))
+TRELLO_CACHE_MAXSIZE = int(os.getenv("TRELLO_CACHE_MAXSIZE", "1024"))
+# Card changes from the API go through an outbox: rows per flush batch, retries, and how long a flusher owns a claimed row
+TRELLO_OUTBOX_BATCH_SIZE = int(os.getenv("TRELLO_OUTBOX_BATCH_SIZE", "100"))
+TRELLO_OUTBOX_MAX_ATTEMPTS = int(os.getenv("TRELLO_OUTBOX_MAX_ATTEMPTS", "8"))
+TRELLO_OUTBOX_CLAIM_SECONDS = int(os.getenv("TRELLO_OUTBOX_CLAIM_SECONDS", "120"))
+# Bulk task endpoint: cards written at once (still under TRELLO_RATE_LIMIT) and specs per request
+TRELLO_BULK_CONCURRENCY = int(os.getenv("TRELLO_BULK_CONCURRENCY", "5"))
+TRELLO_BULK_MAX_ITEMS = int(os.getenv("TRELLO_BULK_MAX_ITEMS", "500"))
+# The deadline scheduler reloads pending deadlines at least this often (seconds) to see other processes' changes
+DEADLINE_SCHEDULER_MAX_IDLE = int(os.getenv("DEADLINE_SCHEDULER_MAX_IDLE", "300"))
+# ...and checks this often (seconds) for tasks other processes saved since, through Task.updated_at
+DEADLINE_SCHEDULER_POLL_INTERVAL = int(os.getenv("DEADLINE_SCHEDULER_POLL_INTERVAL", "15"))
+# Overdue follow-up reminders handled per after_deadline run
+ESCALATION_BATCH_SIZE = int(os.getenv("ESCALATION_BATCH_SIZE", "200"))
+# Tasks read, emailed and flagged together by the notification scanners
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "200"))
+# Chatbot context: most relevant records considered, and the token budget they must fit in
+CHATBOT_CONTEXT_TOP_K = int(os.getenv("CHATBOT_CONTEXT_TOP_K", "20"))
+CHATBOT_CONTEXT_TOKENS = int(os.getenv("CHATBOT_CONTEXT_TOKENS", "2000"))
+# Built chatbot contexts are reused until the data changes or this many seconds pass
+CHATBOT_CONTEXT_CACHE_TTL = int(os.getenv("CHATBOT_CONTEXT_CACHE_TTL", "600"))
+# The relevance index re-checks the tables at least this often even if no change was signalled
+CHATBOT_INDEX_MAX_AGE = int(os.getenv("CHATBOT_INDEX_MAX_AGE", "300"))
+
+# /metrics needs `Authorization: Bearer <METRICS_TOKEN>` and is off without a token. Each process
+# writes its samples to METRICS_DIR every METRICS_FLUSH_INTERVAL seconds; clear the directory on deploy
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+METRICS_DIR = os.getenv("METRICS_DIR", str(BASE_DIR / '.metrics'))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+# Shared by the web and background worker processes, so a change in one is seen by the others
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv("CACHE_LOCATION", str(BASE_DIR / '.cache')),
+    }
+}
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
@@ -82,6 +150,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'home.metrics.metrics_middleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.security.SecurityMiddleware',